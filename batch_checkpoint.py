@@ -0,0 +1,168 @@
+"""Checkpoints that let an interrupted batch matching run resume.
+
+With ``checkpoint=True`` run_matching_v2 keeps a side file next to its output
+(``<output>.checkpoint``) and appends to it every CHECKPOINT_INTERVAL_SECONDS: the
+number of input rows processed so far plus the query-to-match cache entries added
+since the previous checkpoint. The file is JSON Lines: a header describing the run,
+then one line per checkpoint. A write torn by a crash only loses its own line.
+
+When a run starts with a matching checkpoint (same input file, options and catalog)
+it restores the cache and replays the rows it already processed from it, without
+fuzzy matching them again, so the output is identical to an uninterrupted run. The
+checkpoint is removed once the output is complete.
+
+Settings: HENEDY_CHECKPOINT_INTERVAL (seconds between checkpoints, default 30).
+"""
+import glob
+import json
+import os
+import time
+
+CHECKPOINT_INTERVAL_SECONDS = float(os.environ.get("HENEDY_CHECKPOINT_INTERVAL") or 30)
+CHECKPOINT_SUFFIX = ".checkpoint"
+CHECKPOINT_VERSION = 1
+
+
+def checkpoint_path(output_path):
+    return output_path + CHECKPOINT_SUFFIX
+
+
+def _plain(value):
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _plain(item) for key, item in value.items()}
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def run_fingerprint(input_path, catalog_source, catalog_rows, **options):
+    """Identifies a run: the input file as it is on disk, the catalog and the run options.
+
+    A checkpoint is only reused when this matches exactly, since its cached matches
+    point at catalog rows and its row offset at input rows.
+    """
+    try:
+        stat = os.stat(input_path)
+        input_stat = [stat.st_size, stat.st_mtime_ns]
+    except OSError:
+        input_stat = None
+    return _plain(
+        {
+            "version": CHECKPOINT_VERSION,
+            "input": [os.path.basename(input_path), input_stat],
+            "catalog": [catalog_source, catalog_rows],
+            "options": options,
+        }
+    )
+
+
+class Checkpoint:
+    """The state saved by one run: rows processed, its query cache and its partial queries."""
+
+    def __init__(self, path, fingerprint, output_path, rows_done=0, query_cache=None, partial_queries=None):
+        self.path = path
+        # Bytes of the file up to the end of its last intact line.
+        self.valid_size = 0
+        self.fingerprint = fingerprint
+        self.output_path = output_path
+        self.rows_done = rows_done
+        self.query_cache = {} if query_cache is None else query_cache
+        self.partial_queries = set() if partial_queries is None else partial_queries
+
+
+def load_checkpoint(path):
+    """Reads a checkpoint file; returns None when it is missing or its header is unreadable.
+
+    Only newline-terminated lines count: a crash mid-write leaves at most one torn
+    line at the end, and everything before it is used.
+    """
+    try:
+        with open(path, "rb") as f:
+            lines = f.readlines()
+        header = json.loads(lines[0]) if lines[0].endswith(b"\n") else None
+    except (OSError, IndexError, ValueError):
+        return None
+    if not isinstance(header, dict) or header.get("version") != CHECKPOINT_VERSION:
+        return None
+    checkpoint = Checkpoint(path, header.get("fingerprint"), header.get("output_path"))
+    checkpoint.valid_size = len(lines[0])
+    for line in lines[1:]:
+        if not line.endswith(b"\n"):
+            break
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            break
+        for query, match in entry["cache"].items():
+            checkpoint.query_cache[query] = None if match is None else (match[0], match[1])
+        checkpoint.partial_queries.update(entry["partial"])
+        checkpoint.rows_done = entry["rows"]
+        checkpoint.valid_size += len(line)
+    return checkpoint
+
+
+def find_checkpoint(directory, output_prefix, fingerprint):
+    """The newest checkpoint in ``directory`` for a run with ``fingerprint``, or None."""
+    pattern = os.path.join(glob.escape(directory), glob.escape(output_prefix) + "*" + CHECKPOINT_SUFFIX)
+    for path in sorted(glob.glob(pattern), key=os.path.getmtime, reverse=True):
+        checkpoint = load_checkpoint(path)
+        if checkpoint is not None and checkpoint.fingerprint == fingerprint and checkpoint.output_path:
+            return checkpoint
+    return None
+
+
+class CheckpointWriter:
+    """Appends checkpoints for one run; only cache entries added since the last one are written."""
+
+    def __init__(self, output_path, fingerprint, interval=None, resumed=None):
+        self.path = checkpoint_path(output_path)
+        self.output_path = output_path
+        self.fingerprint = fingerprint
+        self.interval = CHECKPOINT_INTERVAL_SECONDS if interval is None else interval
+        self.rows_saved = resumed.rows_done if resumed is not None else 0
+        self._has_header = resumed is not None and resumed.path == self.path
+        if self._has_header:
+            # Drop a line torn by the previous crash; appending after it would hide every later checkpoint.
+            with open(self.path, "r+b") as f:
+                f.truncate(resumed.valid_size)
+        self._pending_cache = {}
+        self._pending_partial = []
+        self._last_save = time.monotonic()
+
+    def add(self, query, match, partial=False):
+        """Records a newly matched query (``match`` is ``(row_pos, score)`` or None)."""
+        self._pending_cache[query] = None if match is None else [int(match[0]), float(match[1])]
+        if partial:
+            self._pending_partial.append(query)
+
+    def due(self):
+        return time.monotonic() - self._last_save >= self.interval
+
+    def save(self, rows_done):
+        lines = []
+        if not self._has_header:
+            header = {"version": CHECKPOINT_VERSION, "fingerprint": self.fingerprint, "output_path": self.output_path}
+            lines.append(json.dumps(header, ensure_ascii=False))
+        lines.append(
+            json.dumps(
+                {"rows": rows_done, "cache": self._pending_cache, "partial": self._pending_partial},
+                ensure_ascii=False,
+            )
+        )
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(line + "\n" for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+        self._has_header = True
+        self._pending_cache = {}
+        self._pending_partial = []
+        self.rows_saved = rows_done
+        self._last_save = time.monotonic()
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,124 @@
+"""Batch input handling shared by the apps.
+
+A ParsedUpload opens an uploaded workbook once (read-only, streaming) and serves sheet
+names, headers, column previews and the projected table for run_matching_v2 from it,
+converting each sheet and column set at most once. The web app keeps one handle per session,
+keyed by upload_signature (name, size, content hash), so reruns never re-read the file.
+"""
+import hashlib
+import itertools
+import threading
+
+import pandas as pd  # type: ignore
+
+import matcher_v2
+
+
+def upload_signature(name, data):
+    """Returns ``(name, size, sha1)`` for an upload's bytes (bytes, memoryview or buffer)."""
+    view = memoryview(data)
+    return (name, view.nbytes, hashlib.sha1(view).hexdigest())
+
+
+class ParsedUpload:
+    """One batch input file (xlsx, CSV or JSON), read at most once per sheet and column set.
+
+    Workbooks stay open in openpyxl's read-only mode, so headers and previews only
+    stream the first rows and frame() extracts just the requested columns.
+    """
+
+    def __init__(self, path, signature=None):
+        self.path = path
+        self.signature = signature
+        self.is_excel = matcher_v2.is_excel_input(path)
+        self._book = None
+        self._headers = {}
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    @property
+    def sheet_names(self):
+        if not self.is_excel:
+            return []
+        with self._lock:
+            return list(self._open_book().sheetnames)
+
+    def _open_book(self):
+        if self._book is None:
+            self._book = matcher_v2.open_excel_workbook(self.path)
+        return self._book
+
+    def _sheet_key(self, sheet_name):
+        if not self.is_excel:
+            return None
+        if isinstance(sheet_name, int):
+            return self._open_book().sheetnames[sheet_name]
+        return sheet_name
+
+    def _cached_frame(self, key, columns):
+        """A cached frame of this sheet holding ``columns`` (all columns when None)."""
+        full = self._frames.get((key, None))
+        if full is not None:
+            return full if columns is None else full[[column for column in columns if column in full.columns]]
+        return self._frames.get((key, columns))
+
+    def frame(self, sheet_name=0, columns=None):
+        """The sheet (or CSV/JSON table) with stripped column names, limited to ``columns`` for xlsx."""
+        columns = tuple(dict.fromkeys(columns)) if columns is not None and self.is_excel else None
+        with self._lock:
+            key = self._sheet_key(sheet_name)
+            df = self._cached_frame(key, columns)
+            if df is None:
+                if self.is_excel:
+                    rows = matcher_v2.iter_excel_rows(matcher_v2.excel_worksheet(self._open_book(), key), columns)
+                    df = _rows_to_frame(rows, columns or self._sheet_headers(key))
+                else:
+                    df = matcher_v2.read_input_frame(self.path)
+                self._frames[(key, columns)] = df
+            return df
+
+    def _sheet_headers(self, key):
+        headers = self._headers.get(key)
+        if headers is None:
+            if self.is_excel:
+                headers = matcher_v2.read_excel_headers(matcher_v2.excel_worksheet(self._open_book(), key))
+            else:
+                headers = matcher_v2.read_input_frame(self.path).columns.tolist()
+            self._headers[key] = headers
+        return headers
+
+    def headers(self, sheet_name=0):
+        if not self.is_excel:
+            return self.frame().columns.tolist()
+        with self._lock:
+            return list(self._sheet_headers(self._sheet_key(sheet_name)))
+
+    def preview(self, column, sheet_name=0, rows=5):
+        if not self.is_excel:
+            return self.frame()[column].head(rows).astype(str).tolist()
+        with self._lock:
+            key = self._sheet_key(sheet_name)
+            df = self._cached_frame(key, (column,))
+            if df is not None:
+                return df[column].head(rows).astype(str).tolist()
+            worksheet = matcher_v2.excel_worksheet(self._open_book(), key)
+            head = itertools.islice(matcher_v2.iter_excel_rows(worksheet, [column]), rows)
+            return _rows_to_frame(head, [column])[column].astype(str).tolist()
+
+    def close(self):
+        with self._lock:
+            if self._book is not None:
+                self._book.close()
+                self._book = None
+            self._headers.clear()
+            self._frames.clear()
+
+
+def _rows_to_frame(rows, columns):
+    """Builds a DataFrame column by column from streamed row dicts."""
+    columns = list(dict.fromkeys(columns))
+    data = {column: [] for column in columns}
+    for row in rows:
+        for column in columns:
+            data[column].append(row.get(column))
+    return pd.DataFrame(data, columns=columns)
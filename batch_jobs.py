@@ -0,0 +1,214 @@
+"""Server-side queue for batch matching jobs.
+
+The web app submits each "Start Matching" run here instead of running it inside the
+Streamlit script. Jobs run run_matching_v2 on one bounded thread pool shared by every
+session, in submission order, and their status, progress and output live in this
+module rather than in st.session_state: a job keeps running across reruns and page
+reloads, and its output stays downloadable until the job expires.
+
+Settings: HENEDY_BATCH_WORKERS (concurrent jobs, default 1), HENEDY_JOB_DIR (where
+inputs and outputs are kept) and HENEDY_JOB_RETENTION (seconds a finished job is kept).
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import matcher_v2
+
+BATCH_WORKERS = int(os.environ.get("HENEDY_BATCH_WORKERS") or 1)
+JOB_DIR = os.environ.get("HENEDY_JOB_DIR") or os.path.join(tempfile.gettempdir(), "henedy_jobs")
+JOB_RETENTION_SECONDS = float(os.environ.get("HENEDY_JOB_RETENTION") or 3600)
+PREVIEW_ROWS = matcher_v2.BATCH_PREVIEW_ROWS
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = frozenset({DONE, FAILED, CANCELLED})
+
+
+class BatchJob:
+    """One submitted matching run. The worker thread updates it; readers only look."""
+
+    def __init__(self, job_id, owner, input_name, input_path, options, job_path=None):
+        self.id = job_id
+        self.owner = owner
+        self.input_name = input_name
+        self.input_path = input_path
+        self.options = options
+        # The queue's own directory for this job; None when the job runs on the caller's file.
+        self.job_path = job_path
+        self.status = QUEUED
+        self.message = "Waiting for a free worker..."
+        self.done_rows = 0
+        self.total_rows = 0
+        self.error = None
+        self.output_path = None
+        self.preview = None
+        # Latest progress_events.ProgressEvent (throughput, cache hit rate, ETA).
+        self.telemetry = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def finished_state(self):
+        return self.status in FINISHED_STATES
+
+    @property
+    def progress(self):
+        if self.status == DONE:
+            return 1.0
+        return min(1.0, self.done_rows / self.total_rows) if self.total_rows else 0.0
+
+
+class JobQueue:
+    def __init__(self, workers=None, job_dir=None, retention=None):
+        self.job_dir = job_dir or JOB_DIR
+        self.retention = JOB_RETENTION_SECONDS if retention is None else retention
+        self.workers = max(1, workers or BATCH_WORKERS)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="batch-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, source_path, input_name, owner=None, copy_input=True, **options):
+        """Queues run_matching_v2 on ``source_path`` and returns the job id.
+
+        By default the job runs on a private copy and writes its output into its own
+        directory; with ``copy_input=False`` it reads the file in place and writes the
+        output next to it (the desktop wizard). ``options`` are run_matching_v2 keyword
+        arguments (search_col, local_fields, db_fields, output_format, sheet_name,
+        filters, row_deadline).
+        """
+        self.prune()
+        job_id = uuid.uuid4().hex[:12]
+        job_path = None
+        input_path = source_path
+        if copy_input:
+            job_path = os.path.join(self.job_dir, job_id)
+            os.makedirs(job_path, exist_ok=True)
+            # The session's upload file may be replaced while the job waits; keep our own copy.
+            input_path = os.path.join(job_path, os.path.basename(input_name) or "input")
+            shutil.copyfile(source_path, input_path)
+
+        job = BatchJob(job_id, owner, input_name, input_path, options, job_path)
+        with self._lock:
+            self._jobs[job_id] = job
+        job.future = self._pool.submit(self._run, job)
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, owner=None):
+        """Jobs (newest first), limited to ``owner``'s when given."""
+        self.prune()
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if owner is None or job.owner == owner]
+        return sorted(jobs, key=lambda job: job.created, reverse=True)
+
+    def cancel(self, job_id):
+        """Cancels a queued or running job; returns False when it already finished."""
+        job = self.get(job_id)
+        if job is None or job.finished_state:
+            return False
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            self._finish(job, CANCELLED, "Cancelled before it started.")
+        return True
+
+    def remove(self, job_id):
+        """Forgets a finished job and deletes the files the queue created for it."""
+        job = self.get(job_id)
+        if job is None or not job.finished_state:
+            return False
+        with self._lock:
+            self._jobs.pop(job_id, None)
+        if job.job_path:
+            shutil.rmtree(job.job_path, ignore_errors=True)
+        return True
+
+    def prune(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [
+                job.id for job in self._jobs.values() if job.finished_state and now - job.finished > self.retention
+            ]
+        for job_id in expired:
+            self.remove(job_id)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel_event.set()
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    def _finish(self, job, status, message, error=None):
+        job.status = status
+        job.message = message
+        job.error = error
+        job.finished = time.time()
+        if job.job_path:
+            try:
+                os.remove(job.input_path)
+            except OSError:
+                pass
+
+    def _run(self, job):
+        if job.cancel_event.is_set():
+            self._finish(job, CANCELLED, "Cancelled before it started.")
+            return
+        job.status = RUNNING
+        job.started = time.time()
+        job.message = "Starting..."
+
+        def on_progress(done, total):
+            job.done_rows = done
+            job.total_rows = total
+
+        def on_event(event):
+            job.telemetry = event
+
+        def on_status(message):
+            job.message = message
+
+        try:
+            output_path, preview = matcher_v2.run_matching_v2(
+                job.input_path,
+                progress_callback=on_progress,
+                status_callback=on_status,
+                progress_event_callback=on_event,
+                cancel_event=job.cancel_event,
+                **job.options,
+            )
+        except matcher_v2.BatchCancelled:
+            self._finish(job, CANCELLED, f"Cancelled after {job.done_rows} rows.")
+        except Exception as e:
+            self._finish(job, FAILED, "Failed.", error=str(e))
+        else:
+            job.output_path = output_path
+            job.preview = preview
+            elapsed = time.time() - job.started
+            self._finish(job, DONE, f"Matched {preview.attrs['rows']} rows in {elapsed:.1f}s.")
+
+
+_QUEUE = None
+_QUEUE_LOCK = threading.Lock()
+
+
+def get_queue():
+    """The process-wide queue shared by every Streamlit session."""
+    global _QUEUE
+    with _QUEUE_LOCK:
+        if _QUEUE is None:
+            _QUEUE = JobQueue()
+        return _QUEUE
@@ -0,0 +1,77 @@
+"""Compares search-index memory for the legacy per-row sets and the compact layout.
+
+Usage: python bench_index_memory.py [--db path/to/druglist.json]
+"""
+import argparse
+import time
+
+import pandas as pd  # type: ignore
+
+import matcher_v2
+
+
+def build_legacy_index(df):
+    """Rebuilds the pre-compaction layout: plain lists of per-row dicts and sets."""
+    total = len(df)
+
+    def _names(field):
+        # The catalog may be a mapped ColumnarCatalog whose columns are not Series.
+        if field not in df.columns:
+            return pd.Series([""] * total)
+        return matcher_v2._catalog_series(df, field).fillna("").astype(str)
+
+    en_series = _names("name_en")
+    ar_series = _names("name_ar")
+
+    legacy = {"en": [], "ar": [], "id": [], "strength": [], "forms": [], "alpha_tokens": []}
+    for idx, (raw_en, raw_ar) in enumerate(zip(en_series, ar_series)):
+        legacy["en"].append(matcher_v2.clean_for_match(raw_en))
+        legacy["ar"].append(matcher_v2.clean_for_match(raw_ar))
+        legacy["id"].append(idx)
+
+        combined_name = f"{raw_en} {raw_ar}"
+        legacy["strength"].append(matcher_v2._extract_strength_signature(combined_name))
+        legacy["forms"].append(matcher_v2._extract_dosage_forms(combined_name))
+        legacy["alpha_tokens"].append(matcher_v2._extract_alpha_tokens(matcher_v2.clean_for_match(combined_name)))
+    return legacy
+
+
+def _format_row(name, legacy_bytes, compact_bytes, rows):
+    ratio = (legacy_bytes / compact_bytes) if compact_bytes else 0.0
+    return (
+        f"{name:<14}{legacy_bytes / 1024 / 1024:>14.2f}{compact_bytes / 1024 / 1024:>14.2f}"
+        f"{legacy_bytes / max(rows, 1):>14.1f}{compact_bytes / max(rows, 1):>14.1f}{ratio:>8.2f}x"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="Catalog JSON to load instead of the bundled druglist.json")
+    args = parser.parse_args()
+
+    if args.db:
+        matcher_v2.DB_JSON = args.db
+
+    df = matcher_v2.get_master_db()
+    rows = len(df)
+
+    started = time.perf_counter()
+    legacy = build_legacy_index(df)
+    legacy_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    compact = matcher_v2.get_search_names(force_rebuild=True)
+    compact_seconds = time.perf_counter() - started
+
+    legacy_usage = matcher_v2.index_memory_usage(legacy)
+    compact_usage = matcher_v2.index_memory_usage(compact)
+
+    print(f"Catalog rows: {rows}")
+    print(f"Build time: legacy {legacy_seconds:.2f}s, compact {compact_seconds:.2f}s")
+    print(f"{'component':<14}{'legacy MB':>14}{'compact MB':>14}{'legacy B/row':>14}{'compact B/row':>14}{'saving':>9}")
+    for key in legacy_usage:
+        print(_format_row(key, legacy_usage[key], compact_usage.get(key, 0), rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Measures cold-start time-to-interactive with and without the persisted index cache.
+
+Usage: python bench_startup.py [--db path/to/druglist.json] [--runs N]
+
+Each measurement runs in a fresh interpreter. "cold" disables the index cache, "cached"
+reuses the cache written by a priming run. When customtkinter is installed the desktop
+app's module import (everything before the window can be drawn) is timed as well.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_CHILD = r"""
+import json, sys, time
+started = time.perf_counter()
+import startup
+import matcher_v2
+imported = time.perf_counter()
+if sys.argv[1]:
+    matcher_v2.DB_JSON = sys.argv[1]
+matcher_v2.get_master_db()
+catalog = time.perf_counter()
+matcher_v2._warmup_index()
+index = time.perf_counter()
+matcher_v2.search_live("concor 5mg", limit=10)
+query = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "catalog": catalog - started,
+    "index": index - started,
+    "first_query": query - started,
+}))
+"""
+
+_UI_CHILD = r"""
+import json, time
+started = time.perf_counter()
+import drug_wizard
+print(json.dumps({"ui_import": time.perf_counter() - started, "matcher_imported": drug_wizard.matcher_v2.loaded}))
+"""
+
+
+def _run_child(code, args, env):
+    output = subprocess.run(
+        [sys.executable, "-c", code, *args], cwd=HERE, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _measure(db_path, runs, cache_setting):
+    env = dict(os.environ)
+    env.pop("HENEDY_SHARED_INDEX_DIR", None)
+    if cache_setting:
+        env["HENEDY_INDEX_CACHE"] = cache_setting
+    samples = [_run_child(_CHILD, [db_path or ""], env) for _ in range(runs)]
+    return {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="Catalog JSON to load instead of the bundled druglist.json")
+    parser.add_argument("--runs", type=int, default=3, help="runs per scenario (median is reported)")
+    args = parser.parse_args()
+
+    results = {"cold": _measure(args.db, args.runs, "off")}
+    _measure(args.db, 1, None)  # Prime the index cache.
+    results["cached"] = _measure(args.db, args.runs, None)
+
+    print(f"{'seconds since start':<22}{'cold':>10}{'cached':>10}")
+    for key in ("import", "catalog", "index", "first_query"):
+        print(f"{key:<22}{results['cold'][key]:>10.2f}{results['cached'][key]:>10.2f}")
+
+    try:
+        ui = _run_child(_UI_CHILD, [], dict(os.environ))
+    except subprocess.CalledProcessError:
+        print("\nDesktop UI import not measured (customtkinter or a display is unavailable).")
+    else:
+        lazy = "deferred" if not ui["matcher_imported"] else "eager"
+        print(f"\nDesktop UI module import: {ui['ui_import']:.2f}s (matcher import {lazy})")
+
+
+if __name__ == "__main__":
+    main()
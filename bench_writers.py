@@ -0,0 +1,100 @@
+"""Compares batch output writers on a synthetic matching result.
+
+Usage: python bench_writers.py [--rows N] [--formats xlsx,csv,...] [--skip-legacy] [--memory]
+
+Each incremental writer gets the same rows one at a time, as run_matching_v2 feeds
+them. The legacy rows time the old path (build a DataFrame, then to_excel /
+to_json(indent=2)). Wall time and file size are reported; ``--memory`` repeats each
+case under tracemalloc (much slower) to report its allocation peak.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd  # type: ignore
+
+import result_writers
+
+COLUMNS = ["Item Code", "search_query", "match_found", "match_score", "name_en", "price_retail", "barcode_primary"]
+
+
+def _rows(count):
+    for i in range(count):
+        found = i % 7 != 0
+        yield {
+            "Item Code": f"SUP-{i:07d}",
+            "search_query": f"concor {i % 500} mg tab",
+            "match_found": f"Concor {i % 500}mg 30 tab" if found else "No Match Found",
+            "match_score": 90.0 + (i % 10) / 2 if found else 0,
+            "name_en": f"Concor {i % 500}mg 30 tab" if found else None,
+            "price_retail": 25.5 + i % 300 if found else None,
+            "barcode_primary": f"622{i:010d}" if found else None,
+        }
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def _traced_peak(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _incremental(path, output_format, count):
+    def run():
+        writer = result_writers.open_result_writer(path, output_format, COLUMNS)
+        for row in _rows(count):
+            writer.write(row)
+        writer.close()
+
+    return run
+
+
+def _legacy(path, output_format, count):
+    def run():
+        final_df = pd.DataFrame(list(_rows(count)))
+        if output_format == "xlsx":
+            final_df.to_excel(path, index=False)
+        else:
+            final_df.to_json(path, orient="records", force_ascii=False, indent=2)
+
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--formats", default=",".join(result_writers.OUTPUT_FORMATS))
+    parser.add_argument("--skip-legacy", action="store_true", help="skip the old to_excel/to_json baseline")
+    parser.add_argument("--memory", action="store_true", help="also report tracemalloc peaks (slow)")
+    args = parser.parse_args()
+
+    formats = [fmt for fmt in args.formats.split(",") if fmt]
+    cases = [(fmt, fmt, _incremental) for fmt in formats]
+    if not args.skip_legacy:
+        cases += [(f"legacy {fmt}", fmt, _legacy) for fmt in ("xlsx", "json") if fmt in formats]
+
+    print(f"{args.rows} rows x {len(COLUMNS)} columns")
+    print(f"{'writer':<14}{'seconds':>10}{'rows/s':>12}{'file MB':>10}{'peak MB' if args.memory else '':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, fmt, factory in cases:
+            path = os.path.join(tmp, f"{label.replace(' ', '_')}.{result_writers.output_extension(fmt)}")
+            run = factory(path, fmt, args.rows)
+            elapsed = _timed(run)
+            size = os.path.getsize(path)
+            peak = f"{_traced_peak(run) / 1024 / 1024:.1f}" if args.memory else ""
+            os.remove(path)
+            print(f"{label:<14}{elapsed:>10.2f}{args.rows / elapsed:>12.0f}{size / 1024 / 1024:>10.1f}{peak:>10}")
+
+
+if __name__ == "__main__":
+    main()
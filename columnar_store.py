@@ -0,0 +1,475 @@
+"""Versioned, memory-mapped columnar snapshots of the catalog and search index.
+
+A builder process writes each snapshot into its own ``v<version>`` directory and then
+atomically repoints ``CURRENT`` at it. Readers map the ``.npy`` files read-only, so every
+process attached to the same version shares one copy of the pages through the OS cache,
+and readers still holding an older version keep working until they re-attach.
+
+The catalog alone can also be compiled into a single ``.columns`` file (a JSON manifest
+followed by aligned column blocks, optionally gzip/lzma compressed per column) that loads
+without parsing druglist.json; see compile_catalog and open_catalog.
+
+Usage: python columnar_store.py publish [--root DIR] [--db path/to/druglist.json]
+       python columnar_store.py compile [--db path/to/druglist.json] [--out FILE] [--compression gzip|lzma]
+"""
+import functools
+import gzip
+import json
+import lzma
+import os
+import pickle
+import shutil
+import struct
+import time
+from collections.abc import Mapping
+
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+MANIFEST_NAME = "manifest.json"
+CURRENT_NAME = "CURRENT"
+FORMAT_VERSION = 1
+
+CATALOG_MAGIC = b"HDCOLS1\n"
+CATALOG_ALIGN = 64
+COMPRESSORS = {
+    "gzip": (functools.partial(gzip.compress, compresslevel=6), gzip.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+
+class StringColumn:
+    """UTF-8 string heap plus an offsets table; rows are decoded only when accessed."""
+
+    __slots__ = ("offsets", "heap", "nulls")
+
+    def __init__(self, offsets, heap, nulls=None):
+        self.offsets = offsets
+        self.heap = heap
+        self.nulls = nulls
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if self.nulls is not None and self.nulls[idx]:
+            return None
+        start = int(self.offsets[idx])
+        end = int(self.offsets[idx + 1])
+        return self.heap[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[idx] for idx in range(len(self)))
+
+    def tolist(self):
+        return list(self)
+
+
+class _RowIndexer:
+    __slots__ = ("_catalog",)
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+
+    def __getitem__(self, row_pos):
+        return self._catalog.row(row_pos)
+
+
+class ColumnarCatalog:
+    """Read-only catalog backed by mapped columns.
+
+    Supports the subset of the DataFrame API the apps use on the master table:
+    ``len()``, ``empty``, ``columns``, ``iloc[row]`` (returning a dict) and ``to_frame()``.
+    """
+
+    def __init__(self, columns, rows=None, mapped=True):
+        self._columns = columns
+        self._names = list(columns)
+        if rows is None:
+            rows = len(next(iter(columns.values()))) if columns else 0
+        self._rows = rows
+        self.iloc = _RowIndexer(self)
+        # Pages shared with other processes through the OS cache (False once decompressed).
+        self.mapped = mapped
+        self.attrs = {}
+
+    @property
+    def columns(self):
+        return pd.Index(self._names)
+
+    @property
+    def empty(self):
+        return self._rows == 0 or not self._names
+
+    def __len__(self):
+        return self._rows
+
+    def __getitem__(self, column):
+        return self._columns[column]
+
+    def get(self, column, default=None):
+        return self._columns.get(column, default)
+
+    def row(self, row_pos, columns=None):
+        names = self._names if columns is None else [name for name in columns if name in self._columns]
+        return {name: _scalar(self._columns[name][row_pos]) for name in names}
+
+    def to_frame(self, columns=None):
+        names = self._names if columns is None else [name for name in columns if name in self._columns]
+        data = {}
+        for name in names:
+            column = self._columns[name]
+            data[name] = column.tolist() if isinstance(column, StringColumn) else np.asarray(column)
+        return pd.DataFrame(data)
+
+
+def _scalar(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _load_array(path, mmap_mode="r"):
+    try:
+        return np.load(path, mmap_mode=mmap_mode)
+    except ValueError:
+        # Zero-length arrays cannot be mapped.
+        return np.load(path)
+
+
+def _string_arrays(values):
+    """Encodes values as a UTF-8 heap, row offsets and (if any) a null mask."""
+    encoded = []
+    nulls = np.zeros(len(values), dtype=bool)
+    for idx, value in enumerate(values):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            nulls[idx] = True
+            encoded.append(b"")
+            continue
+        encoded.append(str(value).encode("utf-8"))
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        np.cumsum([len(chunk) for chunk in encoded], out=offsets[1:])
+    arrays = {"offsets": offsets, "heap": np.frombuffer(b"".join(encoded), dtype=np.uint8)}
+    if nulls.any():
+        arrays["nulls"] = nulls
+    return arrays
+
+
+def _write_string_column(directory, name, values):
+    arrays = _string_arrays(values)
+    for key, array_data in arrays.items():
+        np.save(os.path.join(directory, f"{name}.{key}.npy"), array_data)
+    return {"name": name, "kind": "string", "nulls": "nulls" in arrays}
+
+
+def _read_string_column(directory, spec, mmap_mode="r"):
+    name = spec["name"]
+    offsets = _load_array(os.path.join(directory, f"{name}.offsets.npy"), mmap_mode)
+    heap = _load_array(os.path.join(directory, f"{name}.heap.npy"), mmap_mode)
+    nulls = None
+    if spec.get("nulls"):
+        nulls = _load_array(os.path.join(directory, f"{name}.nulls.npy"), mmap_mode)
+    return StringColumn(offsets, heap, nulls)
+
+
+def write_columns(directory, frame, prefix="col"):
+    """Writes every DataFrame column as a numeric array or string heap; returns the specs."""
+    specs = []
+    for position, column in enumerate(frame.columns):
+        file_stem = f"{prefix}{position}"
+        series = frame[column]
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            np.save(os.path.join(directory, f"{file_stem}.npy"), series.to_numpy())
+            spec = {"name": file_stem, "kind": "numeric"}
+        else:
+            spec = _write_string_column(directory, file_stem, series.tolist())
+        spec["column"] = str(column)
+        specs.append(spec)
+    return specs
+
+
+def read_columns(directory, specs, mmap_mode="r"):
+    """Maps the columns described by ``specs`` and returns them keyed by column name."""
+    columns = {}
+    for spec in specs:
+        if spec["kind"] == "numeric":
+            columns[spec["column"]] = _load_array(os.path.join(directory, f"{spec['name']}.npy"), mmap_mode)
+        else:
+            columns[spec["column"]] = _read_string_column(directory, spec, mmap_mode=mmap_mode)
+    return columns
+
+
+def compile_catalog(frame, path, source=None, compression=None):
+    """Writes ``frame`` as a single columnar catalog file and returns its manifest.
+
+    Numeric columns are stored as raw arrays, everything else as a UTF-8 heap plus
+    offsets. Uncompressed files are memory-mapped on load; with ``compression``
+    ("gzip" or "lzma") each column block is compressed on its own so only the
+    columns actually used get decompressed. ``source`` is stored for staleness checks.
+    """
+    if compression is not None and compression not in COMPRESSORS:
+        raise ValueError(f"Unknown compression {compression!r}; expected one of {sorted(COMPRESSORS)}")
+    compress = COMPRESSORS[compression][0] if compression else None
+
+    blocks = []
+    columns = []
+    position = 0
+    for column in frame.columns:
+        series = frame[column]
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            kind, arrays = "numeric", {"values": np.ascontiguousarray(series.to_numpy())}
+        else:
+            kind, arrays = "string", _string_arrays(series.tolist())
+        specs = {}
+        for name, array_data in arrays.items():
+            payload = array_data.tobytes()
+            stored = compress(payload) if compress else payload
+            padding = -position % CATALOG_ALIGN
+            position += padding
+            specs[name] = {
+                "offset": position,
+                "length": len(stored),
+                "dtype": array_data.dtype.str,
+                "count": int(array_data.size),
+            }
+            blocks.append((padding, stored))
+            position += len(stored)
+        columns.append({"column": str(column), "kind": kind, "arrays": specs})
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "rows": len(frame),
+        "source": source,
+        "compression": compression,
+        "created": time.time(),
+        "columns": columns,
+    }
+    header = json.dumps(manifest, ensure_ascii=False).encode("utf-8")
+    prefix_length = len(CATALOG_MAGIC) + 8 + len(header)
+    data_start = prefix_length + (-prefix_length % CATALOG_ALIGN)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(CATALOG_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.write(b"\0" * (data_start - prefix_length))
+        for padding, stored in blocks:
+            f.write(b"\0" * padding)
+            f.write(stored)
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def read_catalog_manifest(path):
+    """Returns ``(manifest, data_start)`` from a compiled catalog header."""
+    with open(path, "rb") as f:
+        if f.read(len(CATALOG_MAGIC)) != CATALOG_MAGIC:
+            raise ValueError(f"Not a compiled catalog: {path}")
+        (header_length,) = struct.unpack("<Q", f.read(8))
+        manifest = json.loads(f.read(header_length).decode("utf-8"))
+    if manifest.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported catalog format {manifest.get('format')} in {path}")
+    prefix_length = len(CATALOG_MAGIC) + 8 + header_length
+    return manifest, prefix_length + (-prefix_length % CATALOG_ALIGN)
+
+
+class _CompiledColumns(Mapping):
+    """Column name -> column, materialized (mapped or decompressed) on first access."""
+
+    def __init__(self, path, manifest, data_start):
+        self._specs = {spec["column"]: spec for spec in manifest["columns"]}
+        self._decompress = COMPRESSORS[manifest["compression"]][1] if manifest.get("compression") else None
+        self._data_start = data_start
+        self._buffer = None
+        self._path = path
+        self._loaded = {}
+
+    def _raw(self):
+        if self._buffer is None:
+            if self._decompress:
+                with open(self._path, "rb") as f:
+                    self._buffer = f.read()
+            elif os.path.getsize(self._path) > self._data_start:
+                self._buffer = np.memmap(self._path, dtype=np.uint8, mode="r")
+            else:
+                self._buffer = b""
+        return self._buffer
+
+    def _array(self, spec):
+        start = self._data_start + spec["offset"]
+        dtype = np.dtype(spec["dtype"])
+        if self._decompress:
+            payload = self._decompress(bytes(self._raw()[start : start + spec["length"]]))
+            return np.frombuffer(payload, dtype=dtype, count=spec["count"])
+        if not spec["count"]:
+            return np.empty(0, dtype=dtype)
+        return np.frombuffer(self._raw(), dtype=dtype, count=spec["count"], offset=start)
+
+    def __getitem__(self, name):
+        column = self._loaded.get(name)
+        if column is None:
+            spec = self._specs[name]
+            arrays = {key: self._array(array_spec) for key, array_spec in spec["arrays"].items()}
+            if spec["kind"] == "numeric":
+                column = arrays["values"]
+            else:
+                column = StringColumn(arrays["offsets"], arrays["heap"], arrays.get("nulls"))
+            column = self._loaded.setdefault(name, column)
+        return column
+
+    def __iter__(self):
+        return iter(self._specs)
+
+    def __len__(self):
+        return len(self._specs)
+
+
+def open_catalog(path):
+    """Opens a compiled catalog as a ColumnarCatalog; ``attrs["manifest"]`` holds its header."""
+    manifest, data_start = read_catalog_manifest(path)
+    catalog = ColumnarCatalog(
+        _CompiledColumns(path, manifest, data_start),
+        rows=manifest["rows"],
+        mapped=not manifest.get("compression"),
+    )
+    catalog.attrs["manifest"] = manifest
+    return catalog
+
+
+def current_version(root):
+    """Returns the published version name, or None when nothing has been published."""
+    try:
+        with open(os.path.join(root, CURRENT_NAME), "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    return version or None
+
+
+def publish_snapshot(root, catalog_df, index_parts, source=None, keep=2):
+    """Writes a new snapshot version and atomically makes it current.
+
+    ``index_parts`` maps index component names either to a list of strings, to a
+    ``(codes, table)`` pair of per-row uint32 codes and their table of unique values, or
+    to a dict (a prebuilt lookup such as token -> rows), which is pickled as is.
+    The newest ``keep`` versions are retained so readers on older versions can finish.
+    """
+    os.makedirs(root, exist_ok=True)
+    version = f"v{time.time_ns()}"
+    staging = os.path.join(root, f".{version}.tmp")
+    os.makedirs(staging)
+
+    catalog_specs = write_columns(staging, catalog_df, prefix="catalog_")
+
+    index_specs = {}
+    tables = {}
+    for key, part in index_parts.items():
+        if isinstance(part, tuple):
+            codes, table = part
+            np.save(os.path.join(staging, f"index_{key}.codes.npy"), np.asarray(codes, dtype=np.uint32))
+            tables[key] = table
+            index_specs[key] = {"kind": "coded"}
+        elif isinstance(part, dict):
+            tables[key] = part
+            index_specs[key] = {"kind": "pickled"}
+        else:
+            index_specs[key] = _write_string_column(staging, f"index_{key}", part)
+    with open(os.path.join(staging, "index_tables.pkl"), "wb") as f:
+        pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "version": version,
+        "created": time.time(),
+        "rows": len(catalog_df),
+        "source": source,
+        "catalog": catalog_specs,
+        "index": index_specs,
+    }
+    with open(os.path.join(staging, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    final_dir = os.path.join(root, version)
+    os.replace(staging, final_dir)
+
+    pointer_tmp = os.path.join(root, f".{CURRENT_NAME}.{version}.tmp")
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(root, CURRENT_NAME))
+
+    _prune_versions(root, keep=keep)
+    return version
+
+
+def _prune_versions(root, keep):
+    versions = sorted(
+        (name for name in os.listdir(root) if name.startswith("v") and os.path.isdir(os.path.join(root, name))),
+        key=lambda name: int(name[1:]) if name[1:].isdigit() else 0,
+    )
+    for name in versions[:-keep] if keep > 0 else versions:
+        try:
+            shutil.rmtree(os.path.join(root, name))
+        except OSError:
+            # Mapped files cannot be removed on Windows while a reader holds them.
+            pass
+
+
+def attach_snapshot(root, version=None):
+    """Maps a published snapshot read-only.
+
+    Returns ``(version, catalog, index_parts)`` where ``catalog`` is a ColumnarCatalog and
+    ``index_parts`` mirrors what was passed to publish_snapshot, with mapped arrays.
+    """
+    version = version or current_version(root)
+    if version is None:
+        raise FileNotFoundError(f"No published index snapshot in {root}")
+
+    directory = os.path.join(root, version)
+    with open(os.path.join(directory, MANIFEST_NAME), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format {manifest.get('format')} in {directory}")
+
+    catalog = ColumnarCatalog(read_columns(directory, manifest["catalog"]))
+
+    with open(os.path.join(directory, "index_tables.pkl"), "rb") as f:
+        tables = pickle.load(f)
+    index_parts = {}
+    for key, spec in manifest["index"].items():
+        if spec["kind"] == "coded":
+            codes = _load_array(os.path.join(directory, f"index_{key}.codes.npy"))
+            index_parts[key] = (codes, tables[key])
+        elif spec["kind"] == "pickled":
+            index_parts[key] = tables[key]
+        else:
+            index_parts[key] = _read_string_column(directory, spec)
+    return version, catalog, index_parts
+
+
+def main():
+    import argparse
+
+    import matcher_v2
+
+    parser = argparse.ArgumentParser(description="Publish a shared snapshot or compile the catalog to columnar form.")
+    parser.add_argument("command", choices=["publish", "compile"])
+    parser.add_argument("--root", help="Snapshot directory (defaults to HENEDY_SHARED_INDEX_DIR or ./index_store)")
+    parser.add_argument("--db", help="Catalog JSON to load instead of the bundled druglist.json")
+    parser.add_argument("--out", help="Compiled catalog path (defaults to <catalog>.columns)")
+    parser.add_argument("--compression", choices=sorted(COMPRESSORS), help="compress each column block")
+    args = parser.parse_args()
+
+    if args.db:
+        matcher_v2.DB_JSON = args.db
+    if args.command == "compile":
+        path = matcher_v2.compile_catalog(args.out, compression=args.compression, status_callback=print)
+        print(f"Compiled {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+        return
+    version = matcher_v2.publish_shared_index(root=args.root, status_callback=print)
+    print(f"Published {version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,25 @@
+# startup comes first: importing it starts the time-to-interactive clock.
+import startup # type: ignore
 import customtkinter as ctk # type: ignore
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from typing import Optional
-import json
 import threading
+import time
 import os
-import matcher_v2 # type: ignore
+import progress_events # type: ignore
+import result_writers # type: ignore
+import search_metrics # type: ignore
+
+# pandas/rapidfuzz are imported in the background once the window is up; the first
+# matcher call from the UI waits for that import if it has not finished yet.
+matcher_v2 = startup.LazyModule("matcher_v2")
+batch_jobs = startup.LazyModule("batch_jobs")
+result_grid = startup.LazyModule("result_grid")
+
+# Files matched at the same time; they share the one in-memory search index.
+WIZARD_WORKERS = int(os.environ.get("HENEDY_WIZARD_WORKERS") or max(2, min(4, os.cpu_count() or 1)))
+JOB_POLL_MS = 500
 
 # --- Theme Configuration ---
 def load_initial_theme():
@@ -22,23 +36,27 @@ class DrugWizardApp(ctk.CTk):
         # Window Setup
         self.title("Drug Matched Pro")
         self.geometry("900x700")
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
         
         # Grid Configuration
         self.grid_columnconfigure(1, weight=1)
         self.grid_rowconfigure(0, weight=1)
 
         # Config & State
-        self.base_path = matcher_v2.get_base_path()
+        self.base_path = startup.get_base_path()
         self.config_path = os.path.join(self.base_path, 'config.json')
         self.db_fields = self.load_db_fields()
         
         # Wizard State
-        self.input_file = ""
+        self.input_files = []
         self.headers = []
         self.selected_local_fields = []
         self.selected_db_fields = []
         self.search_column_var = ctk.StringVar()
         self.format_var = ctk.StringVar(value="xlsx")
+        self.job_queue = None
+        self.active_jobs = {}
+        self.run_started = None
         
         # Search State
         self.search_results = []
@@ -48,6 +66,11 @@ class DrugWizardApp(ctk.CTk):
         self.tree: Optional[ttk.Treeview] = None
         self.context_menu: Optional[tk.Menu] = None
         
+        # Result Viewer State
+        self.result_view = None
+        self.result_path = ""
+        self.result_grid = None
+        
         # --- UI Layout ---
         self.create_sidebar()
         self.create_main_area()
@@ -55,15 +78,20 @@ class DrugWizardApp(ctk.CTk):
         # Start at Wizard
         self.show_wizard()
 
+        # Build the search index while the user is still picking a file
+        startup.mark("ui_ready")
+        matcher_v2.preload(callback=self._start_backend)
+        search_metrics.start_from_env()
+
+    def _start_backend(self, matcher):
+        startup.mark("matcher_imported")
+        matcher.start_catalog_watcher(status_callback=lambda x: print(x))
+        matcher.start_background_warmup(status_callback=lambda x: print(x)).join()
+        startup.mark("search_ready")
+        print(f"Startup: {startup.format_marks()}")
+
     def load_db_fields(self):
-        if not os.path.exists(self.config_path):
-            return []
-        try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get('fields', [])
-        except:
-            return []
+        return startup.load_config_fields(self.config_path)
 
     def create_sidebar(self):
         self.sidebar = ctk.CTkFrame(self, width=160, corner_radius=0)
@@ -82,6 +110,9 @@ class DrugWizardApp(ctk.CTk):
         self.btn_search = ctk.CTkButton(self.sidebar, text="Manual Search", command=self.show_search)
         self.btn_search.grid(row=3, column=0, padx=20, pady=10)
         
+        self.btn_results = ctk.CTkButton(self.sidebar, text="Result Viewer", command=self.show_results)
+        self.btn_results.grid(row=4, column=0, padx=20, pady=10)
+        
         # Theme Switcher
         lbl_theme = ctk.CTkLabel(self.sidebar, text="Appearance:", anchor="w")
         lbl_theme.grid(row=7, column=0, padx=20, pady=(10, 0))
@@ -118,7 +149,7 @@ class DrugWizardApp(ctk.CTk):
         
     def _reload_db_thread(self):
         try:
-            matcher_v2.get_master_db(status_callback=lambda x: print(x), force_reload=True)
+            matcher_v2.reload_search_index(status_callback=lambda x: print(x))
             self.after(0, lambda: messagebox.showinfo("Success", "Database loaded/reloaded successfully!"))
         except Exception as e:
             err_msg = f"Failed to load DB: {e}"
@@ -131,16 +162,17 @@ class DrugWizardApp(ctk.CTk):
         self.clear_main()
         self.btn_wizard.configure(fg_color=("gray75", "gray25")) # Active look
         self.btn_search.configure(fg_color="#3a7ebf") # Default ctk blue
+        self.btn_results.configure(fg_color="#3a7ebf")
         self.wizard_step_1()
 
     def wizard_step_1(self):
         self.clear_main()
-        ctk.CTkLabel(self.main_frame, text="Step 1: Upload File", font=ctk.CTkFont(size=24, weight="bold")).pack(pady=(10, 5))
+        ctk.CTkLabel(self.main_frame, text="Step 1: Upload Files", font=ctk.CTkFont(size=24, weight="bold")).pack(pady=(10, 5))
         
         self.file_card = ctk.CTkFrame(self.main_frame)
         self.file_card.pack(fill="x", pady=20)
         
-        self.file_label = ctk.CTkLabel(self.file_card, text=self.input_file if self.input_file else "No file selected")
+        self.file_label = ctk.CTkLabel(self.file_card, text=self._describe_files() if self.input_files else "No file selected")
         self.file_label.pack(pady=10)
         
         ctk.CTkButton(self.file_card, text="Browse", command=self.browse_file).pack(pady=10)
@@ -153,17 +185,31 @@ class DrugWizardApp(ctk.CTk):
             
         ctk.CTkButton(self.main_frame, text="Next ->", command=self.wizard_step_2).pack(side="bottom", anchor="e")
 
+    def _describe_files(self):
+        names = [os.path.basename(path) for path in self.input_files]
+        if len(names) == 1:
+            return f"Selected: {names[0]}"
+        shown = ", ".join(names[:3]) + (f" and {len(names) - 3} more" if len(names) > 3 else "")
+        return f"Selected {len(names)} files: {shown}"
+
     def browse_file(self):
-        filename = filedialog.askopenfilename(filetypes=[("Data Files", "*.xlsx *.csv")])
-        if filename:
-            self.input_file = filename
-            basename = os.path.basename(filename)
-            self.file_label.configure(text=f"Selected: {basename}", text_color="green")
+        filenames = filedialog.askopenfilenames(filetypes=[("Data Files", "*.xlsx *.csv")])
+        if filenames:
             try:
-                self.headers = matcher_v2.get_file_headers(filename)
-                self.build_mapping_options()
+                # One column mapping is shared by every file, so offer the columns they all have.
+                per_file = [matcher_v2.get_file_headers(filename) for filename in filenames]
             except Exception as e:
                 messagebox.showerror("Error", str(e))
+                return
+            common = set(per_file[0]).intersection(*per_file[1:])
+            headers = [header for header in per_file[0] if header in common]
+            if not headers:
+                messagebox.showerror("Error", "The selected files have no column names in common.")
+                return
+            self.input_files = list(filenames)
+            self.headers = headers
+            self.file_label.configure(text=self._describe_files(), text_color="green")
+            self.build_mapping_options()
 
     def build_mapping_options(self):
         for w in self.mapping_frame.winfo_children(): w.destroy()
@@ -209,8 +255,24 @@ class DrugWizardApp(ctk.CTk):
         self.clear_main()
         ctk.CTkLabel(self.main_frame, text="Step 3: Export", font=ctk.CTkFont(size=24, weight="bold")).pack(pady=10)
         
-        ctk.CTkRadioButton(self.main_frame, text="Excel", variable=self.format_var, value="xlsx").pack(pady=5)
-        ctk.CTkRadioButton(self.main_frame, text="JSON", variable=self.format_var, value="json").pack(pady=5)
+        for fmt, (label, _, _) in result_writers.OUTPUT_FORMATS.items():
+            ctk.CTkRadioButton(self.main_frame, text=label, variable=self.format_var, value=fmt).pack(pady=5)
+        
+        # One row per input file: name, progress bar and status.
+        files_frame = ctk.CTkScrollableFrame(self.main_frame, height=180, label_text="Files")
+        files_frame.pack(fill="x", pady=10)
+        files_frame.grid_columnconfigure(1, weight=1)
+        self.file_rows = {}
+        for i, path in enumerate(self.input_files):
+            ctk.CTkLabel(files_frame, text=os.path.basename(path), anchor="w").grid(row=i, column=0, sticky="w", padx=5)
+            bar = ctk.CTkProgressBar(files_frame)
+            bar.grid(row=i, column=1, sticky="ew", padx=5, pady=4)
+            bar.set(0)
+            label = ctk.CTkLabel(files_frame, text="Ready", anchor="w")
+            label.grid(row=i, column=2, sticky="w", padx=5)
+            view = ctk.CTkButton(files_frame, text="View", width=60, state="disabled")
+            view.grid(row=i, column=3, padx=5)
+            self.file_rows[path] = (bar, label, view)
         
         self.prog = ctk.CTkProgressBar(self.main_frame)
         self.prog.pack(fill="x", pady=20)
@@ -219,40 +281,103 @@ class DrugWizardApp(ctk.CTk):
         self.status = ctk.CTkLabel(self.main_frame, text="Ready")
         self.status.pack()
         
-        ctk.CTkButton(self.main_frame, text="Run", command=self.run_wizard).pack(pady=20)
+        buttons = ctk.CTkFrame(self.main_frame, fg_color="transparent")
+        buttons.pack(pady=20)
+        self.btn_run = ctk.CTkButton(buttons, text="Run", command=self.run_wizard)
+        self.btn_run.pack(side="left", padx=5)
+        ctk.CTkButton(buttons, text="Cancel", command=self.cancel_wizard, fg_color="gray").pack(side="left", padx=5)
         ctk.CTkButton(self.main_frame, text="Back", command=self.wizard_step_2, fg_color="gray").pack(side="bottom", anchor="w")
 
+    def _get_job_queue(self):
+        # One pool for every run of the wizard; all workers search the same loaded index.
+        if self.job_queue is None:
+            self.job_queue = batch_jobs.JobQueue(workers=WIZARD_WORKERS)
+        return self.job_queue
+
     def run_wizard(self):
-        self.status.configure(text="Processing...")
-        threading.Thread(target=self.worker_run, daemon=True).start()
+        if any(not job.finished_state for job in self.active_jobs.values()):
+            return
+        queue = self._get_job_queue()
+        options = {
+            "search_col": self.search_column_var.get(),
+            "local_fields": self.selected_local_fields,
+            "db_fields": self.selected_db_fields,
+            "output_format": self.format_var.get(),
+            # A run cut short (cancelled, app closed, crashed) resumes from its checkpoint next time.
+            "checkpoint": True,
+        }
+        # Each file is matched in place and its output is written next to it as soon as it finishes.
+        self.active_jobs = {
+            path: queue.get(queue.submit(path, os.path.basename(path), copy_input=False, **options))
+            for path in self.input_files
+        }
+        self.run_started = time.time()
+        self.btn_run.configure(state="disabled")
+        self.status.configure(text=f"Processing {len(self.active_jobs)} files on {queue.workers} workers...")
+        self.after(JOB_POLL_MS, self._poll_jobs)
 
-    def _threadsafe_set_progress(self, current, total):
-        ratio = (current / total) if total else 0
-        ratio = max(0, min(1, ratio))
-        self.after(0, lambda r=ratio: self.prog.set(r))
+    def on_close(self):
+        # Stop running jobs at their next row; their checkpoints stay for the next run.
+        if self.job_queue is not None:
+            self.job_queue.shutdown(wait=False)
+        self.destroy()
 
-    def _threadsafe_set_status(self, message, color=None):
-        def _update():
-            kwargs = {"text": message}
-            if color is not None:
-                kwargs["text_color"] = color
-            self.status.configure(**kwargs)
+    def cancel_wizard(self):
+        if self.job_queue is None:
+            return
+        for job in self.active_jobs.values():
+            self.job_queue.cancel(job.id)
 
-        self.after(0, _update)
+    def _job_text(self, job):
+        if job.status == batch_jobs.QUEUED:
+            return "Queued", None
+        if job.status == batch_jobs.RUNNING:
+            event = job.telemetry
+            if event is None:
+                return f"Running {job.done_rows}/{job.total_rows}", None
+            eta = event.eta_seconds
+            eta_text = f" \u00b7 ETA {progress_events.format_duration(eta)}" if eta is not None else ""
+            return f"{event.done:,}/{event.total:,} \u00b7 {event.rows_per_second:,.0f} rows/s{eta_text}", None
+        if job.status == batch_jobs.DONE:
+            return f"Done \u2192 {os.path.basename(job.output_path)}", "green"
+        if job.status == batch_jobs.FAILED:
+            return f"Failed: {job.error}", "red"
+        return "Cancelled (run again to resume)", "orange"
 
-    def worker_run(self):
+    def _poll_jobs(self):
+        jobs = list(self.active_jobs.values())
+        finished = [job for job in jobs if job.finished_state]
+        rows = sum(job.done_rows for job in jobs)
+        elapsed = max(time.time() - self.run_started, 1e-6)
         try:
-            matcher_v2.run_matching_v2(
-                self.input_file, self.search_column_var.get(),
-                self.selected_local_fields, self.selected_db_fields,
-                self.format_var.get(),
-                progress_callback=self._threadsafe_set_progress,
-                status_callback=self._threadsafe_set_status
-            )
-            self._threadsafe_set_status("Done!", color="green")
-            self.after(0, lambda: messagebox.showinfo("Success", "Finished!"))
-        except Exception as e:
-            self._threadsafe_set_status(f"Error: {e}", color="red")
+            for path, job in self.active_jobs.items():
+                bar, label, view = self.file_rows[path]
+                bar.set(job.progress)
+                text, color = self._job_text(job)
+                label.configure(text=text, **({"text_color": color} if color else {}))
+                if job.status == batch_jobs.DONE and view.cget("state") == "disabled":
+                    view.configure(state="normal", command=lambda p=job.output_path: self.show_results(p))
+            self.prog.set(sum(job.progress for job in jobs) / len(jobs))
+            overall = progress_events.combine_events([job.telemetry for job in jobs], elapsed)
+            self.status.configure(text=f"{len(finished)}/{len(jobs)} files done \u00b7 {overall.describe()}")
+        except (tk.TclError, KeyError):
+            # The user left step 3; keep following the jobs without a view.
+            pass
+
+        if len(finished) < len(jobs):
+            self.after(JOB_POLL_MS, self._poll_jobs)
+            return
+        try:
+            self.btn_run.configure(state="normal")
+        except tk.TclError:
+            pass
+        done = [job for job in jobs if job.status == batch_jobs.DONE]
+        summary = f"{len(done)} of {len(jobs)} files matched ({rows} rows in {elapsed:.1f}s)."
+        failed = [f"{job.input_name}: {job.error or job.message}" for job in jobs if job.status != batch_jobs.DONE]
+        if failed:
+            messagebox.showwarning("Finished", summary + "\n\n" + "\n".join(failed))
+        else:
+            messagebox.showinfo("Success", summary)
 
     # ==========================
     # MODE 2: MANUAL SEARCH
@@ -261,6 +386,7 @@ class DrugWizardApp(ctk.CTk):
         self.clear_main()
         self.btn_search.configure(fg_color=("gray75", "gray25"))
         self.btn_wizard.configure(fg_color="#3a7ebf")
+        self.btn_results.configure(fg_color="#3a7ebf")
 
         # Top Bar: Search Input & Run
         top_frame = ctk.CTkFrame(self.main_frame)
@@ -294,12 +420,7 @@ class DrugWizardApp(ctk.CTk):
         tree_frame = ctk.CTkFrame(self.main_frame)
         tree_frame.pack(fill="both", expand=True, pady=5)
         
-        # Style
-        style = ttk.Style()
-        style.theme_use("clam")
-        style.configure("Treeview", background="#2b2b2b", fieldbackground="#2b2b2b", foreground="white", rowheight=30)
-        style.configure("Treeview.Heading", background="#1f1f1f", foreground="white", relief="flat")
-        style.map("Treeview", background=[('selected', '#1f6aa5')])
+        self.style_treeview()
         
         self.tree = ttk.Treeview(tree_frame, selectmode="extended", show="headings")
         
@@ -328,6 +449,13 @@ class DrugWizardApp(ctk.CTk):
         # Init Cols
         self.refresh_tree_columns()
 
+    def style_treeview(self):
+        style = ttk.Style()
+        style.theme_use("clam")
+        style.configure("Treeview", background="#2b2b2b", fieldbackground="#2b2b2b", foreground="white", rowheight=30)
+        style.configure("Treeview.Heading", background="#1f1f1f", foreground="white", relief="flat")
+        style.map("Treeview", background=[('selected', '#1f6aa5')])
+
     def refresh_tree_columns(self):
         # Safety check if tree exists
         if not self.tree: return
@@ -380,7 +508,9 @@ class DrugWizardApp(ctk.CTk):
         _tree.delete(*_tree.get_children())
         active_cols = [k for k, v in self.search_col_vars.items() if v.get()]
         
-        for row in self.search_results:
+        # Rows are materialized from the ranked ids with only the checked columns
+        rows = self.search_results.page(columns=active_cols) if self.search_results else []
+        for row in rows:
             values = [row.get(col, "") for col in active_cols]
             _tree.insert("", "end", values=values)
 
@@ -422,6 +552,95 @@ class DrugWizardApp(ctk.CTk):
         self.clipboard_append(full_text)
         messagebox.showinfo("Copied", "Row(s) copied to clipboard! You can paste directly into Excel.")
 
+    # ==========================
+    # MODE 3: RESULT VIEWER
+    # ==========================
+    def show_results(self, path=None):
+        self.clear_main()
+        self.btn_results.configure(fg_color=("gray75", "gray25"))
+        self.btn_wizard.configure(fg_color="#3a7ebf")
+        self.btn_search.configure(fg_color="#3a7ebf")
+        self.result_view = None
+
+        # Top Bar: Open & Filters
+        top_frame = ctk.CTkFrame(self.main_frame)
+        top_frame.pack(fill="x", pady=(0, 10))
+        ctk.CTkButton(top_frame, text="Open Output...", width=120, command=self.browse_result).pack(side="left", padx=10, pady=10)
+        self.entry_min_score = ctk.CTkEntry(top_frame, width=90, placeholder_text="Min score")
+        self.entry_min_score.pack(side="left", padx=5)
+        self.entry_match_text = ctk.CTkEntry(top_frame, placeholder_text="Match contains...")
+        self.entry_match_text.pack(side="left", fill="x", expand=True, padx=5)
+        for entry in (self.entry_min_score, self.entry_match_text):
+            entry.bind("<Return>", lambda e: self.apply_result_filter())
+        ctk.CTkButton(top_frame, text="Filter", width=80, command=self.apply_result_filter).pack(side="right", padx=10)
+
+        self.result_status = ctk.CTkLabel(self.main_frame, text="Open a batch output to browse it.", anchor="w")
+        self.result_status.pack(fill="x")
+
+        # Only the visible rows exist as Treeview items, so 100k+ row outputs stay responsive
+        self.style_treeview()
+        self.result_grid = result_grid.VirtualGrid(self.main_frame, on_sort=lambda c: self._update_result_status())
+        self.result_grid.pack(fill="both", expand=True, pady=5)
+        menu = tk.Menu(self.result_grid.tree, tearoff=0)
+        menu.add_command(label="Copy Row (For Excel)", command=self.copy_result_rows)
+        self.result_grid.tree.bind("<Button-3>", lambda e: menu.post(e.x_root, e.y_root))
+
+        if path:
+            self.load_result(path)
+
+    def browse_result(self):
+        patterns = " ".join(f"*.{ext}" for _, ext, _ in result_writers.OUTPUT_FORMATS.values())
+        filename = filedialog.askopenfilename(filetypes=[("Batch Outputs", patterns)])
+        if filename:
+            self.load_result(filename)
+
+    def load_result(self, path):
+        self.result_status.configure(text=f"Loading {os.path.basename(path)}...")
+        threading.Thread(target=self._load_result_thread, args=(path,), daemon=True).start()
+
+    def _load_result_thread(self, path):
+        try:
+            view = result_grid.ResultView(result_grid.open_result_store(path))
+            self.after(0, lambda: self.on_result_loaded(view, path))
+        except Exception as e:
+            err_msg = f"Could not open {os.path.basename(path)}: {e}"
+            self.after(0, lambda msg=err_msg: messagebox.showerror("Error", msg))
+
+    def on_result_loaded(self, view, path):
+        grid = self.result_grid
+        if grid is None or not grid.winfo_exists(): return
+        self.result_view = view
+        self.result_path = path
+        grid.set_view(view)
+        self._update_result_status()
+
+    def apply_result_filter(self):
+        view = self.result_view
+        if view is None: return
+        text = self.entry_min_score.get().strip()
+        try:
+            min_score = float(text) if text else None
+        except ValueError:
+            messagebox.showerror("Error", f"Min score must be a number, not {text!r}.")
+            return
+        view.set_filter(min_score=min_score, text=self.entry_match_text.get())
+        self.result_grid.refresh()
+        self._update_result_status()
+
+    def _update_result_status(self):
+        view = self.result_view
+        if view is None: return
+        shown = f"{len(view):,} of {len(view.store):,} rows"
+        sort = f" \u00b7 sorted by {view.sort_column}" if view.sort_column else ""
+        self.result_status.configure(text=f"{os.path.basename(self.result_path)}: {shown}{sort}")
+
+    def copy_result_rows(self):
+        rows = self.result_grid.selected_values() if self.result_grid is not None else []
+        if not rows: return
+        self.clipboard_clear()
+        self.clipboard_append("\n".join("\t".join(str(v) for v in row) for row in rows))
+        messagebox.showinfo("Copied", "Row(s) copied to clipboard! You can paste directly into Excel.")
+
 if __name__ == "__main__":
     app = DrugWizardApp()
     app.mainloop()
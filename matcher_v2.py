@@ -1,11 +1,96 @@
-﻿import json
+﻿import hashlib
+import json
 import os
+import pickle
 import re
 import sys
+import threading
+import time
+import tracemalloc
+from array import array
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Tuple
 
+import numpy as np  # type: ignore
 import pandas as pd  # type: ignore
 from rapidfuzz import fuzz, process  # type: ignore
+from rapidfuzz.distance import Levenshtein  # type: ignore
+
+import batch_checkpoint
+import columnar_store
+import progress_events
+import query_log
+import result_writers
+import search_metrics
+from startup import get_base_path
+
+
+class _StrengthSignature:
+    """Read-only strength signature shared by every catalog row with the same dosage text."""
+
+    __slots__ = ("ratios", "ratio_sets", "values", "numbers")
+
+    def __init__(self, ratios=(), ratio_sets=(), values=(), numbers=()):
+        self.ratios = frozenset(ratios)
+        self.ratio_sets = frozenset(ratio_sets)
+        self.values = frozenset(values)
+        self.numbers = frozenset(numbers)
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        if not isinstance(other, _StrengthSignature):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def _key(self):
+        return (self.ratios, self.ratio_sets, self.values, self.numbers)
+
+
+class _InternedColumn:
+    """Per-row values stored as integer codes into a table of unique values."""
+
+    __slots__ = ("codes", "table", "_lookup")
+
+    def __init__(self):
+        self.codes = array("I")
+        self.table = []
+        self._lookup = {}
+
+    def append(self, value):
+        code = self._lookup.get(value)
+        if code is None:
+            code = len(self.table)
+            self._lookup[value] = code
+            self.table.append(value)
+        self.codes.append(code)
+
+    def freeze(self):
+        """Drops the build-time lookup once every row has been appended."""
+        self._lookup = None
+
+    @classmethod
+    def from_parts(cls, codes, table):
+        column = cls()
+        column.codes = codes
+        column.table = list(table)
+        column._lookup = None
+        return column
+
+    def __getitem__(self, idx):
+        return self.table[self.codes[idx]]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        table = self.table
+        return (table[code] for code in self.codes)
 
 
 def _new_cached_names():
@@ -14,16 +99,155 @@ def _new_cached_names():
 
 _CACHED_DB = None
 _CACHED_NAMES = _new_cached_names()
+# Guards every build and swap of the two caches above. Readers take the unlocked
+# fast path once a fully built index has been published.
+_INDEX_LOCK = threading.RLock()
+_WARMUP_THREAD = None
+# Why the background warm-up failed (None while it is running or after it succeeded).
+_WARMUP_ERROR = None
+# Guards the start/stop of the warm-up, watcher and shard-pool singletons. Kept apart
+# from _INDEX_LOCK, which the warm-up holds for the whole build, so page reruns that
+# call start_background_warmup/start_catalog_watcher never wait on a build.
+_THREAD_LOCK = threading.Lock()
 
 
-def get_base_path():
-    """Returns the base path for resources, compatible with scripts and EXEs."""
-    if getattr(sys, "frozen", False):
-        return os.path.dirname(sys.executable)
-    return os.path.dirname(os.path.abspath(__file__))
+DB_JSON = os.path.join(get_base_path(), "druglist.json")
 
+# When set, processes attach to index snapshots published into this directory
+# (see columnar_store.py) instead of each building their own copy.
+SHARED_INDEX_DIR = os.environ.get("HENEDY_SHARED_INDEX_DIR") or None
+SHARED_INDEX_POLL_SECONDS = 5.0
+_SHARED_STATE = {"version": None, "checked_at": 0.0}
+# Lets one thread at a time map a new snapshot; the swap itself takes _INDEX_LOCK.
+_ATTACH_LOCK = threading.Lock()
+# Guards the per-index strength subset cache, which concurrent searches fill and evict.
+_SUBSET_LOCK = threading.Lock()
+# Derived lookups published with the snapshot, so attached workers do not rebuild them.
+_SHARED_DERIVED_KEYS = ("strength_index", "facets", "ingredients", "typo_index")
+
+# A catalog compiled with "python columnar_store.py compile" (<catalog>.columns, or
+# HENEDY_COMPILED_CATALOG; "off" disables it) is memory-mapped instead of parsing
+# druglist.json, as long as it was compiled from the JSON file as it is now. Without
+# a druglist.json next to it the compiled file is used as is.
+COMPILED_CATALOG_PATH = os.environ.get("HENEDY_COMPILED_CATALOG") or None
+
+# The built search index is pickled next to the catalog (or to HENEDY_INDEX_CACHE;
+# "off" disables it) and reused on the next start while druglist.json is unchanged,
+# which turns a multi-second index build into a quick load. Bump the version whenever
+# the index layout changes.
+INDEX_CACHE_PATH = os.environ.get("HENEDY_INDEX_CACHE") or None
+INDEX_CACHE_VERSION = 2
+_INDEX_CACHE_KEYS = (
+    "en",
+    "ar",
+    "id",
+    "strength",
+    "forms",
+    "alpha_tokens",
+    "strength_index",
+    "facets",
+    "ingredients",
+    "typo_index",
+)
 
-DB_JSON = os.path.join(get_base_path(), "druglist.json")
+# File state of the catalog behind the cached index, compared by the hot-reload watcher.
+CATALOG_POLL_SECONDS = 5.0
+_SOURCE_STATE = {"stat": None, "sha1": None}
+_RELOAD_LOCK = threading.Lock()
+_WATCHER = None
+
+# Scatter-gather settings for very large catalogs. With more than one shard each
+# prefilter scan runs per shard on a thread pool and the per-shard top-k lists are
+# merged back into the exact global top-k, so rankings match the unsharded scan.
+SEARCH_SHARD_COUNT = int(os.environ.get("HENEDY_SEARCH_SHARDS", "1"))
+SEARCH_SHARD_STRATEGY = os.environ.get("HENEDY_SHARD_STRATEGY", "contiguous")
+SHARD_STRATEGIES = ("contiguous", "first_letter", "language")
+_SHARD_POOL = None
+
+# Intra-query parallelism for unsharded searches. With more than one thread the
+# lane x variant x scorer scans of a query run concurrently (rapidfuzz releases the
+# GIL while scanning), and catalogs of at least QUERY_SPLIT_MIN_ROWS rows are also
+# split into that many contiguous slices. Results merge in the serial scan order.
+SEARCH_QUERY_THREADS = int(os.environ.get("HENEDY_SEARCH_THREADS", "1"))
+QUERY_SPLIT_MIN_ROWS = 20000
+
+# How rows sharing the query's strength/ratio take part in candidate generation:
+# "include" (the default) scans them in addition to the full catalog, so the top-k
+# matches the plain full scan; "restrict" scans only them, falling back to the full catalog when none of them
+# scores at least RESTRICT_FALLBACK_SCORE (e.g. a mistyped strength leaves the right
+# drug outside the subset). Rows without units are indexed by their bare numbers.
+# The name lists of recently used strength subsets are kept (up to
+# STRENGTH_SUBSET_CACHE_ROWS rows in total) so repeated strengths skip rebuilding them.
+STRENGTH_PREFILTER_MODE = os.environ.get("HENEDY_STRENGTH_PREFILTER", "include")
+STRENGTH_SUBSET_MAX_ROWS = 50000
+STRENGTH_SUBSET_CACHE_ROWS = 500000
+RESTRICT_FALLBACK_SCORE = 80
+
+# SymSpell-style typo lookup: query tokens within a small edit distance of a catalog
+# token (found through a deletion index over the token vocabulary) seed candidate
+# rows, with the same "include"/"restrict" modes as the strength prefilter; "off"
+# disables it. The deletion index is built with the rest of the search index (and
+# published and cached with it), never lazily on a query. Tokens shared by more
+# than TYPO_TOKEN_MAX_ROWS rows are too common to narrow anything and are left to
+# the full scan.
+TYPO_PREFILTER_MODE = os.environ.get("HENEDY_TYPO_PREFILTER", "include")
+TYPO_MAX_EDIT_DISTANCE = 2
+TYPO_PREFIX_LENGTH = 7
+TYPO_TOKEN_MAX_ROWS = 5000
+TYPO_SUBSET_MAX_ROWS = 20000
+
+# Catalog fields whose value -> rows index is built with the search index. Any
+# other column can still be filtered; its index is built on first use.
+FILTER_FIELDS = ("category", "manufacturer", "status", "dosage_form", "administration_route")
+
+# Generic-equivalent lookups: rows are indexed by their normalized active-ingredient
+# set, and by that set plus strength, and equivalents are returned cheapest first.
+INGREDIENTS_FIELD = "active_ingredients"
+PRICE_FIELD = "price_retail"
+
+# Guards against pathological input such as pasted paragraphs. Queries are cut to
+# MAX_QUERY_CHARS and expanded into at most MAX_QUERY_VARIANTS variants; an optional
+# per-query time budget returns the best results found so far, flagged as partial.
+MAX_QUERY_CHARS = 200
+MAX_QUERY_VARIANTS = 6
+SEARCH_DEADLINE_SECONDS = float(os.environ["HENEDY_SEARCH_DEADLINE"]) if os.environ.get("HENEDY_SEARCH_DEADLINE") else None
+_LIMIT_COUNTERS = {"query_truncated": 0, "variants_capped": 0, "deadline_expired": 0}
+_COUNTER_LOCK = threading.Lock()
+
+# run_matching_v2 streams rows to the output file and only keeps the first
+# BATCH_PREVIEW_ROWS in memory for display.
+BATCH_PREVIEW_ROWS = 50
+
+# Prometheus-style metrics (see search_metrics). Updates are no-ops unless enabled,
+# and timing code below only runs behind a ``_METRICS.enabled`` check.
+_METRICS = search_metrics.REGISTRY
+_M_SEARCH_LATENCY = _METRICS.histogram(
+    "henedy_search_latency_seconds", "Wall time of search_live calls.", labelnames=("partial",)
+)
+_M_SEARCH_RESULTS = _METRICS.histogram(
+    "henedy_search_results", "Rows returned per search_live call.", buckets=search_metrics.DEFAULT_SIZE_BUCKETS
+)
+_M_CANDIDATE_POOL = _METRICS.histogram(
+    "henedy_rank_candidate_pool_size",
+    "Prefilter candidates reranked per query.",
+    buckets=search_metrics.DEFAULT_SIZE_BUCKETS,
+)
+_M_RANK_LATENCY = _METRICS.histogram("henedy_rank_latency_seconds", "Wall time of candidate generation and reranking.")
+_M_INDEX_BUILD = _METRICS.histogram(
+    "henedy_index_build_seconds", "Search index build time.", buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+_M_INDEX_ROWS = _METRICS.gauge("henedy_index_rows", "Catalog rows in the most recently built search index.")
+_M_QUERY_LIMITS = _METRICS.counter(
+    "henedy_query_limits_total", "Query guard activations (truncation, variant cap, deadline).", labelnames=("limit",)
+)
+_M_BATCH_ROWS = _METRICS.counter("henedy_batch_rows_total", "Input rows processed by run_matching_v2.")
+_M_BATCH_QUERIES = _METRICS.counter(
+    "henedy_batch_queries_total", "Batch query lookups by query-cache outcome.", labelnames=("cache",)
+)
+_M_BATCH_DURATION = _METRICS.histogram(
+    "henedy_batch_duration_seconds", "Wall time of run_matching_v2 calls.", buckets=(1, 5, 15, 30, 60, 300, 900, 3600)
+)
+_M_BATCH_THROUGHPUT = _METRICS.gauge("henedy_batch_rows_per_second", "Matching throughput of the last batch run.")
 
 STOP_WORDS = {
     "mg",
@@ -115,12 +339,15 @@ VALUE_WITH_UNIT_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(mg|mcg|g|gm|ml|iu|units?|%)
 NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
 ALPHA_TOKEN_RE = re.compile(r"[a-z\u0600-\u06FF]{3,}")
 GENERIC_NAME_TOKENS = {"plus", "extra", "forte", "retard"}
+INGREDIENT_SPLIT_RE = re.compile(r"\s*(?:[+,;/&]|\band\b|\bwith\b)\s*")
 
 
 def clear_cache():
     global _CACHED_DB, _CACHED_NAMES
-    _CACHED_DB = None
-    _CACHED_NAMES = _new_cached_names()
+    with _INDEX_LOCK:
+        _CACHED_DB = None
+        _CACHED_NAMES = _new_cached_names()
+        _SHARED_STATE["version"] = None
 
 
 def is_arabic(text):
@@ -236,6 +463,36 @@ def _extract_alpha_tokens(text):
     return {token for token in tokens if token not in GENERIC_NAME_TOKENS}
 
 
+def _count_limit(name):
+    with _COUNTER_LOCK:
+        _LIMIT_COUNTERS[name] += 1
+    _M_QUERY_LIMITS.inc(limit=name)
+
+
+def get_limit_counters():
+    """Returns how often each query guard (truncation, variant cap, deadline) has triggered."""
+    with _COUNTER_LOCK:
+        return dict(_LIMIT_COUNTERS)
+
+
+class _QueryBudget:
+    """Wall-clock budget for one query; ``partial`` is set once it has run out."""
+
+    __slots__ = ("deadline", "partial")
+
+    def __init__(self, seconds=None):
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.partial = False
+
+    def expired(self):
+        if self.partial:
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.partial = True
+            _count_limit("deadline_expired")
+        return self.partial
+
+
 def _build_query_variants(raw_query):
     variants = []
     seen = set()
@@ -244,6 +501,9 @@ def _build_query_variants(raw_query):
         return variants
 
     raw_text = str(raw_query)
+    if len(raw_text) > MAX_QUERY_CHARS:
+        raw_text = raw_text[:MAX_QUERY_CHARS]
+        _count_limit("query_truncated")
     text_without_parens = re.sub(r"\([^)]*\)", " ", raw_text)
     parenthetical_parts = re.findall(r"\(([^)]*)\)", raw_text)
 
@@ -266,65 +526,698 @@ def _build_query_variants(raw_query):
     for part in parenthetical_parts:
         add_variant(part, 0.82)
 
+    if len(variants) > MAX_QUERY_VARIANTS:
+        variants = variants[:MAX_QUERY_VARIANTS]
+        _count_limit("variants_capped")
     return variants
 
 
-def get_master_db(status_callback=None, force_reload=False):
-    """Loads the database as a DataFrame directly from JSON."""
-    global _CACHED_DB
+def _compiled_catalog_path():
+    if COMPILED_CATALOG_PATH == "off":
+        return None
+    return COMPILED_CATALOG_PATH or f"{os.path.splitext(DB_JSON)[0]}.columns"
 
-    if force_reload:
-        clear_cache()
 
-    if _CACHED_DB is not None:
-        return _CACHED_DB
+def _open_compiled_catalog(source_stat):
+    """Maps the compiled catalog when it exists and matches druglist.json; None otherwise."""
+    path = _compiled_catalog_path()
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        catalog = columnar_store.open_catalog(path)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring compiled catalog: {e}")
+        return None
+
+    # Recorded as (path, mtime_ns, size, sha1) of the druglist.json it was compiled from.
+    compiled_from = catalog.attrs["manifest"].get("source")
+    if source_stat is not None:
+        if not compiled_from or tuple(compiled_from[1:3]) != tuple(source_stat):
+            # Compiled from an older druglist.json; parse the JSON instead.
+            return None
+        catalog.attrs["source"] = (os.path.abspath(DB_JSON), *source_stat)
+        catalog.attrs["source_sha1"] = compiled_from[3] if len(compiled_from) > 3 else None
+    else:
+        stat = os.stat(path)
+        catalog.attrs["source"] = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    return catalog
+
 
+def compile_catalog(out_path=None, compression=None, status_callback=None):
+    """Compiles druglist.json into the columnar file that _load_catalog_frame maps on startup."""
+    df = _read_catalog_json(status_callback)
+    path = out_path or _compiled_catalog_path() or f"{os.path.splitext(DB_JSON)[0]}.columns"
+    if status_callback:
+        status_callback("Compiling columnar catalog...")
+    source = df.attrs["source"]
+    if source is not None:
+        source = (*source, df.attrs.get("source_sha1"))
+    columnar_store.compile_catalog(df, path, source=source, compression=compression)
+    return path
+
+
+def _load_catalog_frame(status_callback=None):
+    source_stat = _catalog_stat()
+    compiled = _open_compiled_catalog(source_stat)
+    if compiled is not None:
+        if status_callback:
+            status_callback("Mapped compiled catalog.")
+        _SOURCE_STATE["stat"] = source_stat
+        # Files compiled before the hash was recorded fall back to hashing the JSON once.
+        _SOURCE_STATE["sha1"] = compiled.attrs.get("source_sha1") or (_catalog_sha1() if source_stat else None)
+        return compiled
+    return _read_catalog_json(status_callback)
+
+
+def _read_catalog_json(status_callback=None):
     if status_callback:
         status_callback("Loading JSON database...")
 
     if not os.path.exists(DB_JSON):
         raise FileNotFoundError(f"Database file missing: {DB_JSON}")
 
-    with open(DB_JSON, "r", encoding="utf-8") as f:
-        raw_data = json.load(f)
-        data_list = raw_data.get("data", raw_data) if isinstance(raw_data, dict) else raw_data
-        df = pd.DataFrame(data_list).reset_index(drop=True)
+    # Stat before reading so an edit that lands mid-parse still triggers a reload.
+    source_stat = _catalog_stat()
+    with open(DB_JSON, "rb") as f:
+        raw_bytes = f.read()
+    # Hash exactly the bytes parsed, so the watcher can tell a touch from an edit.
+    sha1 = hashlib.sha1(raw_bytes).hexdigest()
+    raw_data = json.loads(raw_bytes.decode("utf-8"))
+    del raw_bytes
+    data_list = raw_data.get("data", raw_data) if isinstance(raw_data, dict) else raw_data
+    df = pd.DataFrame(data_list).reset_index(drop=True)
+    _SOURCE_STATE["stat"] = source_stat
+    _SOURCE_STATE["sha1"] = sha1
+    # Identifies the file this table came from, so a persisted index can be matched to it.
+    df.attrs["source"] = (os.path.abspath(DB_JSON), *source_stat) if source_stat else None
+    df.attrs["source_sha1"] = sha1
+    return df
+
+
+def _index_cache_path():
+    if INDEX_CACHE_PATH == "off":
+        return None
+    return INDEX_CACHE_PATH or f"{os.path.splitext(DB_JSON)[0]}.index.cache"
+
+
+def _load_index_cache(df):
+    """Returns the persisted index for ``df``'s source file, or None when missing or stale."""
+    path = _index_cache_path()
+    source = getattr(df, "attrs", {}).get("source")
+    if not path or not source or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            payload = pickle.load(f)
+    except Exception as e:
+        print(f"Ignoring unreadable index cache: {e}")
+        return None
+    if payload.get("version") != INDEX_CACHE_VERSION or payload.get("source") != source:
+        return None
+    if payload.get("rows") != len(df) or payload.get("filter_fields") != FILTER_FIELDS:
+        return None
+    names = payload["names"]
+    names["numeric"] = {}
+    names["source"] = source
+    return names
+
+
+def _save_index_cache(names_data):
+    path = _index_cache_path()
+    source = names_data.get("source")
+    if not path or not source:
+        return False
+    payload = {
+        "version": INDEX_CACHE_VERSION,
+        "source": source,
+        "rows": len(names_data["en"]),
+        "filter_fields": FILTER_FIELDS,
+        # Shallow copies: searches may add lazily built facets while this is pickled.
+        "names": {
+            key: dict(value) if key == "facets" else value
+            for key, value in names_data.items()
+            if key in _INDEX_CACHE_KEYS
+        },
+    }
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not write index cache: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    return True
+
+
+def _build_or_load_index(df, status_callback=None):
+    """Loads the persisted index for ``df`` when it is current, else builds and persists it."""
+    names = _load_index_cache(df)
+    if names is not None:
+        if status_callback:
+            status_callback("Loaded cached search index.")
+        if TYPO_PREFILTER_MODE != "off" and "typo_index" not in names:
+            # Saved while the typo prefilter was off.
+            names["typo_index"] = _build_typo_index(names["alpha_tokens"])
+            _save_index_cache(names)
+        return names
+    names = _build_search_names(df, status_callback)
+    names["source"] = getattr(df, "attrs", {}).get("source")
+    _save_index_cache(names)
+    return names
+
+
+def get_loaded_catalog():
+    """Returns the catalog if it is already loaded, without loading it (None otherwise)."""
+    return _CACHED_DB
+
+
+def _catalog_stat():
+    try:
+        stat = os.stat(DB_JSON)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _catalog_sha1():
+    digest = hashlib.sha1()
+    with open(DB_JSON, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _attach_shared_index(force_check=False):
+    """Attaches to the newest published snapshot when shared mode is enabled.
+
+    Returns True when the caches hold a shared snapshot. The CURRENT pointer is
+    re-read at most every SHARED_INDEX_POLL_SECONDS so new versions get picked up.
+    """
+    global _CACHED_DB, _CACHED_NAMES
+
+    if not SHARED_INDEX_DIR:
+        return False
+
+    now = time.monotonic()
+    attached = _SHARED_STATE["version"]
+    if attached and not force_check and now - _SHARED_STATE["checked_at"] < SHARED_INDEX_POLL_SECONDS:
+        return True
+
+    # The snapshot is mapped and decoded outside _INDEX_LOCK, so searches keep using
+    # the previous one meanwhile; only the reference swap below takes the lock.
+    with _ATTACH_LOCK:
+        _SHARED_STATE["checked_at"] = now
+        attached = _SHARED_STATE["version"]
+        version = columnar_store.current_version(SHARED_INDEX_DIR)
+        if version is None:
+            return False
+        if version == attached:
+            return True
+        version, catalog, parts = columnar_store.attach_snapshot(SHARED_INDEX_DIR, version)
+        names = _snapshot_names(catalog, parts)
+
+    with _INDEX_LOCK:
+        if _SHARED_STATE["version"] != version:
+            _CACHED_DB = catalog
+            _CACHED_NAMES = names
+            _SHARED_STATE["version"] = version
+    return True
+
+
+def _snapshot_names(catalog, parts):
+    names = _new_cached_names()
+    # rapidfuzz scans Python strings, so the two name lanes are decoded once per process,
+    # and the derived lookups are unpickled per process too; only the codes stay mapped.
+    names["en"] = parts["en"].tolist()
+    names["ar"] = parts["ar"].tolist()
+    names["id"] = range(len(catalog))
+    for key in ("strength", "forms", "alpha_tokens"):
+        names[key] = _InternedColumn.from_parts(*parts[key])
+    for key in _SHARED_DERIVED_KEYS:
+        if key in parts:
+            names[key] = parts[key]
+    # Snapshots published before the derived lookups were shared (or with the typo prefilter off).
+    if "strength_index" not in names:
+        names["strength_index"] = _build_strength_index(names["strength"])
+    if TYPO_PREFILTER_MODE != "off" and "typo_index" not in names:
+        names["typo_index"] = _build_typo_index(names["alpha_tokens"])
+    return names
+
+
+def get_master_db(status_callback=None, force_reload=False):
+    """Loads the database as a DataFrame directly from JSON.
+
+    Concurrent callers share a single load. A forced reload swaps in the new table
+    only once it is fully parsed and drops the search index built from the old one.
+    """
+    global _CACHED_DB, _CACHED_NAMES
+
+    if _attach_shared_index(force_check=force_reload):
+        return _CACHED_DB
+
+    df = _CACHED_DB
+    if df is not None and not force_reload:
+        return df
+
+    with _INDEX_LOCK:
+        if _CACHED_DB is not None and not force_reload:
+            return _CACHED_DB
 
-    _CACHED_DB = df
+        df = _load_catalog_frame(status_callback)
+        _CACHED_DB = df
+        _CACHED_NAMES = _new_cached_names()
     return df
 
 
 def get_search_names(status_callback=None, force_rebuild=False):
-    """Builds cleaned names and lightweight matching metadata."""
+    """Builds cleaned names and lightweight matching metadata.
+
+    Only one thread builds the index; the others wait and receive the same result.
+    """
     global _CACHED_NAMES
 
-    if force_rebuild:
-        _CACHED_NAMES = _new_cached_names()
+    if _attach_shared_index(force_check=force_rebuild):
+        return _CACHED_NAMES
+
+    names = _CACHED_NAMES
+    if names["en"] and not force_rebuild:
+        return names
+
+    with _INDEX_LOCK:
+        if _CACHED_NAMES["en"] and not force_rebuild:
+            return _CACHED_NAMES
 
-    if _CACHED_NAMES["en"]:
+        df = get_master_db(status_callback)
+        _CACHED_NAMES = _build_or_load_index(df, status_callback)
         return _CACHED_NAMES
 
-    df = get_master_db(status_callback)
+
+def get_search_snapshot(status_callback=None):
+    """Returns a consistent ``(names_data, db_df)`` pair built from the same catalog."""
+    # Both caches are only ever swapped under the lock, so reading them together
+    # under it can never pair an index with a different catalog. A new shared
+    # snapshot is attached before taking it.
+    shared = _attach_shared_index()
+    with _INDEX_LOCK:
+        names = _CACHED_NAMES if shared else get_search_names(status_callback)
+        return names, _CACHED_DB
+
+
+def reload_search_index(status_callback=None):
+    """Rebuilds the catalog and search index from disk, then swaps both in at once.
+
+    The build runs outside the index lock, so searches keep being served from the
+    previous index and any in-flight search finishes on the objects it started with.
+    """
+    global _CACHED_DB, _CACHED_NAMES
+
+    with _RELOAD_LOCK:
+        df = _load_catalog_frame(status_callback)
+        names = _build_or_load_index(df, status_callback)
+        with _INDEX_LOCK:
+            _CACHED_DB = df
+            _CACHED_NAMES = names
+    return names, df
+
+
+class _CatalogWatcher(threading.Thread):
+    """Polls druglist.json and hot-reloads the index when its content changes."""
+
+    def __init__(self, interval, status_callback=None):
+        super().__init__(name="catalog-watcher", daemon=True)
+        self.interval = interval
+        self.status_callback = status_callback
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Catalog watcher error: {e}")
+
+    def check(self):
+        """Reloads when the file changed since it was last loaded; returns True if it did."""
+        if _CACHED_DB is None:
+            # Nothing loaded yet; the first lazy load will read the current file.
+            return False
+
+        stat = _catalog_stat()
+        if stat is None or stat == _SOURCE_STATE["stat"]:
+            return False
+
+        sha1 = _catalog_sha1()
+        if sha1 == _SOURCE_STATE["sha1"]:
+            # Touched or rewritten with identical content.
+            _SOURCE_STATE["stat"] = stat
+            return False
+
+        if self.status_callback:
+            self.status_callback("Catalog changed on disk, rebuilding index...")
+        reload_search_index(self.status_callback)
+        if self.status_callback:
+            self.status_callback("Catalog reloaded.")
+        return True
+
+
+def start_catalog_watcher(interval=None, status_callback=None):
+    """Starts the background druglist.json watcher once per process and returns it.
+
+    Returns None in shared-index mode, where processes follow published snapshots instead.
+    """
+    global _WATCHER
+
+    if SHARED_INDEX_DIR:
+        return None
+    with _THREAD_LOCK:
+        if _WATCHER is None or not _WATCHER.is_alive():
+            _WATCHER = _CatalogWatcher(interval or CATALOG_POLL_SECONDS, status_callback)
+            _WATCHER.start()
+        return _WATCHER
+
+
+def stop_catalog_watcher():
+    global _WATCHER
+
+    with _THREAD_LOCK:
+        watcher = _WATCHER
+        _WATCHER = None
+    if watcher is not None:
+        watcher.stop_event.set()
+
+
+def _warmup_index(status_callback=None):
+    global _WARMUP_ERROR
+
+    _WARMUP_ERROR = None
+    try:
+        get_search_names(status_callback)
+    except Exception as e:
+        _WARMUP_ERROR = e
+        print(f"Search index warm-up failed: {e}")
+
+
+def get_warmup_error():
+    """The exception that stopped the background warm-up, if any."""
+    return _WARMUP_ERROR
+
+
+def start_background_warmup(status_callback=None):
+    """Loads the catalog and builds the search index on a daemon thread.
+
+    Safe to call from every app entry point; only the first call starts a thread.
+    """
+    global _WARMUP_THREAD
+
+    with _THREAD_LOCK:
+        if _WARMUP_THREAD is None:
+            _WARMUP_THREAD = threading.Thread(
+                target=_warmup_index,
+                args=(status_callback,),
+                name="search-index-warmup",
+                daemon=True,
+            )
+            _WARMUP_THREAD.start()
+        return _WARMUP_THREAD
+
+
+def _build_search_names(df, status_callback=None):
     if status_callback:
         status_callback("Optimizing search index...")
 
+    started = time.perf_counter() if _METRICS.enabled else None
     total = len(df)
-    en_series = df.get("name_en", pd.Series([""] * total)).fillna("").astype(str)
-    ar_series = df.get("name_ar", pd.Series([""] * total)).fillna("").astype(str)
+    blank = pd.Series([""] * total)
+    en_series = (_catalog_series(df, "name_en") if "name_en" in df.columns else blank).fillna("").astype(str)
+    ar_series = (_catalog_series(df, "name_ar") if "name_ar" in df.columns else blank).fillna("").astype(str)
 
     cached = _new_cached_names()
-    for idx, (raw_en, raw_ar) in enumerate(zip(en_series, ar_series)):
-        cached["en"].append(clean_for_match(raw_en))
-        cached["ar"].append(clean_for_match(raw_ar))
-        cached["id"].append(idx)
+    name_pool = {}
+    strength_column = _InternedColumn()
+    forms_column = _InternedColumn()
+    tokens_column = _InternedColumn()
+    for raw_en, raw_ar in zip(en_series, ar_series):
+        clean_en = clean_for_match(raw_en)
+        clean_ar = clean_for_match(raw_ar)
+        cached["en"].append(name_pool.setdefault(clean_en, clean_en))
+        cached["ar"].append(name_pool.setdefault(clean_ar, clean_ar))
 
         combined_name = f"{raw_en} {raw_ar}"
-        cached["strength"].append(_extract_strength_signature(combined_name))
-        cached["forms"].append(_extract_dosage_forms(combined_name))
-        cached["alpha_tokens"].append(_extract_alpha_tokens(clean_for_match(combined_name)))
+        signature = _extract_strength_signature(combined_name)
+        strength_column.append(
+            _StrengthSignature(signature["ratios"], signature["ratio_sets"], signature["values"], signature["numbers"])
+        )
+        forms_column.append(frozenset(_extract_dosage_forms(combined_name)))
+        tokens = _extract_alpha_tokens(clean_for_match(combined_name))
+        tokens_column.append(tuple(sorted(sys.intern(token) for token in tokens)))
+
+    for column in (strength_column, forms_column, tokens_column):
+        column.freeze()
+    cached["id"] = range(total)
+    cached["strength"] = strength_column
+    cached["forms"] = forms_column
+    cached["alpha_tokens"] = tokens_column
+    cached["strength_index"] = _build_strength_index(strength_column)
+    cached["facets"] = {}
+    cached["numeric"] = {}
+    for field in FILTER_FIELDS:
+        if field in df.columns:
+            cached["facets"][field] = _build_facet(_catalog_series(df, field))
+    if INGREDIENTS_FIELD in df.columns:
+        cached["ingredients"] = _build_ingredient_index(_catalog_series(df, INGREDIENTS_FIELD), strength_column)
+    if TYPO_PREFILTER_MODE != "off":
+        cached["typo_index"] = _build_typo_index(tokens_column)
+    if started is not None:
+        _M_INDEX_BUILD.observe(time.perf_counter() - started)
+        _M_INDEX_ROWS.set(total)
+    return cached
+
+
+def _catalog_series(db_df, field):
+    column = db_df[field]
+    if isinstance(column, pd.Series):
+        return column
+    # Mapped ColumnarCatalog column.
+    return pd.Series(column.tolist() if hasattr(column, "tolist") else list(column))
+
+
+def _build_facet(series):
+    """Maps each normalized field value to the sorted row positions holding it."""
+    normalized = series.map(_normalize_text)
+    groups = normalized.groupby(normalized, sort=False).indices
+    return {value: rows.astype(np.int32) for value, rows in groups.items() if value}
+
+
+def _numeric_values(names_data, db_df, field):
+    """Returns a catalog field as a cached float array (NaN where not numeric)."""
+    numeric = names_data.setdefault("numeric", {})
+    values = numeric.get(field)
+    if values is None:
+        values = pd.to_numeric(_catalog_series(db_df, field), errors="coerce").to_numpy(dtype=float)
+        values = numeric.setdefault(field, values)
+    return values
+
+
+def _filter_rows(filters, names_data, db_df):
+    """Resolves structured filters to the sorted row positions that satisfy all of them.
+
+    Each filter is ``field: value`` or ``field: [values]`` for an exact
+    (case-insensitive) match, or ``field: (min, max)`` for an inclusive numeric
+    range where either bound may be None. Returns None when no filter is active.
+    """
+    active = {field: spec for field, spec in (filters or {}).items() if spec not in (None, "", [], ())}
+    if not active:
+        return None
+
+    rows = None
+    for field, spec in active.items():
+        if field not in db_df.columns:
+            raise ValueError(f"Unknown filter field: {field}")
+
+        if isinstance(spec, tuple):
+            values = _numeric_values(names_data, db_df, field)
+            low, high = spec
+            mask = ~np.isnan(values)
+            if low is not None:
+                mask &= values >= float(low)
+            if high is not None:
+                mask &= values <= float(high)
+            field_rows = np.flatnonzero(mask).astype(np.int32)
+        else:
+            facets = names_data.setdefault("facets", {})
+            facet = facets.get(field)
+            if facet is None:
+                facet = facets.setdefault(field, _build_facet(_catalog_series(db_df, field)))
+            wanted = [spec] if isinstance(spec, str) or not hasattr(spec, "__iter__") else list(spec)
+            parts = [facet.get(_normalize_text(value)) for value in wanted]
+            parts = [part for part in parts if part is not None]
+            field_rows = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int32)
+
+        rows = field_rows if rows is None else np.intersect1d(rows, field_rows, assume_unique=True)
+        if not len(rows):
+            break
+    return rows.tolist()
+
+
+def get_filter_values(field):
+    """Returns the distinct non-empty values of a catalog field, for filter pickers."""
+    db_df = get_master_db()
+    if field not in db_df.columns:
+        return []
+    series = _catalog_series(db_df, field).dropna()
+    values = {str(value).strip() for value in series if str(value).strip()}
+    return sorted(values, key=str.lower)
+
+
+def _strength_index_keys(signature):
+    keys = [("ratio", ratio) for ratio in signature["ratios"]]
+    keys.extend(("ratio_set", ratio_set) for ratio_set in signature["ratio_sets"])
+    keys.extend(("value", value) for value in signature["values"])
+    if not keys:
+        keys.extend(("number", number) for number in signature["numbers"])
+    return keys
+
+
+def _build_strength_index(strength_column):
+    """Maps each normalized ratio, ratio set and unit value (bare numbers on unit-less rows) to its rows."""
+    rows_by_code = {}
+    for idx, code in enumerate(strength_column.codes):
+        rows_by_code.setdefault(int(code), array("I")).append(idx)
+
+    index = {}
+    for code, rows in rows_by_code.items():
+        for key in _strength_index_keys(strength_column.table[code]):
+            index.setdefault(key, array("I")).extend(rows)
+    return {key: array("I", sorted(rows)) for key, rows in index.items()}
+
+
+def publish_shared_index(root=None, status_callback=None, keep=2):
+    """Builds the catalog and index from JSON and publishes them as a new shared snapshot."""
+    root = root or SHARED_INDEX_DIR or os.path.join(get_base_path(), "index_store")
+    df = _load_catalog_frame(status_callback)
+    names_data = _build_search_names(df, status_callback)
+    if not isinstance(df, pd.DataFrame):
+        df = df.to_frame()
+
+    if status_callback:
+        status_callback("Publishing shared index...")
+    parts = {"en": names_data["en"], "ar": names_data["ar"]}
+    for key in ("strength", "forms", "alpha_tokens"):
+        column = names_data[key]
+        parts[key] = (column.codes, column.table)
+    for key in _SHARED_DERIVED_KEYS:
+        if key in names_data:
+            parts[key] = names_data[key]
+    return columnar_store.publish_snapshot(root, df, parts, source=DB_JSON, keep=keep)
+
+
+def _deep_sizeof(obj, seen):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, np.ndarray):
+        # Views and memory maps do not own their buffer, so getsizeof leaves it out.
+        return max(size, obj.nbytes)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(key, seen) + _deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_deep_sizeof(item, seen) for item in obj)
+    else:
+        for slot in getattr(type(obj), "__slots__", ()):
+            size += _deep_sizeof(getattr(obj, slot, None), seen)
+    return size
+
+
+def index_memory_usage(names_data=None):
+    """Returns approximate bytes held by each component of the search index."""
+    if names_data is None:
+        names_data = _CACHED_NAMES
+    seen = set()
+    usage = {key: _deep_sizeof(value, seen) for key, value in names_data.items()}
+    usage["total"] = sum(usage.values())
+    return usage
+
+
+def _mapped_index_bytes(names_data):
+    """Bytes of index arrays mapped from a shared snapshot rather than held by this process."""
+    return sum(
+        value.codes.nbytes for value in names_data.values() if isinstance(getattr(value, "codes", None), np.memmap)
+    )
+
+
+def catalog_memory_usage(db_df=None):
+    """Returns bytes held by each catalog column (deep sizes; mapped bytes for shared catalogs)."""
+    if db_df is None:
+        db_df = _CACHED_DB
+    if db_df is None:
+        return {"total": 0}
+    if isinstance(db_df, pd.DataFrame):
+        usage = {str(column): int(size) for column, size in db_df.memory_usage(deep=True).items()}
+    else:
+        seen = set()
+        usage = {column: _deep_sizeof(db_df[column], seen) for column in db_df.columns}
+    usage["total"] = sum(usage.values())
+    return usage
 
-    _CACHED_NAMES = cached
-    return _CACHED_NAMES
+
+def _trace_build_memory(status_callback=None):
+    """Reloads the catalog and rebuilds the index under tracemalloc; returns peak/retained bytes.
+
+    The catalog comes from _load_catalog_frame, so a current compiled catalog is mapped
+    (and its load figures cover only the mapping) instead of druglist.json being parsed.
+    """
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        df = _load_catalog_frame(status_callback)
+        loaded, load_peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        names_data = _build_search_names(df, status_callback)  # Held so index_retained counts it.
+        built, build_peak = tracemalloc.get_traced_memory()
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    return {
+        "load_peak": load_peak - baseline,
+        "catalog_retained": loaded - baseline,
+        "index_build_peak": build_peak - loaded,
+        "index_retained": built - loaded,
+    }
+
+
+def memory_report(trace_build=False, status_callback=None):
+    """Reports bytes used by the loaded catalog and every search-index component.
+
+    ``index_shared`` counts the index bytes mapped from a shared snapshot: only the
+    coded columns' codes. The name lanes (decoded to Python strings for rapidfuzz) and
+    the derived lookups (unpickled) stay private copies in every process.
+    With ``trace_build`` the catalog is also reloaded (mapped when a current compiled
+    catalog exists, else parsed from JSON) and the index rebuilt under tracemalloc, to
+    report the transient peak a worker needs while loading.
+    """
+    names_data, db_df = get_search_snapshot(status_callback)
+
+    rows = len(db_df)
+    report = {
+        "rows": rows,
+        # Memory-mapped catalogs (shared snapshots, uncompressed compiled files) share pages across processes.
+        "shared": getattr(db_df, "mapped", False),
+        "catalog": catalog_memory_usage(db_df),
+        "index": index_memory_usage(names_data),
+        "index_shared": _mapped_index_bytes(names_data),
+    }
+    report["total"] = report["catalog"]["total"] + report["index"]["total"]
+    report["bytes_per_row"] = report["total"] / max(rows, 1)
+    if trace_build:
+        report["tracemalloc"] = _trace_build_memory(status_callback)
+    return report
 
 
 def _strength_adjustment(query_sig, candidate_sig):
@@ -415,11 +1308,155 @@ def _rerank_score(
     return max(0.0, min(100.0, score))
 
 
-def _prefilter_candidates(query_variants, names_data, prefer_arabic, limit=40, score_cutoff=30):
+def _partition_rows(names_data, shard_count, strategy):
+    total = len(names_data["en"])
+    shard_count = max(1, min(shard_count, total or 1))
+
+    if strategy == "contiguous":
+        bounds = [round(total * shard / shard_count) for shard in range(shard_count + 1)]
+        return [range(bounds[shard], bounds[shard + 1]) for shard in range(shard_count)]
+
+    if strategy == "first_letter":
+        buckets = {}
+        for idx, (name_en, name_ar) in enumerate(zip(names_data["en"], names_data["ar"])):
+            name = name_en or name_ar
+            buckets.setdefault(name[:1], []).append(idx)
+        groups = sorted(buckets.values(), key=len, reverse=True)
+    elif strategy == "language":
+        arabic_rows = [idx for idx, name_ar in enumerate(names_data["ar"]) if name_ar]
+        other_rows = [idx for idx, name_ar in enumerate(names_data["ar"]) if not name_ar]
+        arabic_shards = max(1, round(shard_count * len(arabic_rows) / max(total, 1))) if arabic_rows else 0
+        other_shards = max(1, shard_count - arabic_shards) if other_rows else 0
+        groups = []
+        for rows, count in ((arabic_rows, arabic_shards), (other_rows, other_shards)):
+            bounds = [round(len(rows) * shard / count) for shard in range(count + 1)] if count else []
+            groups.extend(rows[bounds[shard] : bounds[shard + 1]] for shard in range(count))
+        return [group for group in groups if group]
+    else:
+        raise ValueError(f"Unknown shard strategy {strategy!r}; expected one of {SHARD_STRATEGIES}")
+
+    # Greedy balance: largest letter bucket goes to the currently smallest shard.
+    shards = [[] for _ in range(shard_count)]
+    for group in groups:
+        min(shards, key=len).extend(group)
+    return [sorted(shard) for shard in shards if shard]
+
+
+def _get_shards(names_data, shard_count=None, strategy=None):
+    """Returns the cached shard layout for ``names_data``; None when sharding is off."""
+    shard_count = SEARCH_SHARD_COUNT if shard_count is None else shard_count
+    strategy = strategy or SEARCH_SHARD_STRATEGY
+    if shard_count <= 1:
+        return None
+
+    cache = names_data.setdefault("shards", {})
+    key = (shard_count, strategy)
+    shards = cache.get(key)
+    if shards is None:
+        shards = []
+        for rows in _partition_rows(names_data, shard_count, strategy):
+            shards.append(
+                {
+                    "ids": rows,
+                    "en": [names_data["en"][idx] for idx in rows],
+                    "ar": [names_data["ar"][idx] for idx in rows],
+                }
+            )
+            # Lanes with no names at all (e.g. English-only shards) are skipped per query.
+            shards[-1]["lanes"] = {lang for lang in ("en", "ar") if any(shards[-1][lang])}
+        shards = cache.setdefault(key, shards)
+    return shards
+
+
+def _subset_shard(names_data, rows):
+    shard = {
+        "ids": rows,
+        "en": [names_data["en"][idx] for idx in rows],
+        "ar": [names_data["ar"][idx] for idx in rows],
+    }
+    shard["lanes"] = {lang for lang in ("en", "ar") if any(shard[lang])}
+    return shard
+
+
+def _strength_subset_shard(names_data, keys, rows):
+    """The subset shard for a strength key tuple, reused across queries sharing it."""
+    cache = names_data.setdefault("strength_subsets", {})
+    shard = cache.get(keys)
+    if shard is None:
+        shard = _subset_shard(names_data, rows)
+        with _SUBSET_LOCK:
+            if sum(len(cached["ids"]) for cached in cache.values()) + len(rows) > STRENGTH_SUBSET_CACHE_ROWS:
+                cache.clear()
+            shard = cache.setdefault(keys, shard)
+    return shard
+
+
+def _get_shard_pool():
+    global _SHARD_POOL
+
+    with _THREAD_LOCK:
+        if _SHARD_POOL is None:
+            _SHARD_POOL = ThreadPoolExecutor(
+                max_workers=max(2, SEARCH_SHARD_COUNT, SEARCH_QUERY_THREADS), thread_name_prefix="search-shard"
+            )
+        return _SHARD_POOL
+
+
+def _extract_shard(query_text, shard, lang, scorer, limit, score_cutoff):
+    if lang not in shard["lanes"]:
+        return []
+    ids = shard["ids"]
+    results = process.extract(query_text, shard[lang], scorer=scorer, limit=limit, score_cutoff=score_cutoff)
+    return [(candidate_text, score, ids[local_idx]) for candidate_text, score, local_idx in results]
+
+
+def _extract_all(query_text, choices, scorer, limit, score_cutoff):
+    return process.extract(query_text, choices, scorer=scorer, limit=limit, score_cutoff=score_cutoff)
+
+
+def _merge_top_k(shard_results, limit):
+    """Merges per-shard top-k lists into the global top-k, ordered like process.extract."""
+    merged = [item for results in shard_results for item in results]
+    merged.sort(key=lambda item: (-item[1], item[2]))
+    return merged[:limit]
+
+
+def _prefilter_candidates(
+    query_variants,
+    names_data,
+    prefer_arabic,
+    limit=40,
+    score_cutoff=30,
+    shard_count=None,
+    shard_strategy=None,
+    row_subset=None,
+    budget=None,
+    query_threads=None,
+    subset_shard=None,
+):
+    """Collects fuzzy prefilter candidates, optionally scanning only ``row_subset`` rows.
+
+    ``subset_shard`` is a prebuilt shard for ``row_subset`` (see _strength_subset_shard).
+
+    With a ``budget``, scans still pending when it runs out are skipped (at least one
+    scan always completes) and the candidates gathered so far are returned.
+    ``query_threads`` overrides SEARCH_QUERY_THREADS.
+    """
     language_order = ["ar", "en"] if prefer_arabic else ["en", "ar"]
     best_by_idx = {}
     scorers = [(fuzz.WRatio, 1.0), (fuzz.token_set_ratio, 0.98)]
-
+    if row_subset is not None:
+        shards = [subset_shard or _subset_shard(names_data, row_subset)]
+    else:
+        shards = _get_shards(names_data, shard_count, shard_strategy)
+    query_threads = SEARCH_QUERY_THREADS if query_threads is None else query_threads
+    if shards is None and query_threads > 1 and len(names_data["en"]) >= QUERY_SPLIT_MIN_ROWS:
+        shards = _get_shards(names_data, query_threads, "contiguous")
+    threaded = query_threads > 1
+
+    # Scatter every (lane, variant, scorer) scan across the shards up front, then
+    # gather in the original order so ties resolve exactly as the serial loop did.
+    scans = []
     for order_idx, lang in enumerate(language_order):
         lane_weight = 1.0 if order_idx == 0 else 0.97
         choices = names_data[lang]
@@ -428,48 +1465,250 @@ def _prefilter_candidates(query_variants, names_data, prefer_arabic, limit=40, s
 
         for query_text, query_weight in query_variants:
             for scorer, scorer_weight in scorers:
-                results = process.extract(
-                    query_text,
-                    choices,
-                    scorer=scorer,
-                    limit=limit,
-                    score_cutoff=score_cutoff,
-                )
-                for candidate_text, score, idx in results:
-                    weighted_score = score * lane_weight * query_weight * scorer_weight
-                    prev = best_by_idx.get(idx)
-                    if prev is None or weighted_score > prev[1]:
-                        best_by_idx[idx] = (candidate_text, weighted_score)
+                if shards is not None and (len(shards) > 1 or threaded):
+                    pool = _get_shard_pool()
+                    pending = [
+                        pool.submit(_extract_shard, query_text, shard, lang, scorer, limit, score_cutoff)
+                        for shard in shards
+                    ]
+                elif threaded:
+                    pending = [_get_shard_pool().submit(_extract_all, query_text, choices, scorer, limit, score_cutoff)]
+                else:
+                    pending = None
+                scans.append((lang, query_text, scorer, (lane_weight, query_weight, scorer_weight), pending))
+
+    for scan_idx, (lang, query_text, scorer, weights, pending) in enumerate(scans):
+        if scan_idx and budget is not None and budget.expired():
+            for _, _, _, _, skipped in scans[scan_idx:]:
+                for future in skipped or ():
+                    future.cancel()
+            break
+
+        lane_weight, query_weight, scorer_weight = weights
+        if pending is not None and len(pending) == 1:
+            results = pending[0].result()
+        elif pending is not None:
+            results = _merge_top_k([future.result() for future in pending], limit)
+        elif shards is not None:
+            results = _extract_shard(query_text, shards[0], lang, scorer, limit, score_cutoff)
+        else:
+            results = process.extract(
+                query_text,
+                names_data[lang],
+                scorer=scorer,
+                limit=limit,
+                score_cutoff=score_cutoff,
+            )
+        for candidate_text, score, idx in results:
+            weighted_score = score * lane_weight * query_weight * scorer_weight
+            prev = best_by_idx.get(idx)
+            if prev is None or weighted_score > prev[1]:
+                best_by_idx[idx] = (candidate_text, weighted_score)
 
     return [(idx, value[0], value[1]) for idx, value in best_by_idx.items()]
 
 
-def _rank_candidates(raw_query, names_data, limit=50, min_score=45):
-    query_variants = _build_query_variants(raw_query)
-    if not query_variants:
-        return []
+def _strength_query_keys(query_sig):
+    """The strength index keys a query selects rows by: its ratios, else its unit values.
+
+    Unit values also select unit-less rows carrying the same bare number."""
+    if query_sig["ratios"]:
+        keys = [("ratio", ratio) for ratio in query_sig["ratios"]]
+        keys.extend(("ratio_set", ratio_set) for ratio_set in query_sig["ratio_sets"])
+        return tuple(sorted(keys))
+    keys = {("value", value) for value in query_sig["values"]}
+    keys.update(("number", NUMBER_RE.match(value).group()) for value in query_sig["values"])
+    return tuple(sorted(keys))
+
+
+def _strength_candidate_rows(query_sig, names_data, keys=None):
+    """Returns rows sharing the query's ratio (or, failing that, unit value); None if no signal."""
+    strength_index = names_data.get("strength_index")
+    if not strength_index:
+        return None
+
+    keys = _strength_query_keys(query_sig) if keys is None else keys
+    if not keys:
+        return None
+
+    rows = set()
+    for key in keys:
+        rows.update(strength_index.get(key, ()))
+    if not rows:
+        return None
+    return sorted(rows)
+
+
+def _ingredient_key(text):
+    """Normalizes an active-ingredient list to a canonical "a+b" key, ignoring order and doses."""
+    names = set()
+    for part in INGREDIENT_SPLIT_RE.split(_normalize_text(text)):
+        words = [word for word in clean_for_match(part).split() if not NUMBER_RE.fullmatch(word)]
+        if words:
+            names.add(" ".join(words))
+    return "+".join(sorted(names))
+
+
+def _equivalence_strength_key(signature, bare_numbers=False):
+    """Unit-free strength key: the ratios, else the unit values' numbers (else bare numbers)."""
+    if signature["ratios"]:
+        return tuple(sorted(signature["ratios"]))
+    if signature["values"]:
+        return tuple(sorted({NUMBER_RE.match(value).group() for value in signature["values"]}))
+    if bare_numbers:
+        return tuple(sorted(signature["numbers"]))
+    return ()
+
+
+def _build_ingredient_index(series, strength_column):
+    keys = _InternedColumn()
+    by_ingredients = {}
+    by_strength = {}
+    for idx, (value, signature) in enumerate(zip(series, strength_column)):
+        key = _ingredient_key(value)
+        keys.append(key)
+        if not key:
+            continue
+        by_ingredients.setdefault(key, array("I")).append(idx)
+        by_strength.setdefault((key, _equivalence_strength_key(signature)), array("I")).append(idx)
+    keys.freeze()
+    return {"keys": keys, "rows": by_ingredients, "strength_rows": by_strength}
+
+
+def _get_ingredient_index(names_data, db_df):
+    ingredients = names_data.get("ingredients")
+    if ingredients is None:
+        if INGREDIENTS_FIELD not in db_df.columns:
+            return None
+        ingredients = names_data.setdefault(
+            "ingredients", _build_ingredient_index(_catalog_series(db_df, INGREDIENTS_FIELD), names_data["strength"])
+        )
+    return ingredients
 
-    primary_query_clean = query_variants[0][0]
-    prefer_arabic = is_arabic(raw_query)
-    query_sig = _extract_strength_signature(raw_query)
-    query_forms = _extract_dosage_forms(raw_query)
-    query_tokens = _extract_alpha_tokens(primary_query_clean)
 
-    prefilter_limit = max(90, limit * 8)
-    candidate_pool = _prefilter_candidates(
-        query_variants,
-        names_data,
-        prefer_arabic=prefer_arabic,
-        limit=prefilter_limit,
-        score_cutoff=30,
-    )
+def find_equivalents(query=None, row_pos=None, match_strength=True, filters=None, columns=None, include_self=False):
+    """Returns the catalog rows sharing active ingredients (and strength), cheapest first.
 
+    Pass ``query`` as ingredient text (e.g. "valsartan+hydrochlorothiazide 160/12.5") or
+    ``row_pos`` as a matched row position (e.g. from SearchResults.row_ids). Rows are dicts
+    like search_live's with an extra ``_price``; rows without a price come last. ``filters``
+    uses the search_live format, e.g. ``{"status": "active"}``.
+    """
+    names_data, db_df = get_search_snapshot()
+    ingredients = _get_ingredient_index(names_data, db_df)
+    if ingredients is None:
+        return []
+
+    if row_pos is not None:
+        key = ingredients["keys"][row_pos]
+        strength_key = _equivalence_strength_key(names_data["strength"][row_pos])
+    elif query:
+        key = _ingredient_key(query)
+        strength_key = _equivalence_strength_key(_extract_strength_signature(query), bare_numbers=True)
+    else:
+        return []
+    if not key:
+        return []
+
+    if match_strength and strength_key:
+        rows = ingredients["strength_rows"].get((key, strength_key), ())
+    else:
+        rows = ingredients["rows"].get(key, ())
+    allowed_rows = _filter_rows(filters, names_data, db_df)
+    if allowed_rows is not None:
+        rows = sorted(set(rows).intersection(allowed_rows))
+    if row_pos is not None and not include_self:
+        rows = [idx for idx in rows if idx != row_pos]
+
+    prices = _numeric_values(names_data, db_df, PRICE_FIELD) if PRICE_FIELD in db_df.columns else None
+    ranked = []
+    for idx in rows:
+        price = None if prices is None or np.isnan(prices[idx]) else float(prices[idx])
+        ranked.append((price is None, price or 0.0, idx, price))
+    ranked.sort()
+
+    equivalents = []
+    for _, _, idx, price in ranked:
+        row = _materialize_row(db_df, names_data["id"][idx], columns)
+        row["_price"] = price
+        equivalents.append(row)
+    return equivalents
+
+
+def _token_deletes(token, max_distance):
+    """Every string reachable from the token's prefix by deleting up to ``max_distance`` characters."""
+    token = token[:TYPO_PREFIX_LENGTH]
+    deletes = {token}
+    frontier = {token}
+    for _ in range(max_distance):
+        frontier = {word[:pos] + word[pos + 1 :] for word in frontier if len(word) > 1 for pos in range(len(word))}
+        deletes.update(frontier)
+    return deletes
+
+
+def _build_typo_index(tokens_column):
+    """Maps vocabulary tokens to their rows and deletion variants to vocabulary tokens."""
+    postings = {}
+    for idx, tokens in enumerate(tokens_column):
+        for token in tokens:
+            postings.setdefault(token, array("I")).append(idx)
+
+    deletes = {}
+    for token in postings:
+        for variant in _token_deletes(token, TYPO_MAX_EDIT_DISTANCE):
+            deletes.setdefault(variant, []).append(token)
+    return {"postings": postings, "deletes": {variant: tuple(tokens) for variant, tokens in deletes.items()}}
+
+
+def _typo_max_distance(token):
+    return 1 if len(token) <= 4 else TYPO_MAX_EDIT_DISTANCE
+
+
+def _typo_candidate_rows(query_tokens, names_data):
+    """Returns rows holding a catalog token within edit distance of a query token; None if no signal."""
+    typo_index = names_data.get("typo_index")
+    if not query_tokens or not typo_index:
+        return None
+
+    postings = typo_index["postings"]
+    deletes = typo_index["deletes"]
+    rows = set()
+    for query_token in query_tokens:
+        max_distance = _typo_max_distance(query_token)
+        candidates = set()
+        for variant in _token_deletes(query_token, max_distance):
+            candidates.update(deletes.get(variant, ()))
+        for token in candidates:
+            token_rows = postings[token]
+            if len(token_rows) > TYPO_TOKEN_MAX_ROWS:
+                continue
+            if Levenshtein.distance(query_token, token, score_cutoff=max_distance) <= max_distance:
+                rows.update(token_rows)
+    if not rows or len(rows) > TYPO_SUBSET_MAX_ROWS:
+        return None
+    return sorted(rows)
+
+
+def _merge_candidate_pools(primary_pool, extra_pool):
+    """Unions two prefilter pools, keeping each row's best score and the primary order."""
+    merged = {idx: (candidate_text, score) for idx, candidate_text, score in primary_pool}
+    for idx, candidate_text, score in extra_pool:
+        prev = merged.get(idx)
+        if prev is None or score > prev[1]:
+            merged[idx] = (candidate_text, score)
+    return [(idx, value[0], value[1]) for idx, value in merged.items()]
+
+
+def _score_candidates(candidate_pool, names_data, query_clean, query_sig, query_forms, query_tokens, min_score, budget):
+    """Re-scores prefilter candidates with _rerank_score; returns ``(idx, score)`` pairs above ``min_score``."""
     scored = []
-    for idx, candidate_clean, pre_score in candidate_pool:
+    for position, (idx, candidate_clean, pre_score) in enumerate(candidate_pool):
+        if position and position % 32 == 0 and budget is not None and budget.expired():
+            break
         if not candidate_clean:
             continue
         score = _rerank_score(
-            primary_query_clean,
+            query_clean,
             candidate_clean,
             pre_score,
             query_sig,
@@ -481,38 +1720,232 @@ def _rank_candidates(raw_query, names_data, limit=50, min_score=45):
         )
         if score >= min_score:
             scored.append((idx, score))
+    return scored
+
+
+def _rank_candidates(
+    raw_query,
+    names_data,
+    limit=50,
+    min_score=45,
+    strength_mode=None,
+    allowed_rows=None,
+    budget=None,
+    typo_mode=None,
+):
+    query_variants = _build_query_variants(raw_query)
+    if not query_variants:
+        return []
+
+    started = time.perf_counter() if _METRICS.enabled else None
+    primary_query_clean = query_variants[0][0]
+    prefer_arabic = is_arabic(raw_query)
+    query_sig = _extract_strength_signature(raw_query)
+    query_forms = _extract_dosage_forms(raw_query)
+    query_tokens = _extract_alpha_tokens(primary_query_clean)
+
+    prefilter_limit = max(90, limit * 8)
+    if allowed_rows is not None and not allowed_rows:
+        return []
+    strength_keys = _strength_query_keys(query_sig)
+    strength_rows = _strength_candidate_rows(query_sig, names_data, strength_keys)
+    if strength_rows is not None and allowed_rows is not None:
+        strength_rows = sorted(set(strength_rows).intersection(allowed_rows)) or None
+    strength_mode = STRENGTH_PREFILTER_MODE if strength_mode is None else strength_mode
+    if strength_rows is not None and len(strength_rows) > STRENGTH_SUBSET_MAX_ROWS and strength_mode != "restrict":
+        # Too common to be a useful signal; the full scan already covers it.
+        strength_rows = None
+    typo_mode = TYPO_PREFILTER_MODE if typo_mode is None else typo_mode
+    typo_rows = None if typo_mode == "off" else _typo_candidate_rows(query_tokens, names_data)
+    if typo_rows is not None and allowed_rows is not None:
+        typo_rows = sorted(set(typo_rows).intersection(allowed_rows)) or None
+
+    # A "restrict" seed replaces the full scan (unless nothing in it is a confident
+    # match); an "include" seed is scanned on top of it. Include seeds are skipped
+    # under a restriction because they would reach rows outside it.
+    strength_restrict = strength_rows is not None and strength_mode == "restrict"
+    typo_restrict = typo_rows is not None and typo_mode == "restrict"
+    if strength_restrict and typo_restrict:
+        both = sorted(set(strength_rows).intersection(typo_rows))
+        seeds = [both or strength_rows]
+    elif strength_restrict:
+        seeds = [strength_rows]
+    elif typo_restrict:
+        seeds = [typo_rows]
+    else:
+        seeds = [rows for rows in (strength_rows, typo_rows) if rows is not None]
+
+    restricted = strength_restrict or typo_restrict
+
+    candidate_pool = []
+    if not restricted:
+        candidate_pool = _prefilter_candidates(
+            query_variants,
+            names_data,
+            prefer_arabic=prefer_arabic,
+            limit=prefilter_limit,
+            score_cutoff=30,
+            row_subset=allowed_rows,
+            budget=budget,
+        )
+    for seed_rows in seeds:
+        if candidate_pool and budget is not None and budget.expired():
+            break
+        subset_shard = None
+        if seed_rows is strength_rows and allowed_rows is None:
+            subset_shard = _strength_subset_shard(names_data, strength_keys, strength_rows)
+        seed_pool = _prefilter_candidates(
+            query_variants,
+            names_data,
+            prefer_arabic=prefer_arabic,
+            limit=prefilter_limit,
+            score_cutoff=30,
+            row_subset=seed_rows,
+            budget=budget,
+            subset_shard=subset_shard,
+        )
+        candidate_pool = _merge_candidate_pools(candidate_pool, seed_pool)
+
+    scoring = (primary_query_clean, query_sig, query_forms, query_tokens, min_score, budget)
+    scored = _score_candidates(candidate_pool, names_data, *scoring)
+    best_score = max((score for _, score in scored), default=0.0)
+    if restricted and best_score < RESTRICT_FALLBACK_SCORE and not (budget is not None and budget.expired()):
+        full_pool = _prefilter_candidates(
+            query_variants,
+            names_data,
+            prefer_arabic=prefer_arabic,
+            limit=prefilter_limit,
+            score_cutoff=30,
+            row_subset=allowed_rows,
+            budget=budget,
+        )
+        candidate_pool = _merge_candidate_pools(candidate_pool, full_pool)
+        scored = _score_candidates(candidate_pool, names_data, *scoring)
 
     scored.sort(key=lambda item: item[1], reverse=True)
+    if started is not None:
+        _M_CANDIDATE_POOL.observe(len(candidate_pool))
+        _M_RANK_LATENCY.observe(time.perf_counter() - started)
     return scored[:limit]
 
 
-def _best_batch_match(raw_query, names_data, accept_score=50):
-    ranked = _rank_candidates(raw_query, names_data, limit=1, min_score=40)
+def _best_batch_match(raw_query, names_data, accept_score=50, allowed_rows=None, budget=None):
+    ranked = _rank_candidates(raw_query, names_data, limit=1, min_score=40, allowed_rows=allowed_rows, budget=budget)
     if ranked and ranked[0][1] >= accept_score:
         return ranked[0]
     return None
 
 
-def search_live(query, limit=50):
-    """Search live against the cached JSON DataFrame."""
+def _materialize_row(db_df, row_pos, columns=None):
+    if hasattr(db_df, "row"):
+        return db_df.row(row_pos, columns)
+    if columns is None:
+        return dict(db_df.iloc[row_pos])
+    return {column: db_df.iat[row_pos, db_df.columns.get_loc(column)] for column in columns if column in db_df.columns}
+
+
+class SearchResults(Sequence):
+    """Ranked ``(row position, score)`` pairs whose catalog rows are built only on access.
+
+    Behaves like the list of row dicts search_live used to return (each row carries
+    ``_score``); ``page()`` and ``to_frame()`` add offset/limit paging and column projection.
+    ``partial`` is True when the query deadline cut the search short.
+    """
+
+    def __init__(self, ranked, db_df, columns=None, partial=False):
+        self.ranked = ranked
+        self.db_df = db_df
+        self.columns = columns
+        self.partial = partial
+
+    def __len__(self):
+        return len(self.ranked)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self._row(row_pos, score, self.columns) for row_pos, score in self.ranked[item]]
+        row_pos, score = self.ranked[item]
+        return self._row(row_pos, score, self.columns)
+
+    def __repr__(self):
+        return f"SearchResults({len(self)} rows)"
+
+    def _row(self, row_pos, score, columns):
+        row = _materialize_row(self.db_df, row_pos, columns)
+        row["_score"] = round(score, 2)
+        return row
+
+    @property
+    def row_ids(self):
+        return [row_pos for row_pos, _ in self.ranked]
+
+    @property
+    def scores(self):
+        return [round(score, 2) for _, score in self.ranked]
+
+    def page(self, offset=0, limit=None, columns=None):
+        """Materializes rows ``offset`` to ``offset + limit`` with only ``columns`` (plus _score)."""
+        columns = self.columns if columns is None else columns
+        end = None if limit is None else offset + limit
+        return [self._row(row_pos, score, columns) for row_pos, score in self.ranked[offset:end]]
+
+    def to_frame(self, columns=None, offset=0, limit=None):
+        rows = self.page(offset, limit, columns)
+        if not rows:
+            return pd.DataFrame(columns=list(columns or []) + ["_score"])
+        return pd.DataFrame(rows)
+
+
+def search_live(query, limit=50, filters=None, columns=None, deadline=None):
+    """Search live against the cached JSON DataFrame.
+
+    Returns a SearchResults sequence of row dicts; ``columns`` limits which catalog
+    columns each row carries. ``filters`` restricts the catalog before fuzzy scoring;
+    see _filter_rows for the format, e.g.
+    ``{"status": "active", "dosage_form": "tablet", "price_retail": (None, 50)}``.
+    ``deadline`` is a time budget in seconds (default SEARCH_DEADLINE_SECONDS).
+    """
     if not query:
-        return []
+        return SearchResults([], None)
 
+    started = time.perf_counter() if _METRICS.enabled or query_log.is_enabled() else None
     try:
-        names_data = get_search_names()
-        db_df = get_master_db()
+        names_data, db_df = get_search_snapshot()
     except Exception as e:
         print(f"Search index error: {e}")
-        return []
+        return SearchResults([], None)
 
-    ranked = _rank_candidates(query, names_data, limit=max(1, limit), min_score=45)
-    matches = []
-    for idx, score in ranked:
-        row_pos = names_data["id"][idx]
-        row = dict(db_df.iloc[row_pos])
-        row["_score"] = round(score, 2)
-        matches.append(row)
-    return matches
+    budget = _QueryBudget(SEARCH_DEADLINE_SECONDS if deadline is None else deadline)
+    allowed_rows = _filter_rows(filters, names_data, db_df)
+    ranked = _rank_candidates(
+        query,
+        names_data,
+        limit=max(1, limit),
+        min_score=45,
+        allowed_rows=allowed_rows,
+        budget=budget,
+    )
+    results = SearchResults(
+        [(names_data["id"][idx], score) for idx, score in ranked],
+        db_df,
+        columns=columns,
+        partial=budget.partial,
+    )
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        _M_SEARCH_LATENCY.observe(elapsed, partial=str(budget.partial).lower())
+        _M_SEARCH_RESULTS.observe(len(ranked))
+        query_log.record(
+            "search",
+            query,
+            elapsed,
+            query_log.result_ids(db_df, results.row_ids) if query_log.is_enabled() else [],
+            results.scores,
+            limit=limit,
+            filters=filters,
+            partial=budget.partial,
+        )
+    return results
 
 
 def safe_read_csv(file_path, **kwargs):
@@ -597,6 +2030,148 @@ def get_file_headers(file_path, sheet_name=0):
     return df.columns.tolist()
 
 
+def is_excel_input(file_path):
+    """True for .xlsx paths and for any file that starts with the zip (xlsx) signature."""
+    if str(file_path).lower().endswith(".xlsx"):
+        return True
+    try:
+        with open(file_path, "rb") as f:
+            return f.read(4) == b"\x50\x4b\x03\x04"
+    except Exception:
+        return False
+
+
+def read_input_frame(file_path, sheet_name=0):
+    """Reads a whole batch input file (xlsx, CSV or JSON) with stripped column names."""
+    if is_excel_input(file_path):
+        input_df = pd.read_excel(file_path, sheet_name=sheet_name)
+    else:
+        input_df = safe_read_csv(file_path)
+    input_df.columns = input_df.columns.str.strip()
+    return input_df
+
+
+# Cell strings pd.read_excel treats as missing by default.
+EXCEL_NA_STRINGS = frozenset(
+    {
+        "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+        "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+    }
+)
+
+
+def open_excel_workbook(file_path):
+    """Opens ``file_path`` in openpyxl's read-only streaming mode (close it when done)."""
+    from openpyxl import load_workbook  # type: ignore
+
+    return load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+
+
+def excel_worksheet(book, sheet_name=0):
+    return book.worksheets[sheet_name] if isinstance(sheet_name, int) else book[sheet_name]
+
+
+def _is_blank_row(values):
+    return all(value is None or value == "" for value in values)
+
+
+def _excel_headers(values):
+    """Column names the way pd.read_excel names them, stripped like read_input_frame."""
+    headers = []
+    seen = {}
+    for position, value in enumerate(values):
+        if value is None or value == "":
+            value = f"Unnamed: {position}"
+        elif isinstance(value, float) and value.is_integer():
+            value = int(value)
+        count = seen.get(value, 0)
+        seen[value] = count + 1
+        if count:
+            value = f"{value}.{count}"
+        headers.append(value.strip() if isinstance(value, str) else value)
+    return headers
+
+
+def _excel_cell(value):
+    # Same conversions pandas' openpyxl reader applies to cell values.
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else value
+    if isinstance(value, str) and value in EXCEL_NA_STRINGS:
+        return None
+    return value
+
+
+def read_excel_headers(worksheet):
+    for values in worksheet.iter_rows(max_row=1, values_only=True):
+        return _excel_headers(values)
+    return []
+
+
+def iter_excel_rows(worksheet, columns=None):
+    """Streams a read-only worksheet as dicts holding only ``columns`` (every column when None).
+
+    Rows match read_input_frame (first row as header, pandas cell conversions, trailing
+    blank rows dropped) without building the whole sheet in memory.
+    """
+    rows = worksheet.iter_rows(values_only=True)
+    headers = next((_excel_headers(values) for values in rows), None)
+    if headers is None:
+        return
+    wanted = headers if columns is None else [column for column in dict.fromkeys(columns) if column in headers]
+    positions = [headers.index(column) for column in wanted]
+    blank = dict.fromkeys(wanted)
+    pending_blank = 0
+    for values in rows:
+        if _is_blank_row(values):
+            # Held back until a later row shows the blank run is not trailing.
+            pending_blank += 1
+            continue
+        for _ in range(pending_blank):
+            yield dict(blank)
+        pending_blank = 0
+        width = len(values)
+        yield {
+            column: _excel_cell(values[position]) if position < width else None
+            for column, position in zip(wanted, positions)
+        }
+
+
+def _closing_rows(book, rows):
+    try:
+        yield from rows
+    finally:
+        book.close()
+
+
+def _open_batch_rows(input_path, sheet_name, input_df, columns):
+    """Returns ``(rows, total)``: an iterator of dicts limited to ``columns`` and a row-count estimate.
+
+    Excel inputs are streamed from a read-only workbook; only ``total`` comes from the
+    sheet's recorded dimensions and may overshoot when trailing rows are blank.
+    """
+    if input_df is None and is_excel_input(input_path):
+        book = open_excel_workbook(input_path)
+        try:
+            worksheet = excel_worksheet(book, sheet_name)
+        except (IndexError, KeyError):
+            book.close()
+            raise
+        total = max((worksheet.max_row or 1) - 1, 0)
+        return _closing_rows(book, iter_excel_rows(worksheet, columns)), total
+
+    if input_df is None:
+        input_df = safe_read_csv(input_path)
+    else:
+        # Shallow copy: the caller's (cached) frame keeps its own column labels.
+        input_df = input_df.copy(deep=False)
+    input_df.columns = input_df.columns.str.strip()
+    present = [column for column in dict.fromkeys(columns) if column in input_df.columns]
+    if not present:
+        return ({} for _ in range(len(input_df))), len(input_df)
+    rows = (dict(zip(present, values)) for values in zip(*(input_df[column] for column in present)))
+    return rows, len(input_df)
+
+
 def get_excel_sheets(file_path):
     """Get list of sheet names from an Excel file."""
     try:
@@ -606,6 +2181,23 @@ def get_excel_sheets(file_path):
         return []
 
 
+def _reserve_output_path(directory, base_name, extension):
+    """Creates an empty, uniquely named output file so concurrent runs never share one."""
+    attempt = 0
+    while True:
+        suffix = f"_{attempt}" if attempt else ""
+        path = os.path.join(directory, f"{base_name}{suffix}.{extension}")
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return path
+        except FileExistsError:
+            attempt += 1
+
+
+class BatchCancelled(Exception):
+    """Raised by run_matching_v2 when its ``cancel_event`` is set."""
+
+
 def run_matching_v2(
     input_path,
     search_col,
@@ -615,97 +2207,211 @@ def run_matching_v2(
     sheet_name=0,
     progress_callback=None,
     status_callback=None,
+    filters=None,
+    row_deadline=None,
+    input_df=None,
+    cancel_event=None,
+    progress_event_callback=None,
+    checkpoint=False,
 ):
-    """Super-powered matching using in-memory JSON data."""
+    """Super-powered matching using in-memory JSON data.
+
+    ``filters`` limits which catalog rows may be matched (same format as search_live).
+    ``row_deadline`` caps the seconds spent matching each distinct query; rows whose
+    match was cut short are flagged in an extra ``match_partial`` column.
+    ``input_df`` is an already parsed input table (e.g. from batch_io.ParsedUpload);
+    ``input_path`` is then only used to place the output file.
+    Setting ``cancel_event`` (a threading.Event) stops the run between rows with
+    BatchCancelled; the partial output file is removed.
+    Progress is throttled (see progress_events): ``progress_callback(done, total)`` and
+    ``progress_event_callback(ProgressEvent)`` get a few updates per second, not one per row.
+    With ``checkpoint=True`` progress is saved next to the output as it runs, and a run
+    interrupted earlier with the same input and options resumes from it (see batch_checkpoint).
+
+    Returns ``(output_path, preview)``: the first BATCH_PREVIEW_ROWS result rows as a
+    DataFrame, with the number of rows written in ``preview.attrs["rows"]``.
+    """
+    started = time.perf_counter()
     try:
-        names_data = get_search_names(status_callback)
-        db_df = get_master_db()
+        names_data, db_df = get_search_snapshot(status_callback)
     except Exception as e:
         raise Exception(f"Data Error: {str(e)}")
 
+    allowed_rows = _filter_rows(filters, names_data, db_df)
+
     if status_callback:
         status_callback("Reading input file...")
 
-    is_xlsx = str(input_path).lower().endswith(".xlsx")
-    if not is_xlsx and os.path.exists(input_path):
-        try:
-            with open(input_path, "rb") as f:
-                if f.read(4) == b"\x50\x4b\x03\x04":
-                    is_xlsx = True
-        except Exception:
-            pass
-
-    if is_xlsx:
-        input_df = pd.read_excel(input_path, sheet_name=sheet_name)
-    else:
-        input_df = safe_read_csv(input_path)
-
-    input_df.columns = input_df.columns.str.strip()
-
-    if input_df.empty:
-        raise ValueError("Input file is empty!")
+    # Only the search column and the kept local columns are read (streamed for xlsx).
+    rows, total = _open_batch_rows(input_path, sheet_name, input_df, [search_col, *local_fields])
 
     if status_callback:
         status_callback("Matching items (JSON In-Memory Mode)...")
 
-    matched_data = []
-    total = len(input_df)
+    preview_rows = []
+    rows_done = 0
     query_cache: Dict[str, Optional[Tuple[int, float]]] = {}
+    partial_queries = set()
+    tracker = progress_events.ProgressTracker(progress_callback, progress_event_callback)
+
+    # Rows are written as they are matched; the writer's columns follow result_row's keys.
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    output_prefix = f"matched_output_{stem}_"
+    checkpoints = resumed = None
+    if checkpoint:
+        fingerprint = batch_checkpoint.run_fingerprint(
+            input_path,
+            names_data.get("source") or getattr(db_df, "attrs", {}).get("source"),
+            len(db_df),
+            search_col=search_col,
+            local_fields=list(local_fields),
+            db_fields=list(db_fields),
+            output_format=output_format,
+            sheet_name=sheet_name,
+            filters=filters,
+            row_deadline=row_deadline,
+        )
+        resumed = batch_checkpoint.find_checkpoint(os.path.dirname(input_path), output_prefix, fingerprint)
+    if resumed is not None:
+        # Rows before resumed.rows_done are replayed from the restored cache, not re-matched.
+        output_path = resumed.output_path
+        os.close(os.open(output_path, os.O_CREAT | os.O_WRONLY))
+        query_cache.update(resumed.query_cache)
+        partial_queries.update(resumed.partial_queries)
+        if status_callback:
+            status_callback(f"Resuming after row {resumed.rows_done} from the last checkpoint...")
+    else:
+        output_path = _reserve_output_path(
+            os.path.dirname(input_path),
+            f"{output_prefix}{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}",
+            result_writers.output_extension(output_format),
+        )
+    if checkpoint:
+        checkpoints = batch_checkpoint.CheckpointWriter(output_path, fingerprint, resumed=resumed)
+    output_columns = list(
+        dict.fromkeys(
+            [*local_fields, "search_query", "match_found", "match_score", *db_fields]
+            + (["match_partial"] if row_deadline is not None else [])
+        )
+    )
+    try:
+        writer = result_writers.open_result_writer(output_path, output_format, output_columns)
+    except Exception:
+        os.remove(output_path)
+        raise
 
-    for i, (_, row) in enumerate(input_df.iterrows()):
-        value = row.get(search_col, "")
-        raw_query = "" if pd.isna(value) or str(value).lower() == "nan" else str(value).strip()
-        query_clean = clean_for_match(raw_query)
-        query_is_ar = is_arabic(raw_query)
-
-        result_row = {}
-        for field in local_fields:
-            result_row[field] = row.get(field)
-
-        result_row["search_query"] = raw_query
-        result_row["match_found"] = "None"
-        result_row["match_score"] = 0
-
-        for field in db_fields:
-            result_row[field] = None
-
-        if query_clean:
-            if query_clean not in query_cache:
-                best = _best_batch_match(raw_query, names_data, accept_score=50)
-                if best is None:
-                    query_cache[query_clean] = None
+    try:
+        for i, row in enumerate(rows):
+            if cancel_event is not None and cancel_event.is_set():
+                raise BatchCancelled("Batch run cancelled")
+            value = row.get(search_col, "")
+            raw_query = "" if pd.isna(value) or str(value).lower() == "nan" else str(value).strip()
+            query_clean = clean_for_match(raw_query)
+            query_is_ar = is_arabic(raw_query)
+
+            result_row = {}
+            for field in local_fields:
+                result_row[field] = row.get(field)
+
+            result_row["search_query"] = raw_query
+            result_row["match_found"] = "None"
+            result_row["match_score"] = 0
+
+            for field in db_fields:
+                result_row[field] = None
+
+            if query_clean:
+                cache_hit = query_clean in query_cache
+                if cache_hit:
+                    _M_BATCH_QUERIES.inc(cache="hit")
+                else:
+                    _M_BATCH_QUERIES.inc(cache="miss")
+                    budget = _QueryBudget(row_deadline)
+                    query_started = time.perf_counter()
+                    best = _best_batch_match(
+                        raw_query,
+                        names_data,
+                        accept_score=50,
+                        allowed_rows=allowed_rows,
+                        budget=budget,
+                    )
+                    if query_log.is_enabled():
+                        query_log.record(
+                            "batch",
+                            raw_query,
+                            time.perf_counter() - query_started,
+                            [] if best is None else query_log.result_ids(db_df, [names_data["id"][best[0]]]),
+                            [] if best is None else [best[1]],
+                            filters=filters,
+                            partial=budget.partial,
+                        )
+                    if budget.partial:
+                        partial_queries.add(query_clean)
+                    if best is None:
+                        query_cache[query_clean] = None
+                    else:
+                        best_idx, best_score = best
+                        row_pos = names_data["id"][best_idx]
+                        query_cache[query_clean] = (row_pos, round(best_score, 2))
+                    if checkpoints is not None:
+                        checkpoints.add(query_clean, query_cache[query_clean], budget.partial)
+                tracker.lookup(cache_hit, len(query_cache))
+
+                cached_match = query_cache.get(query_clean)
+                if cached_match is not None:
+                    row_pos, best_score = cached_match
+                    db_row = db_df.iloc[row_pos]
+                    result_row["match_found"] = db_row.get("name_ar") if query_is_ar else db_row.get("name_en")
+                    result_row["match_score"] = best_score
+                    for field in db_fields:
+                        result_row[field] = db_row.get(field)
                 else:
-                    best_idx, best_score = best
-                    row_pos = names_data["id"][best_idx]
-                    query_cache[query_clean] = (row_pos, round(best_score, 2))
-
-            cached_match = query_cache.get(query_clean)
-            if cached_match is not None:
-                row_pos, best_score = cached_match
-                db_row = db_df.iloc[row_pos]
-                result_row["match_found"] = db_row.get("name_ar") if query_is_ar else db_row.get("name_en")
-                result_row["match_score"] = best_score
-                for field in db_fields:
-                    result_row[field] = db_row.get(field)
+                    result_row["match_found"] = "No Match Found"
             else:
-                result_row["match_found"] = "No Match Found"
-        else:
-            result_row["match_found"] = "Empty Query"
-
-        matched_data.append(result_row)
-        if progress_callback:
-            progress_callback(i + 1, total)
-
-    if status_callback:
-        status_callback("Saving results...")
-
-    final_df = pd.DataFrame(matched_data)
-    output_name = f"matched_output_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.{output_format}"
-    output_path = os.path.join(os.path.dirname(input_path), output_name)
-
-    if output_format == "xlsx":
-        final_df.to_excel(output_path, index=False)
-    else:
-        final_df.to_json(output_path, orient="records", force_ascii=False, indent=2)
-
-    return output_path, final_df
+                result_row["match_found"] = "Empty Query"
+
+            if row_deadline is not None:
+                result_row["match_partial"] = query_clean in partial_queries
+
+            if len(preview_rows) < BATCH_PREVIEW_ROWS:
+                preview_rows.append(result_row)
+            writer.write(result_row)
+            rows_done = i + 1
+            tracker.update(rows_done, max(total, rows_done))
+            if checkpoints is not None and rows_done > checkpoints.rows_saved and checkpoints.due():
+                checkpoints.save(rows_done)
+
+        if not rows_done:
+            raise ValueError("Input file is empty!")
+        tracker.finish(rows_done, rows_done)
+        if checkpoints is not None:
+            # Matching is done; if saving the output fails, a rerun only has to write it.
+            checkpoints.save(rows_done)
+
+        if status_callback:
+            status_callback("Saving results...")
+        writer.close()
+        if checkpoints is not None:
+            checkpoints.remove()
+    except BaseException:
+        writer.abort()
+        if checkpoints is not None and rows_done > checkpoints.rows_saved:
+            try:
+                checkpoints.save(rows_done)  # Cancelled or failed: keep every row done so far.
+            except OSError as e:
+                print(f"Could not save batch checkpoint: {e}")
+        raise
+    finally:
+        close = getattr(rows, "close", None)
+        if close:
+            close()  # Releases a streamed workbook even when matching fails midway.
+
+    preview = pd.DataFrame(preview_rows, columns=output_columns)
+    preview.attrs["rows"] = rows_done
+
+    if _METRICS.enabled:
+        elapsed = time.perf_counter() - started
+        _M_BATCH_ROWS.inc(rows_done)
+        _M_BATCH_DURATION.observe(elapsed)
+        _M_BATCH_THROUGHPUT.set(rows_done / elapsed if elapsed > 0 else 0.0)
+    return output_path, preview
@@ -0,0 +1,82 @@
+"""Reports memory used by the catalog and each search-index component.
+
+Usage: python memory_report.py [--db path/to/druglist.json] [--trace] [--workers N]
+                               [--budget-mb MB] [--json]
+
+Exits with status 1 when ``--budget-mb`` is given and the estimated footprint of
+``--workers`` processes exceeds it.
+"""
+import argparse
+import json
+
+import matcher_v2
+
+
+def _mb(size):
+    return size / 1024 / 1024
+
+
+def _print_section(title, usage, rows):
+    print(f"\n{title}")
+    print(f"{'component':<24}{'MB':>12}{'B/row':>12}{'share':>9}")
+    total = usage.get("total", 0) or 1
+    for key, size in sorted(usage.items(), key=lambda item: item[1], reverse=True):
+        if key == "total":
+            continue
+        print(f"{key:<24}{_mb(size):>12.2f}{size / max(rows, 1):>12.1f}{size / total:>8.1%}")
+    print(f"{'total':<24}{_mb(usage.get('total', 0)):>12.2f}{usage.get('total', 0) / max(rows, 1):>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="Catalog JSON to load instead of the bundled druglist.json")
+    parser.add_argument(
+        "--trace", action="store_true", help="also reload the catalog and rebuild the index under tracemalloc for peaks"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="worker processes to size the budget for")
+    parser.add_argument("--budget-mb", type=float, help="fail when the workers' estimated footprint exceeds this")
+    parser.add_argument("--json", action="store_true", help="print the raw report as JSON")
+    args = parser.parse_args()
+
+    if args.db:
+        matcher_v2.DB_JSON = args.db
+
+    report = matcher_v2.memory_report(trace_build=args.trace)
+    # A shared (memory-mapped) catalog is paid once per host, not once per worker; of
+    # the index only the mapped codes are, the rest is a private copy per worker.
+    shared_bytes = (report["catalog"]["total"] if report["shared"] else 0) + report["index_shared"]
+    per_worker = report["total"] - shared_bytes
+    if args.trace:
+        # Loading needs the retained structures plus the transient build overhead.
+        peaks = report["tracemalloc"]
+        per_worker = max(per_worker, peaks["catalog_retained"] + peaks["index_build_peak"])
+    estimate = shared_bytes + per_worker * max(args.workers, 1)
+    report["estimate"] = {"workers": args.workers, "per_worker": per_worker, "shared": shared_bytes, "total": estimate}
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        rows = report["rows"]
+        print(f"Catalog rows: {rows}{' (shared snapshot)' if report['shared'] else ''}")
+        _print_section("Catalog", report["catalog"], rows)
+        _print_section("Search index", report["index"], rows)
+        index_shared = report["index_shared"]
+        print(
+            f"Index mapped from the snapshot: {_mb(index_shared):.2f} MB; "
+            f"private per process: {_mb(report['index']['total'] - index_shared):.2f} MB"
+        )
+        if args.trace:
+            print("\nBuild (tracemalloc)")
+            for key, size in report["tracemalloc"].items():
+                print(f"{key:<24}{_mb(size):>12.2f}")
+        print(f"\nLoaded total: {_mb(report['total']):.2f} MB ({report['bytes_per_row']:.0f} B/row)")
+        print(f"Estimate for {args.workers} worker(s): {_mb(estimate):.2f} MB")
+
+    if args.budget_mb is not None and _mb(estimate) > args.budget_mb:
+        print(f"Over budget: {_mb(estimate):.2f} MB > {args.budget_mb:.2f} MB")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
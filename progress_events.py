@@ -0,0 +1,157 @@
+"""Throttled progress events for batch matching.
+
+run_matching_v2 reports every row to a ProgressTracker, which forwards an event to the
+UI only when PROGRESS_INTERVAL_SECONDS have passed or the run moved on by
+PROGRESS_STEP_FRACTION since the last one (the first and the final row always get
+one). A million-row file therefore costs a few hundred UI updates instead of a
+million. Each event carries throughput, query-cache hit rate, the number of distinct
+queries matched so far and an ETA.
+
+Settings: HENEDY_PROGRESS_INTERVAL (seconds, default 0.5).
+"""
+import os
+import time
+
+PROGRESS_INTERVAL_SECONDS = float(os.environ.get("HENEDY_PROGRESS_INTERVAL") or 0.5)
+PROGRESS_STEP_FRACTION = 0.01
+
+
+def format_duration(seconds):
+    """``1:02:03`` / ``2:03`` style duration for progress text."""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class ProgressEvent:
+    """A snapshot of a batch run; cheap to create and safe to hand to another thread."""
+
+    __slots__ = ("done", "total", "elapsed", "cache_hits", "cache_misses", "unique_queries")
+
+    def __init__(self, done, total, elapsed, cache_hits=0, cache_misses=0, unique_queries=0):
+        self.done = done
+        self.total = total
+        self.elapsed = elapsed
+        self.cache_hits = cache_hits
+        self.cache_misses = cache_misses
+        self.unique_queries = unique_queries
+
+    @property
+    def fraction(self):
+        return min(1.0, self.done / self.total) if self.total else 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def cache_hit_rate(self):
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else 0.0
+
+    @property
+    def eta_seconds(self):
+        """Seconds left at the current rate; None until there is a rate to go by."""
+        rate = self.rows_per_second
+        if not rate or not self.total:
+            return None
+        return max(0, self.total - self.done) / rate
+
+    def describe(self):
+        """One-line summary shown by both UIs."""
+        parts = [
+            f"{self.done:,}/{self.total:,} rows",
+            f"{self.rows_per_second:,.0f} rows/s",
+            f"{self.cache_hit_rate:.0%} cache hits",
+            f"{self.unique_queries:,} unique queries",
+        ]
+        eta = self.eta_seconds
+        if eta is not None and self.done < self.total:
+            parts.append(f"ETA {format_duration(eta)}")
+        return " · ".join(parts)
+
+    def __repr__(self):
+        return f"ProgressEvent({self.describe()})"
+
+
+def combine_events(events, elapsed):
+    """Totals of several concurrent runs (e.g. one per file) over ``elapsed`` wall seconds."""
+    events = [event for event in events if event is not None]
+    return ProgressEvent(
+        sum(event.done for event in events),
+        sum(event.total for event in events),
+        elapsed,
+        sum(event.cache_hits for event in events),
+        sum(event.cache_misses for event in events),
+        sum(event.unique_queries for event in events),
+    )
+
+
+class ProgressTracker:
+    """Counts rows and cache lookups, and decides when an event is worth sending.
+
+    ``callback(done, total)`` is the plain progress callback; ``event_callback(event)``
+    receives the full ProgressEvent. Both see the same throttled updates.
+    """
+
+    def __init__(self, callback=None, event_callback=None, interval=None, step=None, clock=time.monotonic):
+        self.callback = callback
+        self.event_callback = event_callback
+        self.interval = PROGRESS_INTERVAL_SECONDS if interval is None else interval
+        self.step = PROGRESS_STEP_FRACTION if step is None else step
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.unique_queries = 0
+        self.events_sent = 0
+        self._clock = clock
+        self._started = clock()
+        self._last_time = None
+        self._last_fraction = 0.0
+
+    @property
+    def enabled(self):
+        return self.callback is not None or self.event_callback is not None
+
+    def lookup(self, hit, unique_queries):
+        """Records one query-cache lookup; ``unique_queries`` is the cache size after it."""
+        if hit:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+        self.unique_queries = unique_queries
+
+    def update(self, done, total):
+        """Called once per row; sends an event only when the throttle allows it."""
+        if not self.enabled:
+            return
+        now = self._clock()
+        fraction = done / total if total else 0.0
+        if (
+            self._last_time is not None
+            and now - self._last_time < self.interval
+            and fraction - self._last_fraction < self.step
+        ):
+            return
+        self._send(done, total, now, fraction)
+
+    def finish(self, done, total):
+        """Sends the final event regardless of the throttle."""
+        if self.enabled:
+            now = self._clock()
+            self._send(done, total, now, done / total if total else 1.0)
+
+    def event(self, done, total, now=None):
+        now = self._clock() if now is None else now
+        return ProgressEvent(
+            done, total, now - self._started, self.cache_hits, self.cache_misses, self.unique_queries
+        )
+
+    def _send(self, done, total, now, fraction):
+        self._last_time = now
+        self._last_fraction = fraction
+        self.events_sent += 1
+        if self.callback is not None:
+            self.callback(done, total)
+        if self.event_callback is not None:
+            self.event_callback(self.event(done, total, now))
@@ -0,0 +1,240 @@
+"""Query log capture and replay.
+
+With ``HENEDY_QUERY_LOG=<path>`` (or start_logging()) every search_live call and every
+distinct batch query is appended to a JSON-lines log with its timing and result ids.
+``python query_log.py replay <log>`` runs a captured log against the current code at a
+chosen concurrency and reports throughput, latency percentiles and ranking diffs against
+the recorded results.
+"""
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_STATE = {"path": os.environ.get("HENEDY_QUERY_LOG") or None, "file": None}
+_LOCK = threading.Lock()
+
+
+def is_enabled():
+    return _STATE["path"] is not None
+
+
+def start_logging(path):
+    """Starts appending queries to ``path`` (closing any previous log)."""
+    stop_logging()
+    with _LOCK:
+        _STATE["path"] = path
+
+
+def stop_logging():
+    with _LOCK:
+        if _STATE["file"] is not None:
+            _STATE["file"].close()
+        _STATE["path"] = None
+        _STATE["file"] = None
+
+
+def _encode_filters(filters):
+    if not filters:
+        return None
+    # Ranges are tuples and value lists are lists in _filter_rows; JSON would merge them.
+    return {field: {"range": list(value)} if isinstance(value, tuple) else value for field, value in filters.items()}
+
+
+def _decode_filters(filters):
+    if not filters:
+        return None
+    return {
+        field: tuple(value["range"]) if isinstance(value, dict) and "range" in value else value
+        for field, value in filters.items()
+    }
+
+
+def record(kind, query, elapsed, ids, scores, limit=None, filters=None, partial=False):
+    """Appends one query to the log; a no-op unless logging is enabled."""
+    if _STATE["path"] is None:
+        return
+    entry = {
+        "ts": round(time.time(), 3),
+        "kind": kind,
+        "q": query,
+        "limit": limit,
+        "filters": _encode_filters(filters),
+        "ms": round(elapsed * 1000, 3),
+        "ids": ids,
+        "scores": [round(float(score), 2) for score in scores],
+        "partial": partial,
+    }
+    line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+    with _LOCK:
+        if _STATE["path"] is None:
+            return
+        try:
+            if _STATE["file"] is None:
+                _STATE["file"] = open(_STATE["path"], "a", encoding="utf-8", buffering=1)
+            _STATE["file"].write(line)
+        except OSError as e:
+            print(f"Query log disabled: {e}")
+            _STATE["path"] = None
+
+
+def result_ids(db_df, row_positions):
+    """Stable catalog ids for logged results (row positions when the catalog has no id column)."""
+    import matcher_v2
+
+    if db_df is None or "id" not in db_df.columns:
+        return [int(pos) for pos in row_positions]
+    ids = []
+    for pos in row_positions:
+        value = matcher_v2._materialize_row(db_df, pos, ["id"]).get("id")
+        ids.append(value.item() if hasattr(value, "item") else value)
+    return ids
+
+
+def load_log(path, kinds=None):
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping malformed log line {line_no}")
+                continue
+            if kinds is None or entry.get("kind") in kinds:
+                entries.append(entry)
+    return entries
+
+
+def _replay_one(entry):
+    import matcher_v2
+
+    filters = _decode_filters(entry.get("filters"))
+    started = time.perf_counter()
+    if entry.get("kind") == "batch":
+        names_data, db_df = matcher_v2.get_search_snapshot()
+        allowed_rows = matcher_v2._filter_rows(filters, names_data, db_df)
+        best = matcher_v2._best_batch_match(entry["q"], names_data, accept_score=50, allowed_rows=allowed_rows)
+        ranked = [] if best is None else [(names_data["id"][best[0]], best[1])]
+    else:
+        results = matcher_v2.search_live(entry["q"], limit=entry.get("limit") or 50, filters=filters)
+        db_df = results.db_df
+        ranked = results.ranked
+    elapsed = time.perf_counter() - started
+    return elapsed, result_ids(db_df, [pos for pos, _ in ranked])
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def replay(entries, concurrency=1, max_diffs=10):
+    """Replays ``entries`` on ``concurrency`` threads and returns a report dict."""
+    import matcher_v2
+
+    matcher_v2.get_search_snapshot()  # Build the index before the clock starts.
+    latencies = [None] * len(entries)
+    replayed_ids = [None] * len(entries)
+    errors = 0
+
+    def _run(position):
+        latencies[position], replayed_ids[position] = _replay_one(entries[position])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        for future in [pool.submit(_run, position) for position in range(len(entries))]:
+            try:
+                future.result()
+            except Exception as e:
+                errors += 1
+                print(f"Replay error: {e}")
+    wall = time.perf_counter() - started
+
+    done = sorted(latency * 1000 for latency in latencies if latency is not None)
+    recorded = sorted(entry.get("ms", 0.0) for entry in entries)
+    identical = top1_changed = 0
+    overlaps = []
+    diffs = []
+    for entry, ids in zip(entries, replayed_ids):
+        if ids is None:
+            continue
+        before = entry.get("ids") or []
+        if ids == before:
+            identical += 1
+            overlaps.append(1.0)
+            continue
+        if (ids[:1] or [None]) != (before[:1] or [None]):
+            top1_changed += 1
+        union = set(ids) | set(before)
+        overlaps.append(len(set(ids) & set(before)) / len(union) if union else 1.0)
+        if len(diffs) < max_diffs:
+            diffs.append({"q": entry["q"], "recorded": before[:5], "replayed": ids[:5]})
+
+    return {
+        "queries": len(entries),
+        "errors": errors,
+        "concurrency": concurrency,
+        "wall_seconds": wall,
+        "throughput_qps": len(done) / wall if wall > 0 else 0.0,
+        "latency_ms": {pct: _percentile(done, pct) for pct in (50, 90, 95, 99, 100)},
+        "recorded_latency_ms": {pct: _percentile(recorded, pct) for pct in (50, 90, 99)},
+        "identical": identical,
+        "top1_changed": top1_changed,
+        "mean_overlap": sum(overlaps) / len(overlaps) if overlaps else 1.0,
+        "diffs": diffs,
+    }
+
+
+def print_report(report):
+    print(f"Replayed {report['queries']} queries on {report['concurrency']} thread(s) in {report['wall_seconds']:.2f}s")
+    print(f"Throughput: {report['throughput_qps']:.1f} queries/s, errors: {report['errors']}")
+    latency = report["latency_ms"]
+    recorded = report["recorded_latency_ms"]
+    print(
+        f"Latency ms   p50 {latency[50]:8.2f}  p90 {latency[90]:8.2f}  p95 {latency[95]:8.2f}"
+        f"  p99 {latency[99]:8.2f}  max {latency[100]:8.2f}"
+    )
+    print(f"Recorded ms  p50 {recorded[50]:8.2f}  p90 {recorded[90]:8.2f}  p99 {recorded[99]:8.2f}")
+    print(
+        f"Rankings: {report['identical']} identical, {report['top1_changed']} top-1 changes,"
+        f" mean overlap {report['mean_overlap']:.3f}"
+    )
+    for diff in report["diffs"]:
+        print(f"  {diff['q']!r}: {diff['recorded']} -> {diff['replayed']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a captured query log against the current matcher.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    replay_parser = sub.add_parser("replay", help="replay a JSON-lines query log")
+    replay_parser.add_argument("log")
+    replay_parser.add_argument("--concurrency", type=int, default=1)
+    replay_parser.add_argument("--kind", choices=("search", "batch"), action="append", help="only replay these kinds")
+    replay_parser.add_argument("--repeat", type=int, default=1, help="replay the log this many times")
+    replay_parser.add_argument("--diffs", type=int, default=10, help="ranking diffs to print")
+    replay_parser.add_argument("--db", help="catalog JSON to load instead of druglist.json")
+    args = parser.parse_args(argv)
+
+    stop_logging()  # Never append the replay to the log being replayed.
+    if args.db:
+        import matcher_v2
+
+        matcher_v2.DB_JSON = args.db
+    entries = load_log(args.log, set(args.kind) if args.kind else None) * max(1, args.repeat)
+    if not entries:
+        print("No queries to replay.")
+        return 1
+    print_report(replay(entries, args.concurrency, args.diffs))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
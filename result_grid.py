@@ -0,0 +1,272 @@
+"""Virtualized grid for browsing large batch outputs in the desktop app.
+
+A ttk.Treeview with one item per row freezes Tk at a few ten thousand rows. Here the
+rows live in a columnar result store (see columnar_store) and a ResultView keeps the
+current sort and filter as an array of row positions; VirtualGrid owns only as many
+Treeview items as fit on screen and rewrites their values when the view scrolls.
+
+Sorting and filtering are vectorized: numeric columns (match_score) are compared as
+arrays, and text columns (match_found) are factorized once so a sort is an integer
+argsort and a text filter only tests each distinct value.
+"""
+import os
+from tkinter import ttk
+
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+import columnar_store
+
+SCORE_COLUMN = "match_score"
+MATCH_COLUMN = "match_found"
+WHEEL_ROWS = 3
+
+
+def open_result_store(path):
+    """Opens a batch output as a ColumnarCatalog: ``.columns`` files are mapped, other formats are read once."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".columns":
+        return columnar_store.open_catalog(path)
+    if extension == ".csv":
+        frame = pd.read_csv(path, encoding="utf-8-sig")
+    elif extension == ".jsonl":
+        frame = pd.read_json(path, lines=True)
+    elif extension == ".json":
+        frame = pd.read_json(path)
+    elif extension in (".xlsx", ".xls"):
+        frame = pd.read_excel(path)
+    else:
+        raise ValueError(f"Unsupported result file: {os.path.basename(path)}")
+    return columnar_store.ColumnarCatalog(
+        {str(column): frame[column].to_numpy() for column in frame.columns}, rows=len(frame), mapped=False
+    )
+
+
+def _display(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ""
+    return value
+
+
+class ResultView:
+    """Sorted, filtered window onto a result store; ``order`` holds the visible row positions."""
+
+    def __init__(self, store):
+        self.store = store
+        self.columns = list(store.columns)
+        self.sort_column = None
+        self.descending = False
+        self.min_score = None
+        self.max_score = None
+        self.text = ""
+        self._factorized = {}
+        self.order = np.arange(len(store), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.order)
+
+    def _numeric(self, column):
+        values = self.store[column]
+        if isinstance(values, np.ndarray) and values.dtype.kind in "biuf":
+            return values
+        return None
+
+    def _factorize(self, column):
+        """``(codes, uniques)`` for a text column; codes follow sorted order and are -1 for missing values."""
+        cached = self._factorized.get(column)
+        if cached is None:
+            values = self.store[column]
+            values = values.tolist() if isinstance(values, columnar_store.StringColumn) else list(values)
+            try:
+                codes, uniques = pd.factorize(pd.Series(values, dtype=object), sort=True)
+            except TypeError:
+                # Mixed numbers and text cannot be ordered together; order them as text.
+                codes, uniques = pd.factorize(pd.Series([_display(v) for v in values], dtype=str), sort=True)
+            cached = self._factorized[column] = (codes, uniques)
+        return cached
+
+    def _sort_keys(self, column, descending):
+        numeric = self._numeric(column)
+        if numeric is not None:
+            keys = numeric.astype(np.float64)
+            return -keys if descending else keys  # NaN stays last either way.
+        codes, uniques = self._factorize(column)
+        if descending:
+            return -np.where(codes < 0, -1, codes)
+        return np.where(codes < 0, len(uniques), codes)
+
+    def sort(self, column, descending=None):
+        """Sorts by ``column``; without ``descending`` a repeated sort on the same column flips direction."""
+        if descending is None:
+            descending = not self.descending if column == self.sort_column else column == SCORE_COLUMN
+        self.sort_column = column
+        self.descending = descending
+        self._apply()
+
+    def set_filter(self, min_score=None, max_score=None, text=""):
+        """Keeps rows with ``min_score <= match_score <= max_score`` whose match_found contains ``text``."""
+        self.min_score = min_score
+        self.max_score = max_score
+        self.text = (text or "").strip().lower()
+        self._apply()
+
+    def _mask(self):
+        mask = None
+        if (self.min_score is not None or self.max_score is not None) and SCORE_COLUMN in self.columns:
+            scores = np.asarray(self.store[SCORE_COLUMN], dtype=np.float64)
+            mask = np.ones(len(scores), dtype=bool)
+            if self.min_score is not None:
+                mask &= scores >= self.min_score
+            if self.max_score is not None:
+                mask &= scores <= self.max_score
+        if self.text and MATCH_COLUMN in self.columns:
+            codes, uniques = self._factorize(MATCH_COLUMN)
+            hits = np.fromiter((self.text in str(value).lower() for value in uniques), dtype=bool, count=len(uniques))
+            text_mask = np.append(hits, False)[codes]  # Code -1 (missing) picks the trailing False.
+            mask = text_mask if mask is None else mask & text_mask
+        return mask
+
+    def _apply(self):
+        mask = self._mask()
+        positions = np.arange(len(self.store), dtype=np.int64) if mask is None else np.flatnonzero(mask)
+        if self.sort_column is not None:
+            keys = self._sort_keys(self.sort_column, self.descending)[positions]
+            positions = positions[np.argsort(keys, kind="stable")]
+        self.order = positions
+
+    def rows(self, start, stop, columns=None):
+        """Display values for view rows ``start:stop`` as tuples, one value per column."""
+        columns = self.columns if columns is None else columns
+        positions = self.order[start:stop]
+        data = []
+        for column in columns:
+            values = self.store[column]
+            if isinstance(values, np.ndarray):
+                data.append([_display(columnar_store._scalar(value)) for value in values[positions]])
+            else:
+                data.append([_display(values[int(position)]) for position in positions])
+        return list(zip(*data)) if data else [() for _ in positions]
+
+
+class VirtualGrid(ttk.Frame):
+    """Treeview that renders only the visible rows of a ResultView."""
+
+    def __init__(self, master, row_height=30, on_sort=None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.view = None
+        self.columns = []
+        self.offset = 0
+        self.row_height = row_height
+        self.on_sort = on_sort
+        self._items = []
+        # Selected rows by store position, so a selection survives scrolling, sorting and filtering.
+        self._selected = set()
+
+        self.tree = ttk.Treeview(self, show="headings", selectmode="extended", height=1)
+        self.vsb = ttk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        hsb = ttk.Scrollbar(self, orient="horizontal", command=self.tree.xview)
+        self.tree.configure(xscrollcommand=hsb.set)
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.vsb.grid(row=0, column=1, sticky="ns")
+        hsb.grid(row=1, column=0, sticky="ew")
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        self.tree.bind("<Configure>", lambda e: self._resize(e.height))
+        self.tree.bind("<<TreeviewSelect>>", lambda e: self._sync_selection())
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll(-WHEEL_ROWS if e.delta > 0 else WHEEL_ROWS))
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-WHEEL_ROWS))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(WHEEL_ROWS))
+        self.tree.bind("<Prior>", lambda e: self.scroll(-len(self._items)))
+        self.tree.bind("<Next>", lambda e: self.scroll(len(self._items)))
+        self.tree.bind("<Home>", lambda e: self.scroll_to(0))
+        self.tree.bind("<End>", lambda e: self.scroll_to(len(self.view) if self.view else 0))
+
+    def set_view(self, view, columns=None):
+        self.view = view
+        self._selected = set()
+        self.set_columns(columns or view.columns)
+
+    def set_columns(self, columns):
+        self.columns = list(columns)
+        self.tree["columns"] = self.columns
+        for column in self.columns:
+            self.tree.heading(column, text=self._heading(column), command=lambda c=column: self.sort(c))
+            self.tree.column(column, width=120, anchor="w")
+        self.scroll_to(self.offset)
+
+    def _heading(self, column):
+        if self.view is not None and self.view.sort_column == column:
+            return f"{column} {'▼' if self.view.descending else '▲'}"
+        return column
+
+    def sort(self, column):
+        self.view.sort(column)
+        for name in self.columns:
+            self.tree.heading(name, text=self._heading(name))
+        self.scroll_to(0)
+        if self.on_sort:
+            self.on_sort(column)
+
+    def refresh(self):
+        """Re-renders after the view's filter or sort changed."""
+        self.scroll_to(0)
+
+    def _resize(self, height):
+        # Keep exactly as many items as fit; one item per visible row, reused on scroll.
+        visible = max(1, (height - self.row_height) // self.row_height)
+        while len(self._items) < visible:
+            self._items.append(self.tree.insert("", "end", values=()))
+        while len(self._items) > visible:
+            self.tree.delete(self._items.pop())
+        self.scroll_to(self.offset)
+
+    def scroll(self, rows):
+        self.scroll_to(self.offset + rows)
+
+    def scroll_to(self, offset):
+        total = len(self.view) if self.view is not None else 0
+        self.offset = max(0, min(offset, total - len(self._items)))
+        self._render()
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            total = len(self.view) if self.view is not None else 0
+            self.scroll_to(int(float(amount) * total))
+        elif action == "scroll":
+            step = len(self._items) if unit == "pages" else 1
+            self.scroll(int(amount) * step)
+
+    def _render(self):
+        total = len(self.view) if self.view is not None else 0
+        rows = self.view.rows(self.offset, self.offset + len(self._items), self.columns) if total else []
+        for position, item in enumerate(self._items):
+            self.tree.item(item, values=rows[position] if position < len(rows) else ())
+        positions = self._visible_positions()
+        self.tree.selection_set([item for item, row in zip(self._items, positions) if row in self._selected])
+        if total:
+            self.vsb.set(self.offset / total, min(1.0, (self.offset + len(self._items)) / total))
+        else:
+            self.vsb.set(0, 1)
+
+    def _visible_positions(self):
+        if self.view is None:
+            return []
+        return [int(row) for row in self.view.order[self.offset : self.offset + len(self._items)]]
+
+    def _sync_selection(self):
+        selected = set(self.tree.selection())
+        for item, row in zip(self._items, self._visible_positions()):
+            if item in selected:
+                self._selected.add(row)
+            else:
+                self._selected.discard(row)
+
+    def selected_values(self):
+        """Values of the selected rows (on screen or not) for the displayed columns."""
+        store = self.view.store if self.view is not None else None
+        if store is None:
+            return []
+        return [
+            [_display(value) for value in store.row(row, self.columns).values()] for row in sorted(self._selected)
+        ]
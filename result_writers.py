@@ -0,0 +1,229 @@
+"""Incremental writers for batch matching results.
+
+run_matching_v2 hands each result row to a writer as soon as it is matched, so the
+output file grows while matching runs instead of being rendered from one big frame
+at the end. Stays free of heavy imports: the desktop app reads OUTPUT_FORMATS at startup.
+"""
+import csv
+import datetime
+import json
+import math
+import os
+
+# Format key -> (UI label, file extension, MIME type).
+OUTPUT_FORMATS = {
+    "xlsx": ("Excel", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("CSV", "csv", "text/csv"),
+    "jsonl": ("JSON Lines", "jsonl", "application/x-ndjson"),
+    "json": ("JSON", "json", "application/json"),
+    "columns": ("Columnar", "columns", "application/octet-stream"),
+}
+
+WRITE_BATCH_ROWS = 2000
+
+_PLAIN_TYPES = frozenset({str, int, bool})
+
+
+def _format_info(output_format):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {output_format!r}; expected one of {list(OUTPUT_FORMATS)}")
+    return OUTPUT_FORMATS[output_format]
+
+
+def output_extension(output_format):
+    return _format_info(output_format)[1]
+
+
+def output_mime_type(output_format):
+    return _format_info(output_format)[2]
+
+
+def _plain_value(value):
+    """Converts numpy/pandas scalars to plain Python values; NaN and NaT become None."""
+    if value is None or type(value) in _PLAIN_TYPES:
+        return value
+    if type(value) is float:
+        return None if math.isnan(value) else value
+    if hasattr(value, "item") and not isinstance(value, (str, bytes)):
+        try:
+            value = value.item()
+        except (ValueError, AttributeError):
+            pass
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if type(value).__name__ == "NaTType":
+        return None
+    if hasattr(value, "to_pydatetime"):
+        value = value.to_pydatetime()
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+_JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, default=_json_default)
+
+
+class _ResultWriter:
+    """Buffers rows and flushes them in batches; subclasses implement _flush and _finish."""
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = list(columns)
+        self.rows_written = 0
+        self._buffer = []
+
+    def write(self, row):
+        self._buffer.append([_plain_value(row.get(column)) for column in self.columns])
+        if len(self._buffer) >= WRITE_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._flush(self._buffer)
+            self.rows_written += len(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        self.flush()
+        self._finish()
+
+    def abort(self):
+        """Stops writing and removes the partial output."""
+        self._buffer = []
+        try:
+            self._finish()
+        except Exception:
+            pass
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _flush(self, rows):
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+
+class _CsvWriter(_ResultWriter):
+    def __init__(self, path, columns):
+        super().__init__(path, columns)
+        # utf-8-sig so Excel shows Arabic names correctly when opening the CSV.
+        self._file = open(path, "w", encoding="utf-8-sig", newline="")
+        self._csv = csv.writer(self._file)
+        self._csv.writerow(self.columns)
+
+    def _flush(self, rows):
+        self._csv.writerows(rows)
+
+    def _finish(self):
+        self._file.close()
+
+
+class _JsonLinesWriter(_ResultWriter):
+    def __init__(self, path, columns):
+        super().__init__(path, columns)
+        self._file = open(path, "w", encoding="utf-8")
+
+    def _encode(self, values):
+        return _JSON_ENCODER.encode(dict(zip(self.columns, values)))
+
+    def _flush(self, rows):
+        self._file.write("".join(self._encode(values) + "\n" for values in rows))
+
+    def _finish(self):
+        self._file.close()
+
+
+class _JsonArrayWriter(_JsonLinesWriter):
+    """A JSON array of records, written element by element."""
+
+    def __init__(self, path, columns):
+        super().__init__(path, columns)
+        self._file.write("[")
+
+    def _flush(self, rows):
+        separator = ",\n" if self.rows_written else "\n"
+        self._file.write(separator + ",\n".join(self._encode(values) for values in rows))
+
+    def _finish(self):
+        if not self._file.closed:
+            self._file.write("\n]\n" if self.rows_written else "]\n")
+        super()._finish()
+
+
+class _XlsxWriter(_ResultWriter):
+    """openpyxl write-only workbook: rows are serialized as they are appended."""
+
+    def __init__(self, path, columns):
+        super().__init__(path, columns)
+        from openpyxl import Workbook  # type: ignore
+
+        self._book = Workbook(write_only=True)
+        self._sheet = self._book.create_sheet("Sheet1")
+        self._sheet.append(self.columns)
+
+    def _flush(self, rows):
+        for values in rows:
+            self._sheet.append(values)
+
+    def _finish(self):
+        if self._book is not None:
+            book, self._book = self._book, None
+            book.save(self.path)
+
+    def abort(self):
+        # Nothing reaches self.path before save(); just drop the sheet's temp file.
+        if self._book is not None:
+            self._book = None
+            self._sheet.close()
+            sheet_writer = getattr(self._sheet, "_writer", None)
+            if sheet_writer is not None:
+                sheet_writer.cleanup()
+        super().abort()
+
+
+class _ColumnarWriter(_ResultWriter):
+    """A compiled columnar file (see columnar_store); columns are gathered and written on close."""
+
+    def __init__(self, path, columns):
+        super().__init__(path, columns)
+        self._data = {column: [] for column in self.columns}
+
+    def _flush(self, rows):
+        for position, column in enumerate(self.columns):
+            self._data[column].extend(values[position] for values in rows)
+
+    def _finish(self):
+        if self._data is None:
+            return
+        import pandas as pd  # type: ignore
+
+        import columnar_store
+
+        data, self._data = self._data, None
+        columnar_store.compile_catalog(pd.DataFrame(data, columns=self.columns), self.path)
+
+    def abort(self):
+        self._data = None
+        super().abort()
+
+
+_WRITERS = {
+    "xlsx": _XlsxWriter,
+    "csv": _CsvWriter,
+    "jsonl": _JsonLinesWriter,
+    "json": _JsonArrayWriter,
+    "columns": _ColumnarWriter,
+}
+
+
+def open_result_writer(path, output_format, columns):
+    """Returns a writer with write(row_dict), close() and abort() for ``output_format``."""
+    _format_info(output_format)
+    return _WRITERS[output_format](path, columns)
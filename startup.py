@@ -0,0 +1,92 @@
+"""Lightweight startup helpers shared by the two apps.
+
+Import this module first: it anchors the startup clock used for time-to-interactive
+reporting and must stay free of heavy imports (pandas, numpy, rapidfuzz).
+"""
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+
+STARTED = time.perf_counter()
+_MARKS = {}
+_CONFIG_CACHE = {}
+
+
+def get_base_path():
+    """Returns the base path for resources, compatible with scripts and EXEs."""
+    if getattr(sys, "frozen", False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def mark(label):
+    """Records the seconds since startup at which ``label`` was reached (first time only)."""
+    return _MARKS.setdefault(label, time.perf_counter() - STARTED)
+
+
+def get_marks():
+    return dict(_MARKS)
+
+
+def format_marks():
+    return ", ".join(f"{label} {seconds:.2f}s" for label, seconds in sorted(_MARKS.items(), key=lambda item: item[1]))
+
+
+def load_config_fields(path=None):
+    """Returns the ``fields`` list from config.json, re-reading only when the file changes."""
+    path = path or os.path.join(get_base_path(), "config.json")
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return []
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _CONFIG_CACHE.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            fields = json.load(f).get("fields", [])
+    except (OSError, ValueError, AttributeError):
+        fields = []
+    _CONFIG_CACHE[path] = (key, fields)
+    return fields
+
+
+class LazyModule:
+    """Module proxy that imports on first attribute access (or in the background via preload)."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+                module = self._module
+        return module
+
+    def preload(self, callback=None):
+        """Imports the module on a daemon thread, then calls ``callback(module)``."""
+
+        def _run():
+            module = self.load()
+            if callback:
+                callback(module)
+
+        thread = threading.Thread(target=_run, name=f"import-{self._name}", daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
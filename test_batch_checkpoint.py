@@ -0,0 +1,142 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import batch_checkpoint
+import matcher_v2
+from test_search_index import build_sample_catalog
+
+QUERIES = ["Concor 5mg", "Cetal", "panadol 500", "", "concor 5 mg", "Cetal", "xyz unknown", "Panadol Extra", "Concor 5mg"]
+
+
+class TestResumableRuns(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = build_sample_catalog()
+        cls.names = matcher_v2._build_search_names(cls.df)
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        for patcher in (
+            mock.patch.object(matcher_v2, "get_search_snapshot", return_value=(self.names, self.df)),
+            mock.patch.object(batch_checkpoint, "CHECKPOINT_INTERVAL_SECONDS", 0),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.input_path = self._write_input("work", "upload.csv")
+
+    def _write_input(self, folder, name):
+        os.makedirs(os.path.join(self._tmp.name, folder), exist_ok=True)
+        path = os.path.join(self._tmp.name, folder, name)
+        pd.DataFrame({"Drug": QUERIES, "Qty": range(len(QUERIES))}).to_csv(path, index=False)
+        return path
+
+    def _run(self, input_path, checkpoint=True, **kwargs):
+        return matcher_v2.run_matching_v2(
+            input_path, "Drug", ["Qty"], ["price_retail"], "csv", checkpoint=checkpoint, **kwargs
+        )
+
+    def _crash_after(self, calls):
+        real_match = matcher_v2._best_batch_match
+        state = {"calls": 0}
+
+        def flaky_match(*args, **kwargs):
+            state["calls"] += 1
+            if state["calls"] > calls:
+                raise MemoryError("simulated crash")
+            return real_match(*args, **kwargs)
+
+        return mock.patch.object(matcher_v2, "_best_batch_match", side_effect=flaky_match)
+
+    def _read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_interrupted_run_resumes_with_identical_output(self):
+        reference_path, _ = self._run(self._write_input("reference", "upload.csv"), checkpoint=False)
+
+        with self._crash_after(3), self.assertRaises(MemoryError):
+            self._run(self.input_path)
+        saved = [name for name in os.listdir(os.path.dirname(self.input_path)) if name.endswith(".checkpoint")]
+        self.assertEqual(len(saved), 1)
+        checkpoint = batch_checkpoint.load_checkpoint(os.path.join(os.path.dirname(self.input_path), saved[0]))
+        # The fourth distinct query (row 7) failed; rows 1-6 and their three queries were saved.
+        self.assertEqual(checkpoint.rows_done, 6)
+        self.assertEqual(len(checkpoint.query_cache), 3)
+        self.assertFalse(os.path.exists(checkpoint.output_path))
+
+        real_match = matcher_v2._best_batch_match
+        with mock.patch.object(matcher_v2, "_best_batch_match", side_effect=real_match) as match:
+            output_path, final_df = self._run(self.input_path)
+
+        # Only the queries not yet in the checkpoint were fuzzy matched again.
+        self.assertEqual(match.call_count, 2)
+        self.assertEqual(output_path, checkpoint.output_path)
+        self.assertEqual(self._read(output_path), self._read(reference_path))
+        self.assertEqual(final_df["search_query"].tolist(), QUERIES)
+        self.assertFalse(os.path.exists(checkpoint.path))
+
+    def test_torn_checkpoint_line_is_ignored(self):
+        with self._crash_after(4), self.assertRaises(MemoryError):
+            self._run(self.input_path)
+        (name,) = [name for name in os.listdir(os.path.dirname(self.input_path)) if name.endswith(".checkpoint")]
+        path = os.path.join(os.path.dirname(self.input_path), name)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write('{"rows": 9, "cache": {"conc')
+
+        self.assertEqual(batch_checkpoint.load_checkpoint(path).rows_done, 7)
+        output_path, final_df = self._run(self.input_path)
+        self.assertEqual(final_df.attrs["rows"], len(QUERIES))
+        self.assertFalse(os.path.exists(path))
+
+    def test_repeated_crashes_after_a_torn_line_keep_progress(self):
+        reference_path, _ = self._run(self._write_input("reference", "upload.csv"), checkpoint=False)
+
+        with self._crash_after(2), self.assertRaises(MemoryError):
+            self._run(self.input_path)
+        (name,) = [name for name in os.listdir(os.path.dirname(self.input_path)) if name.endswith(".checkpoint")]
+        path = os.path.join(os.path.dirname(self.input_path), name)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write('{"rows": 9, "cache": {"conc')
+        first = batch_checkpoint.load_checkpoint(path).rows_done
+
+        with self._crash_after(1), self.assertRaises(MemoryError):
+            self._run(self.input_path)
+        second = batch_checkpoint.load_checkpoint(path)
+        # The second crash's checkpoints are readable, not hidden behind the torn line.
+        self.assertGreater(second.rows_done, first)
+        self.assertEqual(len(second.query_cache), 3)
+
+        real_match = matcher_v2._best_batch_match
+        with mock.patch.object(matcher_v2, "_best_batch_match", side_effect=real_match) as match:
+            output_path, _ = self._run(self.input_path)
+        self.assertEqual(match.call_count, 2)
+        self.assertEqual(self._read(output_path), self._read(reference_path))
+
+    def test_checkpoint_not_reused_for_different_options_or_input(self):
+        with self._crash_after(2), self.assertRaises(MemoryError):
+            self._run(self.input_path)
+
+        messages = []
+        matcher_v2.run_matching_v2(
+            self.input_path, "Drug", [], ["price_retail"], "csv", checkpoint=True, status_callback=messages.append
+        )
+        self.assertFalse(any("Resuming" in message for message in messages))
+
+        pd.DataFrame({"Drug": QUERIES[:4], "Qty": range(4)}).to_csv(self.input_path, index=False)
+        self._run(self.input_path, status_callback=messages.append)
+        self.assertFalse(any("Resuming" in message for message in messages))
+
+    def test_successful_run_leaves_no_checkpoint(self):
+        output_path, _ = self._run(self.input_path)
+        self.assertEqual(
+            sorted(os.listdir(os.path.dirname(self.input_path))), sorted(["upload.csv", os.path.basename(output_path)])
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
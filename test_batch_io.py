@@ -0,0 +1,135 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import batch_io
+import matcher_v2
+from test_search_index import build_sample_catalog
+
+
+class TestParsedUpload(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.xlsx_path = os.path.join(self._tmp.name, "upload.xlsx")
+        with pd.ExcelWriter(self.xlsx_path) as writer:
+            pd.DataFrame({" Drug Name ": ["Concor 5mg", "Cetal", "panadol 500"], "Qty": [1, 2, 3]}).to_excel(
+                writer, sheet_name="Orders", index=False
+            )
+            pd.DataFrame({"Item": ["Co targe 160/12.5"]}).to_excel(writer, sheet_name="Extra", index=False)
+
+    def test_signature_depends_on_content(self):
+        first = batch_io.upload_signature("a.xlsx", b"abc")
+        self.assertEqual(first[:2], ("a.xlsx", 3))
+        self.assertEqual(first, batch_io.upload_signature("a.xlsx", memoryview(b"abc")))
+        self.assertNotEqual(first, batch_io.upload_signature("a.xlsx", b"abd"))
+
+    def test_sheets_headers_previews_and_projected_frames(self):
+        parsed = batch_io.ParsedUpload(self.xlsx_path)
+        self.addCleanup(parsed.close)
+        self.assertTrue(parsed.is_excel)
+
+        with mock.patch.object(pd, "read_excel") as read_excel:
+            self.assertEqual(parsed.sheet_names, ["Orders", "Extra"])
+            self.assertEqual(parsed.headers(), ["Drug Name", "Qty"])
+            self.assertEqual(parsed.preview("Drug Name", rows=2), ["Concor 5mg", "Cetal"])
+            projected = parsed.frame("Orders", ["Drug Name"])
+            self.assertEqual(projected.columns.tolist(), ["Drug Name"])
+            self.assertIs(parsed.frame(0, ["Drug Name"]), projected)
+            self.assertEqual(len(parsed.frame()), 3)
+            self.assertEqual(parsed.headers(1), ["Item"])
+        read_excel.assert_not_called()
+
+    def test_streamed_rows_match_read_excel(self):
+        path = os.path.join(self._tmp.name, "messy.xlsx")
+        pd.DataFrame(
+            [
+                ["Concor 5mg", 2.0, "NA", "a"],
+                [None, None, None, None],
+                ["Cetal", 2.5, "x", "b"],
+            ],
+            columns=[" Drug ", "Qty", "Note", "Note"],
+        ).to_excel(path, index=False)
+
+        expected = matcher_v2.read_input_frame(path)
+        parsed = batch_io.ParsedUpload(path)
+        self.addCleanup(parsed.close)
+        streamed = parsed.frame()
+
+        self.assertEqual(streamed.columns.tolist(), expected.columns.tolist())
+        self.assertEqual(streamed.columns.tolist(), ["Drug", "Qty", "Note", "Note.1"])
+        self.assertEqual(len(streamed), len(expected))
+        for position in range(len(expected.columns)):
+            self.assertEqual(
+                [None if pd.isna(value) else value for value in streamed.iloc[:, position]],
+                [None if pd.isna(value) else value for value in expected.iloc[:, position]],
+            )
+
+    def test_csv_upload(self):
+        csv_path = os.path.join(self._tmp.name, "upload.csv")
+        pd.DataFrame({"name ": ["Concor 5mg", "Cetal"]}).to_csv(csv_path, index=False)
+        parsed = batch_io.ParsedUpload(csv_path)
+
+        self.assertFalse(parsed.is_excel)
+        self.assertEqual(parsed.sheet_names, [])
+        self.assertEqual(parsed.headers(), ["name"])
+        self.assertIs(parsed.frame(), parsed.frame())
+
+
+class TestMatchingFromParsedUpload(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = build_sample_catalog()
+        cls.names = matcher_v2._build_search_names(cls.df)
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        patcher = mock.patch.object(matcher_v2, "get_search_snapshot", return_value=(self.names, self.df))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_run_matching_uses_parsed_frame_without_rereading(self):
+        input_path = os.path.join(self._tmp.name, "upload.xlsx")
+        input_df = pd.DataFrame({" Drug ": ["Concor 5mg", "Cetal"]})
+
+        with mock.patch.object(matcher_v2, "read_input_frame") as read_input:
+            output_path, final_df = matcher_v2.run_matching_v2(
+                input_path, "Drug", ["Drug"], ["price_retail"], "json", input_df=input_df
+            )
+
+        read_input.assert_not_called()
+        self.assertEqual(input_df.columns.tolist(), [" Drug "])
+        self.assertEqual(os.path.dirname(output_path), self._tmp.name)
+        self.assertEqual(final_df["search_query"].tolist(), ["Concor 5mg", "Cetal"])
+        self.assertEqual(final_df["match_found"].iloc[0], "Concor 5mg 30 tab")
+
+    def test_xlsx_input_is_streamed_with_only_needed_columns(self):
+        input_path = os.path.join(self._tmp.name, "upload.xlsx")
+        pd.DataFrame(
+            {"Drug": ["Concor 5mg", None, "Cetal"], "Qty": [1, 2, 3], "Notes": ["a", "b", "c"]}
+        ).to_excel(input_path, index=False)
+        progress = []
+
+        with mock.patch.object(pd, "read_excel") as read_excel:
+            _, final_df = matcher_v2.run_matching_v2(
+                input_path,
+                "Drug",
+                ["Qty"],
+                ["price_retail"],
+                "json",
+                progress_callback=lambda done, total: progress.append((done, total)),
+            )
+
+        read_excel.assert_not_called()
+        self.assertNotIn("Notes", final_df.columns)
+        self.assertEqual(final_df["Qty"].tolist(), [1, 2, 3])
+        self.assertEqual(final_df["match_found"].tolist()[1], "Empty Query")
+        self.assertEqual(progress[-1], (3, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
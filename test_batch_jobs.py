@@ -0,0 +1,141 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import batch_jobs
+import matcher_v2
+from test_search_index import build_sample_catalog
+
+
+class TestJobQueue(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = build_sample_catalog()
+        cls.names = matcher_v2._build_search_names(cls.df)
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        patcher = mock.patch.object(matcher_v2, "get_search_snapshot", return_value=(self.names, self.df))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.input_path = os.path.join(self._tmp.name, "upload.csv")
+        pd.DataFrame({"Drug": ["Concor 5mg", "Cetal", "panadol 500"]}).to_csv(self.input_path, index=False)
+        self.queue = batch_jobs.JobQueue(workers=1, job_dir=os.path.join(self._tmp.name, "jobs"))
+        self.addCleanup(self.queue.shutdown)
+
+    def _submit(self, owner="me"):
+        return self.queue.submit(
+            self.input_path,
+            "upload.csv",
+            owner=owner,
+            search_col="Drug",
+            local_fields=["Drug"],
+            db_fields=["price_retail"],
+            output_format="csv",
+        )
+
+    def _blocking_matcher(self):
+        """Patches the matcher so running jobs wait until the returned event is set."""
+        release = threading.Event()
+        started = threading.Event()
+        real_match = matcher_v2._best_batch_match
+
+        def slow_match(*args, **kwargs):
+            started.set()
+            release.wait(5)
+            return real_match(*args, **kwargs)
+
+        patcher = mock.patch.object(matcher_v2, "_best_batch_match", side_effect=slow_match)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(release.set)
+        return started, release
+
+    def test_job_runs_to_completion_with_downloadable_output(self):
+        job_id = self._submit()
+        job = self.queue.get(job_id)
+        job.future.result(timeout=10)
+
+        self.assertEqual(job.status, batch_jobs.DONE)
+        self.assertEqual(job.progress, 1.0)
+        self.assertEqual((job.done_rows, job.total_rows), (3, 3))
+        self.assertTrue(os.path.exists(job.output_path))
+        self.assertEqual(os.path.dirname(job.output_path), os.path.join(self._tmp.name, "jobs", job_id))
+        self.assertFalse(os.path.exists(job.input_path))
+        self.assertEqual(job.preview["search_query"].tolist(), ["Concor 5mg", "Cetal", "panadol 500"])
+        self.assertTrue(job.message.startswith("Matched 3 rows"))
+        self.assertEqual([job.id for job in self.queue.jobs("me")], [job_id])
+        self.assertEqual(self.queue.jobs("someone else"), [])
+
+    def test_cancel_running_and_queued_jobs(self):
+        started, release = self._blocking_matcher()
+        running = self.queue.get(self._submit())
+        queued = self.queue.get(self._submit())
+        self.assertTrue(started.wait(5))
+
+        self.assertTrue(self.queue.cancel(queued.id))
+        self.assertEqual(queued.status, batch_jobs.CANCELLED)
+        self.assertTrue(self.queue.cancel(running.id))
+        release.set()
+        running.future.result(timeout=10)
+
+        self.assertEqual(running.status, batch_jobs.CANCELLED)
+        self.assertIsNone(running.output_path)
+        self.assertEqual(os.listdir(os.path.dirname(running.input_path)), [])
+        self.assertFalse(self.queue.cancel(running.id))
+
+    def test_failed_job_keeps_error(self):
+        job_id = self.queue.submit(
+            self.input_path, "upload.csv", search_col="Drug", local_fields=[], db_fields=[], output_format="txt"
+        )
+        job = self.queue.get(job_id)
+        job.future.result(timeout=10)
+
+        self.assertEqual(job.status, batch_jobs.FAILED)
+        self.assertIn("txt", job.error)
+
+    def test_in_place_jobs_write_unique_outputs_next_to_input(self):
+        queue = batch_jobs.JobQueue(workers=2, job_dir=os.path.join(self._tmp.name, "jobs"))
+        self.addCleanup(queue.shutdown)
+        jobs = [
+            queue.get(
+                queue.submit(
+                    self.input_path, "upload.csv", copy_input=False, search_col="Drug", local_fields=[], db_fields=[],
+                    output_format="csv",
+                )
+            )
+            for _ in range(3)
+        ]
+        for job in jobs:
+            job.future.result(timeout=10)
+
+        outputs = {job.output_path for job in jobs}
+        self.assertEqual(len(outputs), 3)
+        for path in outputs:
+            self.assertEqual(os.path.dirname(path), self._tmp.name)
+            self.assertTrue(os.path.basename(path).startswith("matched_output_upload_"))
+        for job in jobs:
+            self.assertTrue(queue.remove(job.id))
+        self.assertTrue(os.path.exists(self.input_path))
+        self.assertTrue(all(os.path.exists(path) for path in outputs))
+
+    def test_finished_jobs_expire(self):
+        job = self.queue.get(self._submit())
+        job.future.result(timeout=10)
+        job_path = os.path.dirname(job.output_path)
+
+        self.queue.prune(now=job.finished + self.queue.retention - 1)
+        self.assertIs(self.queue.get(job.id), job)
+        self.queue.prune(now=job.finished + self.queue.retention + 1)
+        self.assertIsNone(self.queue.get(job.id))
+        self.assertFalse(os.path.exists(job_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
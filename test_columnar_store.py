@@ -0,0 +1,185 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import columnar_store
+import matcher_v2
+from test_search_index import build_sample_catalog
+
+
+class TestColumnarStore(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = self._tmp.name
+        self.frame = pd.DataFrame(
+            {
+                "id": [1, 2, 3],
+                "name_en": ["Concor 5mg", None, "كونكور"],
+                "price_retail": [10.5, np.nan, 3.0],
+            }
+        )
+        self.parts = {"en": ["concor 5", "", "كونكور"], "forms": ([0, 1, 0], [frozenset(), frozenset({"tablet"})])}
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_round_trip_catalog_and_index(self):
+        version = columnar_store.publish_snapshot(self.root, self.frame, self.parts)
+        attached_version, catalog, parts = columnar_store.attach_snapshot(self.root)
+
+        self.assertEqual(attached_version, version)
+        self.assertEqual(len(catalog), 3)
+        self.assertEqual(catalog.columns.tolist(), ["id", "name_en", "price_retail"])
+        self.assertEqual(catalog.iloc[0], {"id": 1, "name_en": "Concor 5mg", "price_retail": 10.5})
+        self.assertIsNone(catalog.iloc[1]["name_en"])
+        self.assertEqual(catalog.iloc[2]["name_en"], "كونكور")
+
+        self.assertEqual(parts["en"].tolist(), self.parts["en"])
+        codes, table = parts["forms"]
+        self.assertEqual([table[code] for code in codes], [frozenset(), frozenset({"tablet"}), frozenset()])
+
+    def test_publish_keeps_recent_versions_and_moves_current(self):
+        versions = [columnar_store.publish_snapshot(self.root, self.frame, self.parts, keep=2) for _ in range(3)]
+
+        self.assertEqual(columnar_store.current_version(self.root), versions[-1])
+        self.assertFalse(os.path.isdir(os.path.join(self.root, versions[0])))
+        self.assertTrue(os.path.isdir(os.path.join(self.root, versions[1])))
+
+    def test_attach_without_snapshot_raises(self):
+        with self.assertRaises(FileNotFoundError):
+            columnar_store.attach_snapshot(self.root)
+
+
+class TestCompiledCatalog(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.frame = pd.DataFrame(
+            {
+                "id": [1, 2, 3],
+                "name_en": ["Concor 5mg", None, "كونكور"],
+                "price_retail": [10.5, np.nan, 3.0],
+            }
+        )
+
+    def test_round_trip_plain_and_compressed(self):
+        for compression in (None, "gzip", "lzma"):
+            with self.subTest(compression=compression):
+                path = os.path.join(self._tmp.name, f"catalog-{compression}.columns")
+                columnar_store.compile_catalog(self.frame, path, source=["x", 1, 2], compression=compression)
+                catalog = columnar_store.open_catalog(path)
+
+                self.assertEqual(len(catalog), 3)
+                self.assertEqual(catalog.mapped, compression is None)
+                self.assertEqual(catalog.attrs["manifest"]["source"], ["x", 1, 2])
+                self.assertEqual(catalog.columns.tolist(), ["id", "name_en", "price_retail"])
+                self.assertEqual(catalog.iloc[0], {"id": 1, "name_en": "Concor 5mg", "price_retail": 10.5})
+                self.assertIsNone(catalog.iloc[1]["name_en"])
+                self.assertEqual(catalog.iloc[2]["name_en"], "كونكور")
+
+    def test_unknown_compression_and_bad_file_rejected(self):
+        path = os.path.join(self._tmp.name, "catalog.columns")
+        with self.assertRaises(ValueError):
+            columnar_store.compile_catalog(self.frame, path, compression="zip")
+        with open(path, "wb") as f:
+            f.write(b"not a catalog")
+        with self.assertRaises(ValueError):
+            columnar_store.open_catalog(path)
+
+    def test_matcher_maps_fresh_compiled_catalog_and_skips_stale_one(self):
+        db_path = os.path.join(self._tmp.name, "druglist.json")
+        with open(db_path, "w", encoding="utf-8") as f:
+            json.dump({"data": self.frame.where(self.frame.notna(), None).to_dict("records")}, f, ensure_ascii=False)
+        with mock.patch.object(matcher_v2, "DB_JSON", db_path), mock.patch.object(
+            matcher_v2, "COMPILED_CATALOG_PATH", None
+        ):
+            compiled_path = matcher_v2.compile_catalog()
+            self.assertEqual(compiled_path, os.path.join(self._tmp.name, "druglist.columns"))
+
+            loaded = matcher_v2._load_catalog_frame()
+            self.assertIsInstance(loaded, columnar_store.ColumnarCatalog)
+            self.assertEqual(loaded.attrs["source"][0], os.path.abspath(db_path))
+            # The JSON's hash travels with the compiled file, so the watcher never has to re-hash it.
+            self.assertEqual(matcher_v2._SOURCE_STATE["sha1"], matcher_v2._catalog_sha1())
+            self.assertEqual(loaded.iloc[2]["name_en"], "كونكور")
+
+            with open(db_path, "a", encoding="utf-8") as f:
+                f.write("\n")
+            self.assertIsInstance(matcher_v2._load_catalog_frame(), pd.DataFrame)
+
+
+class TestSharedIndex(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.root = os.path.join(self._tmp.name, "index_store")
+        self.frame = build_sample_catalog()
+        matcher_v2.clear_cache()
+        self.addCleanup(matcher_v2.clear_cache)
+
+    def test_workers_attach_prebuilt_indexes_outside_the_lock(self):
+        with mock.patch.object(matcher_v2, "_load_catalog_frame", return_value=self.frame):
+            matcher_v2.publish_shared_index(root=self.root)
+        expected = matcher_v2._build_search_names(self.frame)
+        expected_typo = matcher_v2._build_typo_index(expected["alpha_tokens"])
+
+        real_attach = columnar_store.attach_snapshot
+        lock_free = []
+
+        def try_lock():
+            if matcher_v2._INDEX_LOCK.acquire(timeout=1):
+                matcher_v2._INDEX_LOCK.release()
+                lock_free.append(True)
+
+        def attach(*args):
+            # Searches on other threads can still take the index lock while the snapshot is mapped.
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+            return real_attach(*args)
+
+        patches = [
+            mock.patch.object(matcher_v2, "SHARED_INDEX_DIR", self.root),
+            mock.patch.object(columnar_store, "attach_snapshot", side_effect=attach),
+        ]
+        for builder in ("_build_strength_index", "_build_typo_index", "_build_facet", "_build_ingredient_index"):
+            patches.append(mock.patch.object(matcher_v2, builder, side_effect=AssertionError(f"{builder} called")))
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        names, catalog = matcher_v2.get_search_snapshot()
+        results = matcher_v2.search_live("Blockatens 160/10", limit=3)
+        equivalents = matcher_v2.find_equivalents(row_pos=8, match_strength=False, filters={"status": "active"})
+
+        self.assertEqual(lock_free, [True])
+        self.assertEqual(len(catalog), len(self.frame))
+        self.assertEqual(names["strength_index"], expected["strength_index"])
+        self.assertEqual(names["typo_index"], expected_typo)
+        self.assertEqual(names["facets"].keys(), expected["facets"].keys())
+        self.assertEqual(names["ingredients"]["rows"], expected["ingredients"]["rows"])
+        self.assertEqual(results[0]["name_en"], "Blockatens 160/10 mg 14 tab")
+        self.assertEqual([row["name_en"] for row in equivalents], ["Blockatens 160/5 mg 14 tab"])
+
+    def test_memory_report_separates_mapped_and_private_index_bytes(self):
+        with mock.patch.object(matcher_v2, "_load_catalog_frame", return_value=self.frame):
+            matcher_v2.publish_shared_index(root=self.root)
+        with mock.patch.object(matcher_v2, "SHARED_INDEX_DIR", self.root):
+            report = matcher_v2.memory_report()
+            names = matcher_v2.get_search_names()
+
+        self.assertTrue(report["shared"])
+        # Only the coded columns are mapped; names and derived lookups are per-process copies.
+        codes = sum(names[key].codes.nbytes for key in ("strength", "forms", "alpha_tokens"))
+        self.assertEqual(report["index_shared"], codes)
+        self.assertLess(report["index_shared"], report["index"]["total"] - report["index"]["en"])
+
+
+if __name__ == "__main__":
+    unittest.main()
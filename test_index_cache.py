@@ -0,0 +1,242 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import matcher_v2
+
+
+def _sample_frame():
+    return pd.DataFrame(
+        {
+            "id": [1, 2, 3, 4],
+            "name_en": ["Concor 5mg 30 tab", "Concor 10mg 30 tab", "Co-Tareg 160/12.5mg tab", "Panadol 500mg tab"],
+            "name_ar": ["كونكور 5", "", "", "بانادول"],
+        }
+    )
+
+
+class TestIndexCache(unittest.TestCase):
+    def setUp(self):
+        matcher_v2.clear_cache()
+        self.load_calls = 0
+
+        def fake_load(status_callback=None):
+            self.load_calls += 1
+            time.sleep(0.05)
+            return _sample_frame()
+
+        patcher = mock.patch.object(matcher_v2, "_load_catalog_frame", side_effect=fake_load)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(matcher_v2.clear_cache)
+
+    def test_concurrent_builds_share_one_load(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(matcher_v2.get_search_names())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.load_calls, 1)
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(len(results[0]["en"]), 4)
+
+    def test_snapshot_pairs_index_with_its_catalog(self):
+        names, db_df = matcher_v2.get_search_snapshot()
+        reloaded = matcher_v2.get_master_db(force_reload=True)
+        new_names, new_db = matcher_v2.get_search_snapshot()
+
+        self.assertIsNot(db_df, reloaded)
+        self.assertIs(new_db, reloaded)
+        self.assertIsNot(new_names, names)
+        self.assertEqual(len(new_names["en"]), len(new_db))
+
+    def test_background_warmup_builds_index(self):
+        with mock.patch.object(matcher_v2, "_WARMUP_THREAD", None):
+            thread = matcher_v2.start_background_warmup()
+            self.assertIs(matcher_v2.start_background_warmup(), thread)
+            thread.join(timeout=5)
+
+        self.assertTrue(matcher_v2._CACHED_NAMES["en"])
+        self.assertEqual(self.load_calls, 1)
+        self.assertIsNone(matcher_v2.get_warmup_error())
+
+    def test_background_warmup_keeps_its_error(self):
+        matcher_v2._load_catalog_frame.side_effect = ValueError("bad druglist.json")
+        with mock.patch.object(matcher_v2, "_WARMUP_THREAD", None), mock.patch.object(
+            matcher_v2, "_WARMUP_ERROR", None
+        ), mock.patch("builtins.print"):
+            matcher_v2.start_background_warmup().join(timeout=5)
+            self.assertIn("bad druglist.json", str(matcher_v2.get_warmup_error()))
+        self.assertIsNone(matcher_v2.get_loaded_catalog())
+
+    def test_reruns_do_not_wait_for_a_running_build(self):
+        building = threading.Event()
+        release = threading.Event()
+
+        def hold_index_lock():
+            with matcher_v2._INDEX_LOCK:
+                building.set()
+                release.wait(5)
+
+        holder = threading.Thread(target=hold_index_lock)
+        holder.start()
+        self.addCleanup(holder.join)
+        self.addCleanup(release.set)
+        building.wait(5)
+
+        started = []
+        with mock.patch.object(matcher_v2, "_WARMUP_THREAD", holder), mock.patch.object(
+            matcher_v2, "_WATCHER", None
+        ), mock.patch.object(matcher_v2, "SHARED_INDEX_DIR", None):
+            rerun = threading.Thread(
+                target=lambda: started.extend(
+                    [matcher_v2.start_background_warmup(), matcher_v2.start_catalog_watcher(interval=60)]
+                )
+            )
+            rerun.start()
+            rerun.join(timeout=2)
+            self.assertFalse(rerun.is_alive())
+            matcher_v2.stop_catalog_watcher()
+        self.assertIs(started[0], holder)
+        self.assertIsInstance(started[1], matcher_v2._CatalogWatcher)
+
+
+class TestPersistentIndexCache(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.db_path = os.path.join(self._tmp.name, "druglist.json")
+        self._write_catalog(["Concor 5mg tab", "Panadol 500mg tab"])
+
+        for patcher in (
+            mock.patch.object(matcher_v2, "DB_JSON", self.db_path),
+            mock.patch.object(matcher_v2, "INDEX_CACHE_PATH", None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        matcher_v2.clear_cache()
+        self.addCleanup(matcher_v2.clear_cache)
+
+    def _write_catalog(self, names):
+        with open(self.db_path, "w", encoding="utf-8") as f:
+            json.dump({"data": [{"id": idx, "name_en": name} for idx, name in enumerate(names)]}, f)
+
+    def test_second_start_loads_index_from_cache(self):
+        built = matcher_v2.get_search_names()
+        self.assertTrue(os.path.exists(matcher_v2._index_cache_path()))
+
+        matcher_v2.clear_cache()
+        with mock.patch.object(matcher_v2, "_build_search_names", side_effect=AssertionError("rebuilt")):
+            cached = matcher_v2.get_search_names()
+        self.assertEqual(cached["en"], built["en"])
+        self.assertEqual(matcher_v2.search_live("concor", limit=1)[0]["name_en"], "Concor 5mg tab")
+
+    def test_typo_index_is_built_with_the_index_and_cached(self):
+        with mock.patch.object(matcher_v2, "TYPO_PREFILTER_MODE", "off"):
+            self.assertNotIn("typo_index", matcher_v2.get_search_names())
+
+        # An index cached while the typo prefilter was off gets the typo index once, at load.
+        matcher_v2.clear_cache()
+        names = matcher_v2.get_search_names()
+        self.assertIn("typo_index", names)
+        with mock.patch.object(matcher_v2, "_build_typo_index", side_effect=AssertionError("built per query")):
+            self.assertEqual(matcher_v2.search_live("concr", limit=1)[0]["name_en"], "Concor 5mg tab")
+            reloaded, _ = matcher_v2.reload_search_index()
+        self.assertEqual(reloaded["typo_index"], names["typo_index"])
+
+    def test_changed_catalog_invalidates_cache(self):
+        matcher_v2.get_search_names()
+        matcher_v2.clear_cache()
+        self._write_catalog(["Concor 5mg tab", "Panadol 500mg tab", "Tareg 80mg tab"])
+        os.utime(self.db_path, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+
+        self.assertEqual(len(matcher_v2.get_search_names()["en"]), 3)
+
+    def test_cache_can_be_disabled(self):
+        with mock.patch.object(matcher_v2, "INDEX_CACHE_PATH", "off"):
+            matcher_v2.get_search_names()
+        self.assertFalse(os.path.exists(os.path.join(self._tmp.name, "druglist.index.cache")))
+
+
+class TestMemoryReport(unittest.TestCase):
+    def setUp(self):
+        matcher_v2.clear_cache()
+        patcher = mock.patch.object(matcher_v2, "_load_catalog_frame", side_effect=lambda status_callback=None: _sample_frame())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(matcher_v2.clear_cache)
+
+    def test_report_covers_catalog_columns_and_index_components(self):
+        report = matcher_v2.memory_report()
+
+        self.assertEqual(report["rows"], 4)
+        self.assertEqual(set(report["catalog"]) - {"Index", "total"}, {"id", "name_en", "name_ar"})
+        for component in ("en", "ar", "strength", "forms", "alpha_tokens", "strength_index", "typo_index"):
+            self.assertGreater(report["index"][component], 0, component)
+        self.assertEqual(report["total"], report["catalog"]["total"] + report["index"]["total"])
+        self.assertEqual(report["index_shared"], 0)
+
+    def test_trace_build_reports_peaks(self):
+        peaks = matcher_v2.memory_report(trace_build=True)["tracemalloc"]
+        self.assertGreater(peaks["index_build_peak"], 0)
+        self.assertGreaterEqual(peaks["index_build_peak"], peaks["index_retained"])
+
+
+class TestCatalogHotReload(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.db_path = os.path.join(self._tmp.name, "druglist.json")
+        self._write_catalog(["Concor 5mg tab", "Panadol 500mg tab"])
+
+        patcher = mock.patch.object(matcher_v2, "DB_JSON", self.db_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        matcher_v2.clear_cache()
+        self.addCleanup(matcher_v2.clear_cache)
+
+    def _write_catalog(self, names):
+        with open(self.db_path, "w", encoding="utf-8") as f:
+            json.dump({"data": [{"id": idx, "name_en": name} for idx, name in enumerate(names)]}, f)
+
+    def test_watcher_swaps_in_rebuilt_index_when_file_changes(self):
+        old_names, old_db = matcher_v2.get_search_snapshot()
+        watcher = matcher_v2._CatalogWatcher(interval=60)
+        self.assertFalse(watcher.check())
+
+        self._write_catalog(["Concor 5mg tab", "Panadol 500mg tab", "Tareg 80mg tab"])
+        os.utime(self.db_path, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+        self.assertTrue(watcher.check())
+
+        new_names, new_db = matcher_v2.get_search_snapshot()
+        self.assertEqual(len(new_db), 3)
+        self.assertEqual(len(new_names["en"]), 3)
+        # The previous pair stays intact for searches that were already running.
+        self.assertEqual(len(old_db), 2)
+        self.assertEqual(len(old_names["en"]), 2)
+
+    def test_watcher_ignores_touch_without_content_change(self):
+        matcher_v2.get_search_snapshot()
+        watcher = matcher_v2._CatalogWatcher(interval=60)
+        with mock.patch.object(matcher_v2, "reload_search_index") as reload:
+            for step in (1, 2):
+                os.utime(self.db_path, ns=(time.time_ns(), time.time_ns() + step * 1_000_000))
+                self.assertFalse(watcher.check())
+        reload.assert_not_called()
+
+        self._write_catalog(["Concor 5mg tab", "Tareg 80mg tab"])
+        os.utime(self.db_path, ns=(time.time_ns(), time.time_ns() + 3_000_000))
+        self.assertTrue(watcher.check())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import matcher_v2
+import progress_events
+from test_search_index import build_sample_catalog
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestProgressTracker(unittest.TestCase):
+    def _tracker(self, **kwargs):
+        self.clock = FakeClock()
+        self.calls = []
+        self.events = []
+        return progress_events.ProgressTracker(
+            lambda done, total: self.calls.append((done, total)), self.events.append, clock=self.clock, **kwargs
+        )
+
+    def test_updates_are_throttled_by_time_and_fraction(self):
+        tracker = self._tracker(interval=1.0, step=0.1)
+        for done in range(1, 1001):
+            self.clock.now += 0.0001
+            tracker.update(done, 1000)
+        # The first row, then one event per 10% of the file.
+        done = [done for done, _ in self.calls]
+        self.assertEqual(done[0], 1)
+        self.assertEqual(len(done), 10)
+        self.assertTrue(all(100 <= b - a <= 101 for a, b in zip(done, done[1:])))
+
+        tracker = self._tracker(interval=1.0, step=0.5)
+        for done in range(1, 6):
+            self.clock.now += 0.6
+            tracker.update(done, 1000)
+        self.assertEqual([done for done, _ in self.calls], [1, 3, 5])
+
+    def test_finish_always_reports(self):
+        tracker = self._tracker(interval=60, step=1)
+        tracker.update(1, 10)
+        tracker.update(2, 10)
+        tracker.finish(3, 3)
+        self.assertEqual(self.calls, [(1, 10), (3, 3)])
+        self.assertEqual(self.events[-1].fraction, 1.0)
+
+    def test_event_numbers(self):
+        tracker = self._tracker()
+        for hit, unique in [(False, 1), (True, 1), (True, 1), (False, 2)]:
+            tracker.lookup(hit, unique)
+        self.clock.now += 2
+        event = tracker.event(50, 250)
+
+        self.assertEqual(event.rows_per_second, 25)
+        self.assertEqual(event.cache_hit_rate, 0.5)
+        self.assertEqual(event.unique_queries, 2)
+        self.assertEqual(event.eta_seconds, 8)
+        self.assertIn("ETA 0:08", event.describe())
+
+        combined = progress_events.combine_events([event, None, event], elapsed=4)
+        self.assertEqual((combined.done, combined.total, combined.rows_per_second), (100, 500, 25))
+
+    def test_no_callbacks_no_events(self):
+        tracker = progress_events.ProgressTracker()
+        tracker.update(1, 1)
+        tracker.finish(1, 1)
+        self.assertEqual(tracker.events_sent, 0)
+
+
+class TestRunMatchingEvents(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = build_sample_catalog()
+        cls.names = matcher_v2._build_search_names(cls.df)
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        patcher = mock.patch.object(matcher_v2, "get_search_snapshot", return_value=(self.names, self.df))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_run_reports_cache_hits_and_unique_queries(self):
+        input_df = pd.DataFrame({"Drug": ["Concor 5mg", "concor 5mg", "Cetal", "", "Concor 5mg"] * 40})
+        progress = []
+        events = []
+
+        matcher_v2.run_matching_v2(
+            os.path.join(self._tmp.name, "upload.csv"),
+            "Drug",
+            [],
+            [],
+            "csv",
+            input_df=input_df,
+            progress_callback=lambda done, total: progress.append((done, total)),
+            progress_event_callback=events.append,
+        )
+
+        self.assertLess(len(progress), len(input_df))
+        self.assertEqual(progress[-1], (200, 200))
+        final = events[-1]
+        self.assertEqual(final.unique_queries, 2)
+        self.assertEqual(final.cache_misses, 2)
+        self.assertEqual(final.cache_hits, 158)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import matcher_v2
+import query_log
+from test_search_index import build_sample_catalog
+
+
+class TestQueryLog(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = build_sample_catalog()
+        cls.names = matcher_v2._build_search_names(cls.df)
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.log_path = os.path.join(self._tmp.name, "queries.jsonl")
+
+        patcher = mock.patch.object(matcher_v2, "get_search_snapshot", return_value=(self.names, self.df))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(query_log.stop_logging)
+
+    def _capture(self, queries, filters=None):
+        query_log.start_logging(self.log_path)
+        for query in queries:
+            matcher_v2.search_live(query, limit=5, filters=filters)
+        query_log.stop_logging()
+        return query_log.load_log(self.log_path)
+
+    def test_search_live_appends_entries_with_catalog_ids(self):
+        entries = self._capture(["Concor 5mg", "Cetal"], filters={"price_retail": (None, 50)})
+
+        self.assertEqual([entry["q"] for entry in entries], ["Concor 5mg", "Cetal"])
+        self.assertEqual(entries[0]["kind"], "search")
+        # Concor 5mg costs 60, so the price filter leaves Concor 2.5mg (id 3) on top.
+        self.assertEqual(entries[0]["ids"][0], 3)
+        self.assertEqual(len(entries[0]["ids"]), len(entries[0]["scores"]))
+        self.assertEqual(query_log._decode_filters(entries[0]["filters"]), {"price_retail": (None, 50)})
+
+    def test_logging_disabled_by_default(self):
+        matcher_v2.search_live("Concor 5mg", limit=5)
+        self.assertFalse(os.path.exists(self.log_path))
+
+    def test_replay_reports_identical_rankings(self):
+        entries = self._capture(["Concor 5mg", "Co targe 160/12.5", "panadol 500"])
+        report = query_log.replay(entries, concurrency=2)
+
+        self.assertEqual(report["queries"], 3)
+        self.assertEqual(report["errors"], 0)
+        self.assertEqual(report["identical"], 3)
+        self.assertEqual(report["diffs"], [])
+        self.assertGreater(report["throughput_qps"], 0)
+
+    def test_replay_flags_ranking_changes(self):
+        entries = self._capture(["Concor 5mg"])
+        entries[0]["ids"] = [999] + entries[0]["ids"][1:]
+        report = query_log.replay(entries)
+
+        self.assertEqual(report["identical"], 0)
+        self.assertEqual(report["top1_changed"], 1)
+        self.assertEqual(report["diffs"][0]["recorded"][0], 999)
+
+
+if __name__ == "__main__":
+    unittest.main()
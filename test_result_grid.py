@@ -0,0 +1,125 @@
+import os
+import tempfile
+import time
+import tkinter
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import result_grid
+import result_writers
+
+COLUMNS = ["search_query", "match_found", "match_score", "price_retail"]
+
+
+def _write_result(path, output_format, rows):
+    writer = result_writers.open_result_writer(path, output_format, COLUMNS)
+    for row in rows:
+        writer.write(row)
+    writer.close()
+    return path
+
+
+SAMPLE = [
+    {"search_query": "a", "match_found": "Concor 5mg", "match_score": 97.5, "price_retail": 60},
+    {"search_query": "b", "match_found": "No Match Found", "match_score": 0, "price_retail": None},
+    {"search_query": "c", "match_found": "Cetal", "match_score": 88, "price_retail": 12.5},
+    {"search_query": "d", "match_found": None, "match_score": 70, "price_retail": None},
+    {"search_query": "e", "match_found": "concor plus", "match_score": 97.5, "price_retail": 75},
+]
+
+
+class TestResultView(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+
+    def _view(self, output_format="columns", rows=SAMPLE):
+        path = os.path.join(self._tmp.name, f"out.{result_writers.output_extension(output_format)}")
+        return result_grid.ResultView(result_grid.open_result_store(_write_result(path, output_format, rows)))
+
+    def _queries(self, view):
+        return [row[0] for row in view.rows(0, len(view), ["search_query"])]
+
+    def test_sort_by_score_and_match(self):
+        for output_format in ("columns", "csv"):
+            with self.subTest(output_format=output_format):
+                view = self._view(output_format)
+                view.sort("match_score")  # Scores sort highest first; ties keep file order.
+                self.assertEqual(self._queries(view), ["a", "e", "c", "d", "b"])
+                view.sort("match_score")
+                self.assertEqual(self._queries(view), ["b", "d", "c", "a", "e"])
+
+                view.sort("match_found")  # Missing values sort last in both directions.
+                self.assertEqual(self._queries(view), ["c", "a", "b", "e", "d"])
+                view.sort("match_found")
+                self.assertEqual(self._queries(view), ["e", "b", "a", "c", "d"])
+
+    def test_filters_combine_with_sort(self):
+        view = self._view()
+        view.sort("match_score", descending=False)
+        view.set_filter(min_score=80)
+        self.assertEqual(self._queries(view), ["c", "a", "e"])
+        view.set_filter(min_score=80, text=" CONCOR ")
+        self.assertEqual(self._queries(view), ["a", "e"])
+        view.set_filter(max_score=75)
+        self.assertEqual(self._queries(view), ["b", "d"])
+        view.set_filter()
+        self.assertEqual(len(view), len(SAMPLE))
+
+    def test_rows_window_and_missing_values(self):
+        view = self._view()
+        self.assertEqual(view.rows(1, 3), [("b", "No Match Found", 0, ""), ("c", "Cetal", 88, 12.5)])
+        self.assertEqual(view.rows(4, 10, ["match_found"]), [("concor plus",)])
+
+    def test_large_output_stays_fast(self):
+        count = 200_000
+        rng = np.random.default_rng(0)
+        scores = rng.integers(0, 101, count)
+        names = [f"Drug {i % 5000}" for i in range(count)]
+        path = os.path.join(self._tmp.name, "large.columns")
+        rows = (
+            {"search_query": f"q{i}", "match_found": names[i], "match_score": int(scores[i]), "price_retail": i}
+            for i in range(count)
+        )
+        view = result_grid.ResultView(result_grid.open_result_store(_write_result(path, "columns", rows)))
+
+        started = time.perf_counter()
+        view.sort("match_score")
+        view.set_filter(min_score=90, text="drug 12")
+        view.sort("match_found")
+        window = view.rows(0, 40)
+        elapsed = time.perf_counter() - started
+
+        expected = pd.DataFrame({"name": names, "score": scores})
+        expected = expected[(expected["score"] >= 90) & expected["name"].str.contains("drug 12", case=False)]
+        self.assertEqual(len(view), len(expected))
+        self.assertEqual([row[1] for row in window], sorted(expected["name"])[:40])
+        self.assertLess(elapsed, 5)
+
+
+class TestVirtualGrid(unittest.TestCase):
+    def setUp(self):
+        try:
+            self.root = tkinter.Tk()
+        except tkinter.TclError:
+            self.skipTest("no display")
+        self.addCleanup(self.root.destroy)
+
+    def test_only_visible_rows_are_items(self):
+        frame = pd.DataFrame({"match_found": [f"Drug {i}" for i in range(50_000)], "match_score": range(50_000)})
+        store = result_grid.columnar_store.ColumnarCatalog({c: frame[c].to_numpy() for c in frame.columns})
+        grid = result_grid.VirtualGrid(self.root)
+        grid.set_view(result_grid.ResultView(store))
+        grid._resize(300)
+
+        self.assertEqual(len(grid.tree.get_children()), 9)
+        grid.scroll_to(1000)
+        self.assertEqual(grid.tree.item(grid.tree.get_children()[0])["values"][0], "Drug 1000")
+        grid.scroll_to(10**9)
+        self.assertEqual(grid.offset, 50_000 - 9)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import columnar_store
+import matcher_v2
+import result_writers
+from test_search_index import build_sample_catalog
+
+COLUMNS = ["search_query", "match_found", "match_score", "price_retail"]
+ROWS = [
+    {"search_query": "Concor 5mg", "match_found": "كونكور", "match_score": np.float64(97.5), "price_retail": np.int64(60)},
+    {"search_query": "xyz", "match_found": "No Match Found", "match_score": 0, "price_retail": np.nan},
+]
+
+
+class TestResultWriters(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+
+    def _write(self, output_format, rows=ROWS):
+        path = os.path.join(self._tmp.name, f"out.{result_writers.output_extension(output_format)}")
+        writer = result_writers.open_result_writer(path, output_format, COLUMNS)
+        with mock.patch.object(result_writers, "WRITE_BATCH_ROWS", 1):
+            for row in rows:
+                writer.write(row)
+        writer.close()
+        return path
+
+    def test_every_format_round_trips(self):
+        readers = {
+            "xlsx": pd.read_excel,
+            "csv": lambda path: pd.read_csv(path, encoding="utf-8-sig"),
+            "jsonl": lambda path: pd.read_json(path, lines=True),
+            "json": pd.read_json,
+            "columns": lambda path: columnar_store.open_catalog(path).to_frame(),
+        }
+        for output_format, read in readers.items():
+            with self.subTest(output_format=output_format):
+                df = read(self._write(output_format))
+                self.assertEqual(df.columns.tolist(), COLUMNS)
+                self.assertEqual(df["match_found"].tolist(), ["كونكور", "No Match Found"])
+                self.assertEqual(df["match_score"].tolist(), [97.5, 0])
+                self.assertEqual(df["price_retail"].iloc[0], 60)
+                self.assertTrue(pd.isna(df["price_retail"].iloc[1]))
+
+    def test_json_outputs_are_valid_for_empty_and_missing_values(self):
+        with open(self._write("json", rows=[]), encoding="utf-8") as f:
+            self.assertEqual(json.load(f), [])
+        with open(self._write("jsonl"), encoding="utf-8") as f:
+            self.assertIsNone(json.loads(f.readlines()[1])["price_retail"])
+
+    def test_abort_removes_partial_output(self):
+        for output_format in result_writers.OUTPUT_FORMATS:
+            with self.subTest(output_format=output_format):
+                path = os.path.join(self._tmp.name, f"partial.{output_format}")
+                writer = result_writers.open_result_writer(path, output_format, COLUMNS)
+                writer.write(ROWS[0])
+                writer.flush()
+                writer.abort()
+                self.assertFalse(os.path.exists(path))
+
+    def test_unknown_format_rejected(self):
+        with self.assertRaises(ValueError):
+            result_writers.open_result_writer(os.path.join(self._tmp.name, "out.txt"), "txt", COLUMNS)
+
+
+class TestRunMatchingOutput(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = build_sample_catalog()
+        cls.names = matcher_v2._build_search_names(cls.df)
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        patcher = mock.patch.object(matcher_v2, "get_search_snapshot", return_value=(self.names, self.df))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_csv_output_matches_returned_frame(self):
+        input_path = os.path.join(self._tmp.name, "upload.csv")
+        input_df = pd.DataFrame({"Drug": ["Concor 5mg", "", "Cetal"], "Qty": [1, 2, 3]})
+
+        output_path, final_df = matcher_v2.run_matching_v2(
+            input_path, "Drug", ["Qty"], ["price_retail"], "csv", input_df=input_df
+        )
+
+        self.assertTrue(output_path.endswith(".csv"))
+        written = pd.read_csv(output_path, encoding="utf-8-sig")
+        self.assertEqual(written.columns.tolist(), final_df.columns.tolist())
+        self.assertEqual(written["match_found"].tolist(), final_df["match_found"].tolist())
+
+    def test_only_a_bounded_preview_is_returned(self):
+        input_path = os.path.join(self._tmp.name, "upload.csv")
+        input_df = pd.DataFrame({"Drug": ["Concor 5mg", "Cetal", "panadol 500"] * 100})
+
+        output_path, preview = matcher_v2.run_matching_v2(input_path, "Drug", [], [], "csv", input_df=input_df)
+
+        written = pd.read_csv(output_path, encoding="utf-8-sig", keep_default_na=False)
+        self.assertEqual(len(written), 300)
+        self.assertEqual(preview.attrs["rows"], 300)
+        self.assertEqual(len(preview), matcher_v2.BATCH_PREVIEW_ROWS)
+        self.assertEqual(preview["search_query"].tolist(), written["search_query"].tolist()[: len(preview)])
+
+    def test_failed_run_leaves_no_output(self):
+        input_path = os.path.join(self._tmp.name, "upload.csv")
+        input_df = pd.DataFrame({"Drug": ["Concor 5mg", "Cetal"]})
+
+        with mock.patch.object(matcher_v2, "_best_batch_match", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                matcher_v2.run_matching_v2(input_path, "Drug", [], [], "jsonl", input_df=input_df)
+        self.assertEqual(os.listdir(self._tmp.name), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,426 @@
+import random
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import bench_index_memory
+import matcher_v2
+
+QUERIES = [
+    "Concor 5mg",
+    "Co targe 160/12.5",
+    "Blockatens 160/10",
+    "panadol 500",
+    "كونكور 5",
+    "Vita Kids( total syrup )",
+]
+
+
+def build_sample_catalog():
+    rows = [
+        ("Concor 5mg 30 tab", "كونكور 5 مجم 30 قرص", "bisoprolol", "tablet", "Merck", "active", 60.0),
+        ("Concor 10mg 30 tab", "كونكور 10 مجم", "bisoprolol", "tablet", "Merck", "active", 85.0),
+        ("Concor 2.5mg 30 tab", "", "bisoprolol", "tablet", "Merck", "inactive", 40.0),
+        ("Bisocor 5mg 20 tab", "", "bisoprolol", "tablet", "Pharco", "active", 30.0),
+        ("Co-Tareg 160/12.5mg 14 f.c.tab", "كو تارج 160/12.5", "valsartan+hydrochlorothiazide", "tablet", "Novartis", "active", 120.0),
+        ("Co-Tareg 80/12.5mg 14 f.c.tab", "", "valsartan+hydrochlorothiazide", "tablet", "Novartis", "active", 90.0),
+        ("Tareg 160mg 14 tab", "تارج 160", "valsartan", "tablet", "Novartis", "active", 100.0),
+        ("Blockatens 160/5 mg 14 tab", "", "valsartan+amlodipine", "tablet", "Eva", "active", 70.0),
+        ("Blockatens 160/10 mg 14 tab", "", "valsartan+amlodipine", "tablet", "Eva", "active", 75.0),
+        ("Panadol 500mg 24 tab", "بانادول 500", "paracetamol", "tablet", "GSK", "active", 25.0),
+        ("Cetal 500mg 20 tab", "سيتال 500", "paracetamol", "tablet", "Eipico", "active", 15.0),
+        ("Cetal 250mg/5ml syrup", "", "paracetamol", "syrup", "Eipico", "active", 18.0),
+        ("Vita Kids total syrup 120ml", "فيتا كيدز شراب", "multivitamin", "syrup", "Amoun", "active", 45.0),
+    ]
+    columns = ["name_en", "name_ar", "active_ingredients", "dosage_form", "manufacturer", "status", "price_retail"]
+    frame = pd.DataFrame(rows, columns=columns)
+    frame.insert(0, "id", range(1, len(frame) + 1))
+    return frame
+
+
+def build_synthetic_catalog(rows=600, seed=0):
+    """A larger random catalog mixing ratios, unit values, bare numbers, forms and Arabic names."""
+    rng = random.Random(seed)
+    stems = ["Concor", "Tareg", "Co-Tareg", "Blockatens", "Panadol", "Cetal", "Augmentin", "Brufen", "Nexium", "Zyrtec"]
+    strengths = ["5mg", "10 mg", "2.5mg", "160/12.5mg", "80/12.5", "160/5 mg", "500mg", "250mg/5ml", "1 g", "400", ""]
+    forms = ["tab", "f.c.tab", "caps", "syrup", "amp", "susp", "cream", "eff. tab"]
+    arabic = ["كونكور", "تارج", "بانادول", "سيتال", "أوجمنتين", ""]
+    names_en = []
+    names_ar = []
+    for _ in range(rows):
+        strength = rng.choice(strengths)
+        names_en.append(f"{rng.choice(stems)} {strength} {rng.randint(1, 40)} {rng.choice(forms)}".replace("  ", " "))
+        ar_name = rng.choice(arabic)
+        names_ar.append(f"{ar_name} {strength}".strip() if ar_name else "")
+    return pd.DataFrame({"id": range(1, rows + 1), "name_en": names_en, "name_ar": names_ar})
+
+
+class TestShardedSearch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = build_sample_catalog()
+        cls.names = matcher_v2._build_search_names(cls.df)
+
+    def test_sharded_ranking_matches_single_scan(self):
+        expected = {query: matcher_v2._rank_candidates(query, self.names, limit=5) for query in QUERIES}
+
+        for strategy in matcher_v2.SHARD_STRATEGIES:
+            with self.subTest(strategy=strategy), mock.patch.object(matcher_v2, "SEARCH_SHARD_COUNT", 3), mock.patch.object(
+                matcher_v2, "SEARCH_SHARD_STRATEGY", strategy
+            ):
+                for query in QUERIES:
+                    self.assertEqual(matcher_v2._rank_candidates(query, self.names, limit=5), expected[query])
+
+    def test_threaded_scans_match_serial_ranking(self):
+        expected = {query: matcher_v2._rank_candidates(query, self.names, limit=5) for query in QUERIES}
+
+        for split_rows in (matcher_v2.QUERY_SPLIT_MIN_ROWS, 0):
+            with self.subTest(split_rows=split_rows), mock.patch.object(matcher_v2, "SEARCH_QUERY_THREADS", 3), mock.patch.object(
+                matcher_v2, "QUERY_SPLIT_MIN_ROWS", split_rows
+            ):
+                for query in QUERIES:
+                    self.assertEqual(matcher_v2._rank_candidates(query, self.names, limit=5), expected[query])
+
+    def test_shards_cover_every_row_once(self):
+        for strategy in matcher_v2.SHARD_STRATEGIES:
+            shards = matcher_v2._get_shards(self.names, 4, strategy)
+            row_ids = sorted(idx for shard in shards for idx in shard["ids"])
+            self.assertEqual(row_ids, list(range(len(self.df))), strategy)
+
+    def test_unknown_strategy_is_rejected(self):
+        with self.assertRaises(ValueError):
+            matcher_v2._partition_rows(self.names, 2, "by_price")
+
+
+class TestStrengthIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = build_sample_catalog()
+        cls.names = matcher_v2._build_search_names(cls.df)
+
+    def _row_names(self, rows):
+        return [self.df.iloc[idx]["name_en"] for idx in rows]
+
+    def test_ratio_query_selects_rows_with_same_ratio(self):
+        query_sig = matcher_v2._extract_strength_signature("Co targe 160/12.5")
+        rows = matcher_v2._strength_candidate_rows(query_sig, self.names)
+        self.assertEqual(self._row_names(rows), ["Co-Tareg 160/12.5mg 14 f.c.tab"])
+
+    def test_value_query_selects_rows_with_same_unit_value(self):
+        query_sig = matcher_v2._extract_strength_signature("Concor 5mg")
+        rows = matcher_v2._strength_candidate_rows(query_sig, self.names)
+        self.assertEqual(self._row_names(rows), ["Concor 5mg 30 tab", "Bisocor 5mg 20 tab", "Blockatens 160/5 mg 14 tab"])
+
+    def test_unit_value_query_also_selects_unitless_rows(self):
+        df = build_sample_catalog()
+        df.loc[len(df)] = [len(df) + 1, "Brufen 400 tab", "", "ibuprofen", "tablet", "Abbott", "active", 20.0]
+        names = matcher_v2._build_search_names(df)
+        query_sig = matcher_v2._extract_strength_signature("Brufen 400mg")
+        rows = matcher_v2._strength_candidate_rows(query_sig, names)
+        self.assertEqual(df.iloc[rows]["name_en"].tolist(), ["Brufen 400 tab"])
+        ranked = matcher_v2._rank_candidates("Brufen 400mg", names, limit=5, strength_mode="restrict")
+        self.assertEqual(df.iloc[ranked[0][0]]["name_en"], "Brufen 400 tab")
+
+    def test_query_without_strength_has_no_subset(self):
+        query_sig = matcher_v2._extract_strength_signature("Concor")
+        self.assertIsNone(matcher_v2._strength_candidate_rows(query_sig, self.names))
+
+    def test_restrict_mode_ranks_only_matching_strength(self):
+        ranked = matcher_v2._rank_candidates("Blockatens 160/10", self.names, limit=5, strength_mode="restrict")
+        self.assertEqual(self._row_names([idx for idx, _ in ranked]), ["Blockatens 160/10 mg 14 tab"])
+
+    def test_include_mode_keeps_other_candidates(self):
+        ranked = matcher_v2._rank_candidates("Blockatens 160/10", self.names, limit=5, strength_mode="include")
+        names = self._row_names([idx for idx, _ in ranked])
+        self.assertEqual(names[0], "Blockatens 160/10 mg 14 tab")
+        self.assertIn("Blockatens 160/5 mg 14 tab", names)
+
+    def _rank_and_count(self, query, names=None, **kwargs):
+        """Ranks ``query`` and returns the ranking with the number of names the fuzzy scans read."""
+        scanned = []
+        real_extract = matcher_v2.process.extract
+
+        def extract(query_text, choices, **extract_kwargs):
+            scanned.append(len(choices))
+            return real_extract(query_text, choices, **extract_kwargs)
+
+        with mock.patch.object(matcher_v2.process, "extract", side_effect=extract):
+            ranked = matcher_v2._rank_candidates(query, names or self.names, limit=5, typo_mode="off", **kwargs)
+        return ranked, sum(scanned)
+
+    def test_default_keeps_the_full_scan_top_k(self):
+        # Rankings of the plain full scan, before the strength index existed.
+        expected = {
+            "Concor 5mg": ["Concor 5mg 30 tab", "Concor 2.5mg 30 tab", "Concor 10mg 30 tab", "Bisocor 5mg 20 tab"],
+            "Tareg 160mg": ["Tareg 160mg 14 tab", "Co-Tareg 160/12.5mg 14 f.c.tab", "Co-Tareg 80/12.5mg 14 f.c.tab"],
+            "Concor 10mg": ["Concor 10mg 30 tab", "Concor 5mg 30 tab", "Concor 2.5mg 30 tab"],
+            "cetal 250mg/5ml": ["Cetal 250mg/5ml syrup", "Cetal 500mg 20 tab"],
+        }
+        for query, names in expected.items():
+            ranked = matcher_v2._rank_candidates(query, self.names, limit=5)
+            self.assertEqual(self._row_names([idx for idx, _ in ranked]), names, query)
+
+    def test_restrict_scans_fewer_names_for_the_same_match(self):
+        for query in ("Concor 5mg", "Co targe 160/12.5", "Blockatens 160/10", "Panadol 500mg"):
+            restricted, restricted_work = self._rank_and_count(query, strength_mode="restrict")
+            included, included_work = self._rank_and_count(query, strength_mode="include")
+            self.assertEqual(restricted[0], included[0], query)
+            self.assertLess(restricted_work, included_work / 2, query)
+
+    def test_restrict_falls_back_to_full_scan_without_a_confident_match(self):
+        # No 5mg row is a Cetal, so the subset alone would offer Concor 5mg.
+        ranked, _ = self._rank_and_count("Cetal 5mg", strength_mode="restrict")
+        self.assertEqual(self._row_names([idx for idx, _ in ranked[:1]]), ["Cetal 500mg 20 tab"])
+        self.assertEqual(ranked, self._rank_and_count("Cetal 5mg", strength_mode="include")[0])
+
+    def test_strength_subsets_are_reused_across_queries(self):
+        names = matcher_v2._build_search_names(self.df)
+        with mock.patch.object(matcher_v2, "_subset_shard", side_effect=matcher_v2._subset_shard) as subset_shard:
+            for query in ("Concor 5mg", "Bisocor 5mg", "concor 5 mg"):
+                self._rank_and_count(query, names, strength_mode="restrict")
+        self.assertEqual(subset_shard.call_count, 1)
+
+
+class TestTypoIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = build_sample_catalog()
+        cls.names = matcher_v2._build_search_names(cls.df)
+
+    def _row_names(self, rows):
+        return [self.df.iloc[idx]["name_en"] for idx in rows]
+
+    def test_token_deletes_cover_single_edits(self):
+        self.assertEqual(matcher_v2._token_deletes("abc", 1), {"abc", "bc", "ac", "ab"})
+
+    def test_misspelled_tokens_find_catalog_tokens(self):
+        rows = matcher_v2._typo_candidate_rows({"targe"}, self.names)
+        self.assertEqual(
+            self._row_names(rows),
+            ["Co-Tareg 160/12.5mg 14 f.c.tab", "Co-Tareg 80/12.5mg 14 f.c.tab", "Tareg 160mg 14 tab"],
+        )
+        self.assertIsNone(matcher_v2._typo_candidate_rows({"zzzzzz"}, self.names))
+
+    def test_restrict_mode_ranks_only_typo_rows(self):
+        ranked = matcher_v2._rank_candidates("Blokatens", self.names, limit=5, typo_mode="restrict")
+        self.assertEqual(
+            sorted(self._row_names([idx for idx, _ in ranked])), ["Blockatens 160/10 mg 14 tab", "Blockatens 160/5 mg 14 tab"]
+        )
+
+    def test_include_mode_keeps_full_scan_ranking(self):
+        for query in QUERIES:
+            included = matcher_v2._rank_candidates(query, self.names, limit=5, typo_mode="include")
+            plain = matcher_v2._rank_candidates(query, self.names, limit=5, typo_mode="off")
+            self.assertEqual(included[:1], plain[:1], query)
+
+
+class TestFilterPushdown(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = build_sample_catalog()
+        cls.names = matcher_v2._build_search_names(cls.df)
+
+    def _filter(self, filters):
+        return matcher_v2._filter_rows(filters, self.names, self.df)
+
+    def test_no_active_filters_means_no_restriction(self):
+        self.assertIsNone(self._filter(None))
+        self.assertIsNone(self._filter({"status": "", "manufacturer": []}))
+
+    def test_value_filters_are_case_insensitive_and_combined(self):
+        rows = self._filter({"manufacturer": "merck", "status": "ACTIVE"})
+        self.assertEqual(self.df.iloc[rows]["name_en"].tolist(), ["Concor 5mg 30 tab", "Concor 10mg 30 tab"])
+
+    def test_value_lists_and_price_range(self):
+        rows = self._filter({"dosage_form": ["syrup", "capsule"], "price_retail": (None, 20)})
+        self.assertEqual(self.df.iloc[rows]["name_en"].tolist(), ["Cetal 250mg/5ml syrup"])
+
+    def test_lazy_facet_for_unindexed_field(self):
+        rows = self._filter({"active_ingredients": "Paracetamol"})
+        self.assertEqual(len(rows), 3)
+
+    def test_unknown_field_raises(self):
+        with self.assertRaises(ValueError):
+            self._filter({"colour": "red"})
+
+    def test_ranking_only_returns_allowed_rows(self):
+        allowed = self._filter({"manufacturer": "Pharco"})
+        ranked = matcher_v2._rank_candidates("Concor 5mg", self.names, limit=5, allowed_rows=allowed)
+        self.assertEqual([self.df.iloc[idx]["name_en"] for idx, _ in ranked], ["Bisocor 5mg 20 tab"])
+        self.assertEqual(matcher_v2._rank_candidates("Concor 5mg", self.names, allowed_rows=[]), [])
+
+
+class TestSearchResults(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = build_sample_catalog()
+        cls.names = matcher_v2._build_search_names(cls.df)
+
+    def setUp(self):
+        patcher = mock.patch.object(matcher_v2, "get_search_snapshot", return_value=(self.names, self.df))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_results_behave_like_row_dicts(self):
+        results = matcher_v2.search_live("Concor 5mg", limit=5)
+        self.assertIsInstance(results, matcher_v2.SearchResults)
+        self.assertEqual(results[0]["name_en"], "Concor 5mg 30 tab")
+        self.assertEqual(set(results[0]), set(self.df.columns) | {"_score"})
+        self.assertEqual([row["_score"] for row in results], results.scores)
+
+    def test_page_projects_columns_and_offsets(self):
+        results = matcher_v2.search_live("Concor", limit=10)
+        page = results.page(offset=1, limit=2, columns=["name_en"])
+        self.assertEqual(len(page), 2)
+        self.assertEqual(set(page[0]), {"name_en", "_score"})
+        self.assertEqual(page[0]["name_en"], results[1]["name_en"])
+
+    def test_search_columns_argument_and_frame(self):
+        results = matcher_v2.search_live("Cetal", limit=3, columns=["name_en", "price_retail"])
+        self.assertEqual(set(results[0]), {"name_en", "price_retail", "_score"})
+        frame = results.to_frame(limit=1)
+        self.assertEqual(frame.columns.tolist(), ["name_en", "price_retail", "_score"])
+        self.assertEqual(len(frame), 1)
+
+    def test_empty_query_returns_empty_results(self):
+        results = matcher_v2.search_live("")
+        self.assertFalse(results)
+        self.assertEqual(results.page(), [])
+
+
+class TestEquivalents(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = build_sample_catalog()
+        cls.names = matcher_v2._build_search_names(cls.df)
+
+    def setUp(self):
+        patcher = mock.patch.object(matcher_v2, "get_search_snapshot", return_value=(self.names, self.df))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _names(self, rows):
+        return [row["name_en"] for row in rows]
+
+    def test_ingredient_keys_ignore_order_case_and_doses(self):
+        self.assertEqual(matcher_v2._ingredient_key("Valsartan + Hydrochlorothiazide 160/12.5"), "hydrochlorothiazide+valsartan")
+        self.assertEqual(matcher_v2._ingredient_key("hydrochlorothiazide, valsartan"), "hydrochlorothiazide+valsartan")
+
+    def test_equivalents_of_matched_row_share_strength(self):
+        rows = matcher_v2.find_equivalents(row_pos=0)
+        self.assertEqual(self._names(rows), ["Bisocor 5mg 20 tab"])
+        self.assertEqual(rows[0]["_price"], 30.0)
+
+    def test_query_equivalents_ranked_by_price(self):
+        rows = matcher_v2.find_equivalents("bisoprolol", columns=["name_en"])
+        self.assertEqual(
+            self._names(rows), ["Bisocor 5mg 20 tab", "Concor 2.5mg 30 tab", "Concor 5mg 30 tab", "Concor 10mg 30 tab"]
+        )
+        self.assertEqual(self._names(matcher_v2.find_equivalents("paracetamol 500")), ["Cetal 500mg 20 tab", "Panadol 500mg 24 tab"])
+
+    def test_equivalents_respect_strength_and_filters(self):
+        rows = matcher_v2.find_equivalents("hydrochlorothiazide+valsartan 160/12.5")
+        self.assertEqual(self._names(rows), ["Co-Tareg 160/12.5mg 14 f.c.tab"])
+        rows = matcher_v2.find_equivalents("bisoprolol", filters={"status": "active"})
+        self.assertNotIn("Concor 2.5mg 30 tab", self._names(rows))
+
+
+class TestQueryGuards(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = build_sample_catalog()
+        cls.names = matcher_v2._build_search_names(cls.df)
+
+    def setUp(self):
+        patcher = mock.patch.object(matcher_v2, "get_search_snapshot", return_value=(self.names, self.df))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_expired_deadline_returns_flagged_partial_results(self):
+        before = matcher_v2.get_limit_counters()["deadline_expired"]
+        results = matcher_v2.search_live("Concor 5mg (concor merik)", limit=5, deadline=0)
+
+        self.assertTrue(results.partial)
+        self.assertTrue(results, "the first scan always completes")
+        self.assertEqual(matcher_v2.get_limit_counters()["deadline_expired"], before + 1)
+
+    def test_generous_deadline_matches_unbounded_search(self):
+        bounded = matcher_v2.search_live("Co targe 160/12.5", limit=5, deadline=60)
+        unbounded = matcher_v2.search_live("Co targe 160/12.5", limit=5)
+        self.assertFalse(bounded.partial)
+        self.assertEqual(bounded.row_ids, unbounded.row_ids)
+
+    def test_long_queries_are_truncated_and_variants_capped(self):
+        before = matcher_v2.get_limit_counters()
+        query = " ".join(f"(part{idx} drug)" for idx in range(60))
+        variants = matcher_v2._build_query_variants(query)
+        after = matcher_v2.get_limit_counters()
+
+        self.assertLessEqual(len(variants), matcher_v2.MAX_QUERY_VARIANTS)
+        self.assertEqual(after["query_truncated"], before["query_truncated"] + 1)
+        self.assertEqual(after["variants_capped"], before["variants_capped"] + 1)
+
+
+class TestCompactIndexEquivalence(unittest.TestCase):
+    QUERIES = [
+        "Concor 5mg",
+        "co tareg 160/12.5",
+        "Blockatens 160/5",
+        "panadol 500 mg tab",
+        "cetal syrup 250mg/5ml",
+        "كونكور 5",
+        "Augmentin 1g",
+        "brufen 400",
+        "nexium caps",
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = build_synthetic_catalog()
+        cls.compact = matcher_v2._build_search_names(cls.df)
+        cls.legacy = bench_index_memory.build_legacy_index(cls.df)
+        # The legacy layout had no prefilter lookups; compare the full-scan path on both.
+        cls.compact_scan = {
+            key: value for key, value in cls.compact.items() if key not in ("strength_index", "typo_index")
+        }
+
+    def test_rows_hold_the_same_metadata(self):
+        self.assertEqual(self.compact["en"], self.legacy["en"])
+        self.assertEqual(self.compact["ar"], self.legacy["ar"])
+        for idx in range(len(self.df)):
+            compact_sig = self.compact["strength"][idx]
+            legacy_sig = self.legacy["strength"][idx]
+            for key in ("ratios", "ratio_sets", "values", "numbers"):
+                self.assertEqual(compact_sig[key], legacy_sig[key], (idx, key))
+            self.assertEqual(self.compact["forms"][idx], self.legacy["forms"][idx], idx)
+            self.assertEqual(set(self.compact["alpha_tokens"][idx]), set(self.legacy["alpha_tokens"][idx]), idx)
+
+    def test_strength_adjustments_match(self):
+        for query in self.QUERIES:
+            query_sig = matcher_v2._extract_strength_signature(query)
+            for compact_sig, legacy_sig in zip(self.compact["strength"], self.legacy["strength"]):
+                self.assertEqual(
+                    matcher_v2._strength_adjustment(query_sig, compact_sig),
+                    matcher_v2._strength_adjustment(query_sig, legacy_sig),
+                    query,
+                )
+
+    def test_candidates_and_scores_match(self):
+        for query in self.QUERIES:
+            variants = matcher_v2._build_query_variants(query)
+            prefer_arabic = matcher_v2.is_arabic(query)
+            self.assertEqual(
+                matcher_v2._prefilter_candidates(variants, self.compact_scan, prefer_arabic, limit=90),
+                matcher_v2._prefilter_candidates(variants, self.legacy, prefer_arabic, limit=90),
+                query,
+            )
+            compact_ranked = matcher_v2._rank_candidates(query, self.compact_scan, limit=20, typo_mode="off")
+            self.assertTrue(compact_ranked, query)
+            self.assertEqual(
+                compact_ranked, matcher_v2._rank_candidates(query, self.legacy, limit=20, typo_mode="off"), query
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
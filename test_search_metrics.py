@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+import urllib.request
+from unittest import mock
+
+import matcher_v2
+import search_metrics
+from test_search_index import build_sample_catalog
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_disabled_registry_records_nothing(self):
+        registry = search_metrics.MetricsRegistry(enabled=False)
+        counter = registry.counter("demo_total", "Demo counter.")
+        histogram = registry.histogram("demo_seconds", "Demo histogram.")
+        counter.inc()
+        histogram.observe(0.2)
+
+        self.assertEqual(counter.value(), 0)
+        self.assertEqual(histogram.count(), 0)
+
+    def test_text_exposition_format(self):
+        registry = search_metrics.MetricsRegistry(enabled=True)
+        counter = registry.counter("demo_total", "Demo counter.", labelnames=("kind",))
+        histogram = registry.histogram("demo_seconds", "Demo histogram.", buckets=(0.1, 1))
+        counter.inc(kind="hit")
+        counter.inc(2, kind="miss")
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+
+        text = registry.render()
+        self.assertIn("# TYPE demo_total counter", text)
+        self.assertIn('demo_total{kind="hit"} 1', text)
+        self.assertIn('demo_total{kind="miss"} 2', text)
+        self.assertIn('demo_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('demo_seconds_bucket{le="1"} 2', text)
+        self.assertIn('demo_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn("demo_seconds_count 2", text)
+
+    def test_file_and_http_export(self):
+        registry = search_metrics.MetricsRegistry(enabled=True)
+        registry.counter("demo_total", "Demo counter.").inc()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "henedy.prom")
+            registry.write(path)
+            with open(path, encoding="utf-8") as f:
+                self.assertIn("demo_total 1", f.read())
+
+        server = registry.serve(port=0)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            self.assertIn("demo_total 1", response.read().decode("utf-8"))
+
+    def test_failed_bind_leaves_metrics_off_and_is_reported_once(self):
+        owner = search_metrics.MetricsRegistry().serve(port=0)
+        self.addCleanup(owner.shutdown)
+        registry = search_metrics.MetricsRegistry()
+        env = {"HENEDY_METRICS_PORT": str(owner.server_address[1])}
+
+        with mock.patch.object(search_metrics, "REGISTRY", registry), mock.patch.dict(os.environ, env), mock.patch(
+            "builtins.print"
+        ) as printed:
+            for _ in range(3):  # Streamlit calls this on every rerun.
+                search_metrics.start_from_env()
+
+        self.assertFalse(registry.enabled)
+        self.assertEqual(printed.call_count, 1)
+
+
+class TestMatcherInstrumentation(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = build_sample_catalog()
+        cls.names = matcher_v2._build_search_names(cls.df)
+
+    def setUp(self):
+        for patcher in (
+            mock.patch.object(matcher_v2, "get_search_snapshot", return_value=(self.names, self.df)),
+            mock.patch.object(search_metrics.REGISTRY, "enabled", True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_search_live_updates_latency_and_pool_histograms(self):
+        searches = matcher_v2._M_SEARCH_LATENCY.count(partial="false")
+        pools = matcher_v2._M_CANDIDATE_POOL.count()
+        matcher_v2.search_live("Concor 5mg", limit=5)
+
+        self.assertEqual(matcher_v2._M_SEARCH_LATENCY.count(partial="false"), searches + 1)
+        self.assertEqual(matcher_v2._M_CANDIDATE_POOL.count(), pools + 1)
+
+    def test_query_guards_feed_limit_counter(self):
+        before = matcher_v2._M_QUERY_LIMITS.value(limit="deadline_expired")
+        matcher_v2.search_live("Concor 5mg", limit=5, deadline=0)
+        self.assertEqual(matcher_v2._M_QUERY_LIMITS.value(limit="deadline_expired"), before + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
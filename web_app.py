@@ -1,11 +1,16 @@
-﻿import json
-import os
+﻿import os
 import tempfile
+import uuid
 
 import pandas as pd  # type: ignore
 import streamlit as st  # type: ignore
 
+import batch_io  # type: ignore
+import batch_jobs  # type: ignore
 import matcher_v2  # type: ignore
+import result_writers  # type: ignore
+import search_metrics  # type: ignore
+import startup  # type: ignore
 
 
 # Page Config
@@ -113,21 +118,142 @@ def _remove_temp_upload(path):
             pass
 
 
-def _get_temp_upload_path(uploaded_file):
-    file_signature = (uploaded_file.name, uploaded_file.size)
-    previous_signature = st.session_state.get("upload_signature")
-    previous_path = st.session_state.get("upload_temp_path")
+@st.cache_data(ttl=300, show_spinner=False)
+def _filter_options(field):
+    return matcher_v2.get_filter_values(field)
+
 
-    if previous_signature != file_signature or not previous_path or not os.path.exists(previous_path):
-        _remove_temp_upload(previous_path)
+def _render_filter_controls(available_cols, key_prefix):
+    """Draws catalog filter pickers and returns the filters dict for matcher_v2."""
+    filters = {}
+    facet_fields = [field for field in matcher_v2.FILTER_FIELDS if field in available_cols]
+    filter_cols = st.columns(max(1, len(facet_fields)))
+    for col, field in zip(filter_cols, facet_fields):
+        with col:
+            selected = st.multiselect(
+                field.replace("_", " ").title(),
+                _filter_options(field),
+                key=f"{key_prefix}_{field}",
+            )
+            if selected:
+                filters[field] = selected
+
+    if "price_retail" in available_cols:
+        price_min_col, price_max_col = st.columns(2)
+        with price_min_col:
+            price_min = st.number_input("Min Retail Price", min_value=0.0, value=0.0, key=f"{key_prefix}_price_min")
+        with price_max_col:
+            price_max = st.number_input("Max Retail Price (0 = no limit)", min_value=0.0, value=0.0, key=f"{key_prefix}_price_max")
+        if price_min or price_max:
+            filters["price_retail"] = (price_min or None, price_max or None)
+    return filters
+
+
+def _upload_signature(uploaded_file):
+    # Hash the bytes once per upload widget value; reruns reuse the digest.
+    widget_key = (uploaded_file.name, uploaded_file.size, getattr(uploaded_file, "file_id", None))
+    cached = st.session_state.get("upload_hash")
+    if widget_key[2] is not None and cached and cached[0] == widget_key:
+        return cached[1]
+    signature = batch_io.upload_signature(uploaded_file.name, uploaded_file.getbuffer())
+    st.session_state["upload_hash"] = (widget_key, signature)
+    return signature
+
+
+def _clear_upload():
+    parsed = st.session_state.pop("upload_parsed", None)
+    if parsed is not None:
+        parsed.close()  # Release the workbook before deleting it (Windows keeps it locked).
+    _remove_temp_upload(st.session_state.pop("upload_temp_path", None))
+    st.session_state.pop("upload_signature", None)
+
+
+def _get_parsed_upload(uploaded_file):
+    """Returns this session's ParsedUpload, writing and parsing the file only when it changes."""
+    file_signature = _upload_signature(uploaded_file)
+    previous_path = st.session_state.get("upload_temp_path")
+    parsed = st.session_state.get("upload_parsed")
+
+    if (
+        st.session_state.get("upload_signature") != file_signature
+        or parsed is None
+        or not previous_path
+        or not os.path.exists(previous_path)
+    ):
+        _clear_upload()
         suffix = os.path.splitext(uploaded_file.name)[1] or ".tmp"
         with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, prefix="henedy_upload_") as tmp_file:
             tmp_file.write(uploaded_file.getbuffer())
             new_path = tmp_file.name
+        parsed = batch_io.ParsedUpload(new_path, file_signature)
         st.session_state["upload_signature"] = file_signature
         st.session_state["upload_temp_path"] = new_path
+        st.session_state["upload_parsed"] = parsed
+
+    return parsed
+
+
+def _batch_owner():
+    """Identifies this browser's batch jobs; kept in the URL so a page reload still finds them."""
+    params = getattr(st, "query_params", None)
+    owner = st.session_state.get("batch_owner") or (params.get("jobs") if params is not None else None)
+    if not owner:
+        owner = uuid.uuid4().hex[:16]
+    st.session_state["batch_owner"] = owner
+    if params is not None and params.get("jobs") != owner:
+        params["jobs"] = owner
+    return owner
+
 
-    return st.session_state.get("upload_temp_path")
+def _render_batch_job(job_queue, job):
+    st.markdown(f"**{job.input_name}** &nbsp; `{job.id}` &nbsp; {job.status.title()}")
+    if not job.finished_state:
+        if job.telemetry is not None:
+            rows = f" ({job.telemetry.describe()})"
+        else:
+            rows = f" ({job.done_rows}/{job.total_rows} rows)" if job.total_rows else ""
+        st.progress(job.progress, text=f"{job.message}{rows}")
+        st.button("Cancel", key=f"cancel_{job.id}", on_click=job_queue.cancel, args=(job.id,))
+        return
+
+    if job.status == batch_jobs.DONE:
+        st.success(job.message)
+        if job.preview is not None:
+            with st.expander(f"Results Preview (Top {batch_jobs.PREVIEW_ROWS})"):
+                fixed_cols = ["search_query", "match_found", "match_score"]
+                preview_cols = [col for col in fixed_cols + job.options["db_fields"] if col in job.preview.columns]
+                st.dataframe(job.preview[preview_cols], use_container_width=True, hide_index=True)
+        if job.output_path and os.path.exists(job.output_path):
+            with open(job.output_path, "rb") as f_out:
+                st.download_button(
+                    label="Download Full Matched File",
+                    data=f_out,
+                    file_name=os.path.basename(job.output_path),
+                    mime=result_writers.output_mime_type(job.options["output_format"]),
+                    key=f"download_{job.id}",
+                )
+        else:
+            st.warning("The output file has expired or could not be found on disk.")
+    elif job.status == batch_jobs.FAILED:
+        st.error(f"An error occurred during processing: {job.error}")
+    else:
+        st.info(job.message)
+    st.button("Remove", key=f"remove_{job.id}", on_click=job_queue.remove, args=(job.id,))
+
+
+def _render_batch_jobs(owner):
+    job_queue = batch_jobs.get_queue()
+    jobs = job_queue.jobs(owner)
+    if not jobs:
+        return
+    for job in jobs:
+        with st.container():
+            _render_batch_job(job_queue, job)
+            st.markdown("---")
+    # Once everything has finished, stop the fragment's polling with one full rerun.
+    if st.session_state.get("batch_jobs_active") and all(job.finished_state for job in jobs):
+        st.session_state["batch_jobs_active"] = False
+        st.rerun()
 
 
 # Sidebar
@@ -150,19 +276,34 @@ st.sidebar.markdown("---")
 page = st.sidebar.radio("Navigation", ["File Wizard", "Manual Search"])
 
 
-@st.cache_resource
+# Build the search index in the background so the first query does not pay for it,
+# and rebuild it whenever druglist.json changes on disk. Metrics are exported only
+# when HENEDY_METRICS_PORT / HENEDY_METRICS_FILE are set.
+matcher_v2.start_background_warmup()
+matcher_v2.start_catalog_watcher()
+search_metrics.start_from_env()
+
+
 def load_db():
-    try:
-        return matcher_v2.get_master_db()
-    except Exception:
-        return pd.DataFrame()
+    # matcher_v2 caches the table itself; asking it on every rerun picks up hot reloads.
+    # Never block the page on the first load: the warm-up thread is already loading it.
+    return matcher_v2.get_loaded_catalog()
 
 
 db_df = load_db()
-if not db_df.empty:
+if db_df is not None and not db_df.empty:
+    startup.mark("catalog_ready")
     st.sidebar.success(f"Data Active: {len(db_df)} records")
+elif db_df is None and matcher_v2.get_warmup_error() is not None:
+    st.sidebar.error(f"Failed to load database: {matcher_v2.get_warmup_error()}")
+    db_df = pd.DataFrame()
+elif db_df is None and (matcher_v2.SHARED_INDEX_DIR or os.path.exists(matcher_v2.DB_JSON)):
+    st.sidebar.info("Loading database in the background...")
+    db_df = pd.DataFrame()
 else:
     st.sidebar.error("Database (druglist.json) missing")
+    db_df = pd.DataFrame()
+startup.mark("ui_ready")
 
 
 # --- FILE WIZARD PAGE ---
@@ -187,34 +328,31 @@ if page == "File Wizard":
         )
 
     if not uploaded_file:
-        _remove_temp_upload(st.session_state.get("upload_temp_path"))
-        st.session_state.pop("upload_signature", None)
-        st.session_state.pop("upload_temp_path", None)
+        _clear_upload()
+        st.session_state.pop("upload_hash", None)
 
     if uploaded_file:
-        temp_input_path = _get_temp_upload_path(uploaded_file)
-        if not temp_input_path:
+        try:
+            parsed_upload = _get_parsed_upload(uploaded_file)
+        except OSError:
             st.error("Could not prepare uploaded file for processing.")
             st.stop()
+        temp_input_path = parsed_upload.path
 
-        # For Excel files, show sheet selector.
+        # For Excel files, show sheet selector. Sheets, headers, previews and the
+        # matching run below all read through the one workbook held by parsed_upload.
         selected_sheet = 0
-        is_excel = uploaded_file.name.lower().endswith(".xlsx")
-        if is_excel:
-            sheets = matcher_v2.get_excel_sheets(temp_input_path)
-            if len(sheets) > 1:
-                st.subheader("Select Excel Sheet")
-                selected_sheet = st.selectbox("Choose the sheet to process:", sheets, help="Select the specific sheet from your Excel file")
-
-        # Load Headers.
         try:
-            if is_excel:
-                df_preview = pd.read_excel(temp_input_path, sheet_name=selected_sheet, nrows=0)
-            else:
-                df_preview = matcher_v2.safe_read_csv(temp_input_path, nrows=0)
-
-            df_preview.columns = df_preview.columns.str.strip()
-            headers = df_preview.columns.tolist()
+            if parsed_upload.is_excel:
+                sheets = parsed_upload.sheet_names
+                if len(sheets) > 1:
+                    st.subheader("Select Excel Sheet")
+                    selected_sheet = st.selectbox(
+                        "Choose the sheet to process:", sheets, help="Select the specific sheet from your Excel file"
+                    )
+
+            # Load Headers.
+            headers = parsed_upload.headers(selected_sheet)
         except Exception as e:
             st.error(f"Error reading file: {e}")
             st.stop()
@@ -240,12 +378,7 @@ if page == "File Wizard":
             )
 
             try:
-                if is_excel:
-                    df_col_preview = pd.read_excel(temp_input_path, sheet_name=selected_sheet, usecols=[search_col], nrows=5)
-                else:
-                    df_col_preview = matcher_v2.safe_read_csv(temp_input_path, usecols=[search_col], nrows=5)
-
-                values = df_col_preview[search_col].astype(str).tolist()
+                values = parsed_upload.preview(search_col, selected_sheet)
                 if values:
                     st.caption(f"Preview of '{search_col}': {', '.join(values[:5])}")
             except Exception:
@@ -253,7 +386,13 @@ if page == "File Wizard":
 
         with col2:
             st.write("Output Format")
-            out_fmt = st.radio("Format", ["xlsx", "json"], horizontal=True, label_visibility="collapsed")
+            out_fmt = st.radio(
+                "Format",
+                list(result_writers.OUTPUT_FORMATS),
+                format_func=lambda fmt: result_writers.OUTPUT_FORMATS[fmt][0],
+                horizontal=True,
+                label_visibility="collapsed",
+            )
 
         # Columns Selection
         st.markdown("#### Column Mapping")
@@ -263,64 +402,56 @@ if page == "File Wizard":
             local_cols = st.multiselect("Select columns to preserve", headers, default=headers)
 
         with tabs[1]:
-            try:
-                with open("config.json", "r", encoding="utf-8") as f_config:
-                    config_data = json.load(f_config).get("fields", [])
-                    db_keys = [field_info["key"] for field_info in config_data]
-            except Exception:
+            db_keys = [field_info["key"] for field_info in startup.load_config_fields() if "key" in field_info]
+            if not db_keys:
                 db_keys = db_df.columns.tolist() if not db_df.empty else []
 
             default_db = ["name_en", "price_retail", "price_wholesale", "barcode_primary"]
             default_db = [col for col in default_db if col in db_keys]
             db_cols = st.multiselect("Select columns to append", db_keys, default=default_db)
 
+        match_filters = {}
+        if not db_df.empty:
+            with st.expander("Restrict Matches (optional)"):
+                st.caption("Only catalog items passing these filters can be matched.")
+                match_filters = _render_filter_controls(db_df.columns.tolist(), "wizard_filter")
+
         st.markdown("---")
         # Step 3: Process
         st.subheader("3. Execution")
         if st.button("Start Matching Process"):
-            msg_placeholder = st.empty()
-            progress_bar = st.progress(0)
-
-            def update_progress(curr, total):
-                progress_bar.progress(curr / total)
-
-            def update_status(msg):
-                msg_placeholder.info(f"Status: {msg}")
-
+            # Runs on the shared job queue (the input is streamed there from a private
+            # copy), so this session stays responsive and the job survives reruns.
             try:
-                output_path, final_df = matcher_v2.run_matching_v2(
+                job_id = batch_jobs.get_queue().submit(
                     temp_input_path,
-                    search_col,
-                    local_cols,
-                    db_cols,
-                    out_fmt,
+                    uploaded_file.name,
+                    owner=_batch_owner(),
+                    search_col=search_col,
+                    local_fields=local_cols,
+                    db_fields=db_cols,
+                    output_format=out_fmt,
                     sheet_name=selected_sheet,
-                    progress_callback=update_progress,
-                    status_callback=update_status,
+                    filters=match_filters,
                 )
-
-                st.success("Processing complete. Previewing top rows below.")
-
-                # --- RESULTS PREVIEW ---
-                st.subheader("Results Preview (Top 50)")
-                preview_cols = [col for col in (["search_query", "match_found", "match_score"] + db_cols) if col in final_df.columns]
-                st.dataframe(final_df[preview_cols].head(50), use_container_width=True, hide_index=True)
-
-                st.markdown("---")
-                if os.path.exists(output_path):
-                    with open(output_path, "rb") as f_out:
-                        st.download_button(
-                            label="Download Full Matched File",
-                            data=f_out,
-                            file_name=os.path.basename(output_path),
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                            if out_fmt == "xlsx"
-                            else "application/json",
-                        )
-                else:
-                    st.warning("Output file was generated in memory but could not be found on disk.")
-            except Exception as e:
-                st.error(f"An error occurred during processing: {e}")
+                st.session_state["batch_jobs_active"] = True
+                st.success(f"Queued matching job {job_id}.")
+            except OSError as e:
+                st.error(f"Could not queue the job: {e}")
+
+    # Step 4: this browser's queued, running and finished jobs.
+    owner = _batch_owner()
+    if batch_jobs.get_queue().jobs(owner):
+        st.subheader("4. Jobs")
+        fragment = getattr(st, "fragment", None)
+        active = any(not job.finished_state for job in batch_jobs.get_queue().jobs(owner))
+        st.session_state["batch_jobs_active"] = active
+        if fragment is not None and active:
+            fragment(run_every=2)(_render_batch_jobs)(owner)
+        else:
+            _render_batch_jobs(owner)
+            if active:
+                st.button("Refresh job status")
 
 
 # --- MANUAL SEARCH PAGE ---
@@ -341,29 +472,33 @@ elif page == "Manual Search":
         if not db_df.empty:
             all_cols = db_df.columns.tolist()
         else:
-            try:
-                with open("config.json", "r", encoding="utf-8") as f_conf:
-                    config_fields = json.load(f_conf).get("fields", [])
-                    all_cols = [field_obj["key"] for field_obj in config_fields]
-            except Exception:
-                all_cols = []
+            all_cols = [field_obj["key"] for field_obj in startup.load_config_fields() if "key" in field_obj]
 
         defaults = ["name_en", "price_retail", "price_wholesale", "barcode_primary", "manufacturer", "_score"]
         defaults = [col for col in defaults if col in all_cols or col == "_score"]
         show_cols = st.multiselect("Visible Columns", all_cols + ["_score"], default=defaults)
 
+    search_filters = {}
+    if not db_df.empty:
+        with st.expander("Filters"):
+            search_filters = _render_filter_controls(db_df.columns.tolist(), "search_filter")
+
     if query:
         with st.spinner("Searching..."):
-            results = matcher_v2.search_live(query, limit=50)
+            results = matcher_v2.search_live(query, limit=50, filters=search_filters)
 
         if results:
-            res_df = pd.DataFrame(results)
+            # Only the visible catalog columns are materialized from the ranked ids.
+            projected_cols = [col for col in show_cols if col != "_score"]
+            res_df = results.to_frame(columns=projected_cols or None)
             valid_cols = [col for col in show_cols if col in res_df.columns]
             if not valid_cols:
                 fallback_cols = [col for col in ["name_en", "name_ar", "_score"] if col in res_df.columns]
                 valid_cols = fallback_cols if fallback_cols else res_df.columns.tolist()
 
             st.markdown(f"**Found {len(results)} matches:**")
+            if results.partial:
+                st.caption("Search time limit reached: showing the best matches found so far.")
             st.dataframe(res_df[valid_cols], use_container_width=True, hide_index=True)
 
             # Export helpers